@@ -1,57 +1,347 @@
-from flask import Flask, request, render_template, session, redirect, url_for, flash, jsonify, send_file
-from pymongo import MongoClient
+from flask import Flask, request, render_template, session, redirect, url_for, flash, jsonify, send_file, Response, has_request_context
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 from bson import ObjectId
-from datetime import datetime, timezone
-import bcrypt
+from datetime import datetime, timezone, timedelta
 import os
 import re
 import uuid
 from werkzeug.utils import secure_filename
+from urllib.parse import urlparse
 import mimetypes
+import json
+import base64
+import hashlib
+from pubsub import DEFAULT_SOCKET_PATH, InProcessBroker, create_backend
+from migrations import run_migrations, TOMBSTONE_RETENTION_DAYS, STALE_UPLOAD_HOURS
+import chunked_uploads
+import search
+import thumbnails
+from cache import MongoCacheStore, TTLCache, VersionedCache
+from group_commit import GroupCommitWriter
+from gateway import Gateway
+from jobs import JobQueue
+from passwords import AttemptThrottle, HasherBusy, PasswordHasher
+from presence import PresenceTracker
+from db_metrics import CommandMonitor, PoolMonitor, begin_request, end_request, current_request_stats
+from metrics import Registry, DEFAULT_COUNT_BUCKETS
+from structured_logging import configure_logging, parse_levels
+from websocket import ProtocolError, UpgradedResponse, WebSocket
+import click
+import logging
+import time
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 
+def log_context():
+    """Request fields attached to every log record"""
+    if not has_request_context():
+        return None
+    return {
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'user_id': session.get('user_id')
+    }
+
+# Structured JSON logging, written by a background thread
+# LOG_LEVELS takes per-logger overrides, e.g. "chatflow.jobs=DEBUG,chatflow=WARNING"
+log_handler, log_listener = configure_logging(
+    'chatflow',
+    level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+    levels=parse_levels(os.environ.get('LOG_LEVELS')),
+    debug_sample_rate=float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', 0.01)),
+    queue_size=int(os.environ.get('LOG_QUEUE_SIZE', 10000)),
+    context=log_context
+)
+logger = logging.getLogger('chatflow.app')
+
 # File upload configuration
 UPLOAD_FOLDER = os.path.abspath('uploads')
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'mp4', 'avi', 'mov', 'mp3', 'wav', 'ogg', 'webm', 'm4a', 'aac', 'flac', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx'}
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
 
+# Message pagination configuration
+MESSAGE_PAGE_SIZE = 50
+MAX_MESSAGE_PAGE_SIZE = 200
+CONVERSATION_PAGE_SIZE = 50
+
+# Incremental sync configuration
+SYNC_MAX_MESSAGES = 500
+SYNC_OVERLAP_SECONDS = 2  # re-read window that covers writes still in flight
+
+# Live delivery configuration
+STREAM_HEARTBEAT_SECONDS = 15
+broker = InProcessBroker()
+
+# Cross-worker pub/sub: inprocess (one worker), unix (workers on one host) or mongo (several hosts)
+PUBSUB_BACKEND = os.environ.get('PUBSUB_BACKEND', 'inprocess')
+PUBSUB_SOCKET = os.environ.get('PUBSUB_SOCKET', DEFAULT_SOCKET_PATH)
+PUBSUB_COLLECTION = 'pubsub_events'
+
+# WebSocket gateway: one connection per client for messages, typing and acks
+WS_HEARTBEAT_SECONDS = 20
+WS_IDLE_TIMEOUT = 60  # no frames (pongs included) for this long closes the connection
+WS_MAX_QUEUE = 256  # outbound frames buffered per connection before it counts as slow
+WS_MAX_MESSAGE_SIZE = 64 * 1024
+WS_MAX_SUBSCRIPTIONS = 100
+gateway = Gateway(heartbeat_seconds=WS_HEARTBEAT_SECONDS, idle_timeout=WS_IDLE_TIMEOUT, max_queue=WS_MAX_QUEUE)
+
+# Presence: pages heartbeat every PRESENCE_HEARTBEAT_SECONDS; status changes are
+# collected and pushed to conversation partners every PRESENCE_FLUSH_SECONDS
+PRESENCE_HEARTBEAT_SECONDS = 30
+PRESENCE_OFFLINE_SECONDS = 75  # missed heartbeats before a user counts as offline
+PRESENCE_AWAY_SECONDS = 300  # heartbeats without activity before a user counts as away
+PRESENCE_FLUSH_SECONDS = float(os.environ.get('PRESENCE_FLUSH_SECONDS', 2))
+PRESENCE_MAX_IDS = 200
+presence = PresenceTracker(away_after=PRESENCE_AWAY_SECONDS, offline_after=PRESENCE_OFFLINE_SECONDS)
+
+# Resumable chunked uploads
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB suggested to clients
+MAX_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+PARTIAL_UPLOAD_FOLDER = os.path.join(UPLOAD_FOLDER, 'partial')
+HASH_BLOCK_SIZE = 64 * 1024
+# A blob delete claimed longer ago than this is assumed abandoned and may be taken over
+BLOB_DELETE_TIMEOUT = 30
+BLOB_DELETE_POLL_SECONDS = 0.05
+
+# Uploaded files never change once stored, so clients may cache them for a year
+UPLOAD_SUBFOLDERS = ('images', 'videos', 'audio', 'documents')
+UPLOAD_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+# Conversation membership checks, cached per (user, conversation)
+MEMBERSHIP_CACHE_SIZE = 50000
+MEMBERSHIP_CACHE_TTL = 300
+membership_cache = TTLCache(maxsize=MEMBERSHIP_CACHE_SIZE, ttl=MEMBERSHIP_CACHE_TTL)
+participants_cache = TTLCache(maxsize=MEMBERSHIP_CACHE_SIZE, ttl=MEMBERSHIP_CACHE_TTL)
+
+# Each user's dashboard data, cached under a version that every write to their conversations bumps
+# DASHBOARD_CACHE_SHARED=true also keeps versions and values in MongoDB for other workers
+DASHBOARD_CACHE_BYTES = int(os.environ.get('DASHBOARD_CACHE_BYTES', 64 * 1024 * 1024))
+DASHBOARD_CACHE_TTL = 300
+DASHBOARD_CACHE_SHARED = os.environ.get('DASHBOARD_CACHE_SHARED', 'false').lower() == 'true'
+
+# bcrypt runs on a bounded pool; requests get a 503 instead of queueing behind a login burst
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+password_hasher = PasswordHasher(
+    rounds=BCRYPT_ROUNDS,
+    workers=int(os.environ.get('BCRYPT_WORKERS', 4)),
+    max_pending=int(os.environ.get('BCRYPT_MAX_PENDING', 16))
+)
+HASHER_BUSY_RETRY_SECONDS = 1
+
+# Failed logins allowed per client IP and per account before they are throttled
+LOGIN_IP_ATTEMPTS = int(os.environ.get('LOGIN_IP_ATTEMPTS', 20))
+LOGIN_IP_WINDOW = int(os.environ.get('LOGIN_IP_WINDOW', 300))
+LOGIN_ACCOUNT_ATTEMPTS = int(os.environ.get('LOGIN_ACCOUNT_ATTEMPTS', 5))
+LOGIN_ACCOUNT_WINDOW = int(os.environ.get('LOGIN_ACCOUNT_WINDOW', 900))
+login_ip_throttle = AttemptThrottle(LOGIN_IP_ATTEMPTS, LOGIN_IP_WINDOW)
+login_account_throttle = AttemptThrottle(LOGIN_ACCOUNT_ATTEMPTS, LOGIN_ACCOUNT_WINDOW)
+
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
 
 # Create upload directories and verify permissions
-for folder_dir in ['images', 'videos', 'audio', 'documents']:
+for folder_dir in ['images', 'videos', 'audio', 'documents', 'partial']:
     folder_path = os.path.join(UPLOAD_FOLDER, folder_dir)
     try:
         os.makedirs(folder_path, exist_ok=True)
         if not os.access(folder_path, os.W_OK):
             raise PermissionError(f"Directory {folder_path} is not writable")
     except Exception as e:
-        print(f"Error creating folder {folder_path}: {e}")
+        logger.error("Error creating folder %s: %s", folder_path, e)
         continue
 
+# Request and database metrics, served at /metrics in Prometheus format
+QUERY_COUNT_WARNING = int(os.environ.get('QUERY_COUNT_WARNING', 20))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+metrics_registry = Registry()
+REQUEST_LATENCY = metrics_registry.histogram(
+    'chatflow_request_duration_seconds', 'Request latency by endpoint', ['endpoint', 'method']
+)
+REQUESTS = metrics_registry.counter(
+    'chatflow_requests_total', 'Requests by endpoint and status', ['endpoint', 'method', 'status']
+)
+REQUEST_COMMANDS = metrics_registry.histogram(
+    'chatflow_request_mongo_commands', 'MongoDB commands issued per request', ['endpoint'],
+    buckets=DEFAULT_COUNT_BUCKETS
+)
+REQUEST_MONGO_TIME = metrics_registry.histogram(
+    'chatflow_request_mongo_seconds', 'Time spent in MongoDB per request', ['endpoint']
+)
+QUERY_COUNT_WARNINGS = metrics_registry.counter(
+    'chatflow_query_count_warnings_total', 'Requests over QUERY_COUNT_WARNING commands', ['endpoint']
+)
+UPLOAD_BYTES_SENT = metrics_registry.counter(
+    'chatflow_uploaded_file_bytes_sent_total', 'Bytes of uploaded files sent to clients', ['status']
+)
+CACHE_LOOKUPS = metrics_registry.gauge(
+    'chatflow_cache_lookups', 'In-process cache lookups since start', ['cache', 'result']
+)
+CACHE_ENTRIES = metrics_registry.gauge('chatflow_cache_entries', 'In-process cache size', ['cache'])
+CACHE_BYTES = metrics_registry.gauge('chatflow_cache_bytes', 'Approximate memory held by a sized cache', ['cache'])
+LOG_RECORDS_DROPPED = metrics_registry.gauge(
+    'chatflow_log_records_dropped', 'Log records dropped because the log queue was full'
+)
+WS_CONNECTIONS = metrics_registry.gauge('chatflow_ws_connections', 'Open WebSocket connections')
+WS_FRAMES = metrics_registry.gauge('chatflow_ws_frames', 'WebSocket frames received since start by type', ['type'])
+WS_DROPPED = metrics_registry.gauge(
+    'chatflow_ws_dropped_frames', 'Droppable frames skipped for slow consumers on open connections'
+)
+PUBSUB_MESSAGES = metrics_registry.gauge(
+    'chatflow_pubsub_messages', 'Messages exchanged with other workers since start', ['direction']
+)
+PUBSUB_DROPPED = metrics_registry.gauge(
+    'chatflow_pubsub_dropped', 'Messages not sent to other workers because the backend was unavailable'
+)
+PUBSUB_CONNECTED = metrics_registry.gauge('chatflow_pubsub_connected', 'Whether the pub/sub backend is connected')
+PRESENCE_USERS = metrics_registry.gauge('chatflow_presence_users', 'Users with a live presence heartbeat')
+PRESENCE_CHANGES = metrics_registry.counter(
+    'chatflow_presence_changes_total', 'Coalesced presence status changes fanned out'
+)
+AUTH_REJECTED = metrics_registry.counter(
+    'chatflow_auth_rejected_total', 'Logins and registrations refused before bcrypt ran', ['reason']
+)
+command_monitor = CommandMonitor(metrics_registry)
+pool_monitor = PoolMonitor(metrics_registry)
+
 # MongoDB connection
 try:
-    client = MongoClient('mongodb://localhost:27017/')
+    client = MongoClient('mongodb://localhost:27017/', event_listeners=[command_monitor, pool_monitor])
     db = client['chat_app']
     users = db['users']
     messages = db['messages']
     conversations = db['conversations']
+    message_tombstones = db['message_tombstones']
+    upload_sessions = db['upload_sessions']
+    blobs = db['blobs']
+    jobs = db['jobs']
     # Test connection
     client.admin.command('ping')
-    print("Connected to MongoDB successfully!")
+    logger.info("Connected to MongoDB successfully!")
 except Exception as e:
-    print(f"Failed to connect to MongoDB: {e}")
+    logger.error("Failed to connect to MongoDB: %s", e)
+
+pubsub_backend = create_backend(PUBSUB_BACKEND, socket_path=PUBSUB_SOCKET, collection=db[PUBSUB_COLLECTION])
+dashboard_cache = VersionedCache(
+    max_bytes=DASHBOARD_CACHE_BYTES,
+    ttl=DASHBOARD_CACHE_TTL,
+    store=MongoCacheStore(db['cache_versions'], db['dashboard_cache']) if DASHBOARD_CACHE_SHARED else None
+)
+
+# Optional group commit for message writes (WRITE_COALESCE_WINDOW_MS=0 disables it)
+WRITE_COALESCE_WINDOW_MS = float(os.environ.get('WRITE_COALESCE_WINDOW_MS', 0))
+WRITE_COALESCE_MAX_BATCH = int(os.environ.get('WRITE_COALESCE_MAX_BATCH', 100))
+message_writer = None
+if WRITE_COALESCE_WINDOW_MS > 0:
+    message_writer = GroupCommitWriter(
+        messages, conversations, window_ms=WRITE_COALESCE_WINDOW_MS, max_batch=WRITE_COALESCE_MAX_BATCH
+    )
+
+# Background jobs (set JOB_WORKERS=0 to only run them via `flask run-jobs`)
+job_queue = JobQueue(jobs, workers=int(os.environ.get('JOB_WORKERS', 2)))
+if job_queue.workers > 0:
+    job_queue.start()
+
+@app.cli.command('run-jobs')
+def run_jobs_command():
+    """Run every background job that is currently due"""
+    click.echo(f"Ran {job_queue.run_pending()} jobs")
+
+# Create indexes and apply schema migrations (set AUTO_MIGRATE=false to run them separately)
+if os.environ.get('AUTO_MIGRATE', 'true').lower() != 'false':
+    try:
+        run_migrations(db)
+    except Exception:
+        logger.exception("Failed to apply database migrations")
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Create indexes and apply pending schema migrations"""
+    run_migrations(db)
+
+# Request instrumentation
+@app.before_request
+def start_request_metrics():
+    request.metrics_started = time.perf_counter()
+    begin_request()
+
+@app.after_request
+def record_request_metrics(response):
+    stats = current_request_stats()
+    started = getattr(request, 'metrics_started', None)
+    if stats is None or started is None:
+        return response
+
+    endpoint = request.endpoint or 'unmatched'
+    REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint, method=request.method)
+    REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    REQUEST_COMMANDS.observe(stats.commands, endpoint=endpoint)
+    REQUEST_MONGO_TIME.observe(stats.seconds, endpoint=endpoint)
+
+    if endpoint == 'uploaded_file' and response.content_length:
+        UPLOAD_BYTES_SENT.inc(response.content_length, status=response.status_code)
+
+    # Flag N+1 query regressions
+    if stats.commands > QUERY_COUNT_WARNING:
+        QUERY_COUNT_WARNINGS.inc(endpoint=endpoint)
+        logger.warning("Request issued %d MongoDB commands (threshold %d)", stats.commands, QUERY_COUNT_WARNING,
+                       extra={'mongo_commands': stats.commands})
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    end_request()
+
+@metrics_registry.collector
+def collect_cache_metrics():
+    for name, cache in (('membership', membership_cache), ('participants', participants_cache),
+                        ('dashboard', dashboard_cache)):
+        stats = cache.stats()
+        CACHE_LOOKUPS.set(stats['hits'], cache=name, result='hit')
+        CACHE_LOOKUPS.set(stats['misses'], cache=name, result='miss')
+        CACHE_ENTRIES.set(stats['size'], cache=name)
+    CACHE_BYTES.set(dashboard_cache.stats()['bytes'], cache='dashboard')
+
+@metrics_registry.collector
+def collect_logging_metrics():
+    LOG_RECORDS_DROPPED.set(log_handler.dropped)
+
+@metrics_registry.collector
+def collect_gateway_metrics():
+    stats = gateway.registry.stats()
+    WS_CONNECTIONS.set(stats['connections'])
+    WS_DROPPED.set(stats['dropped'])
+    for frame_type, count in gateway.frame_counts().items():
+        WS_FRAMES.set(count, type=frame_type)
+    PRESENCE_USERS.set(presence.size())
+
+@metrics_registry.collector
+def collect_pubsub_metrics():
+    stats = pubsub_backend.stats()
+    PUBSUB_MESSAGES.set(stats['published'], direction='published')
+    PUBSUB_MESSAGES.set(stats['received'], direction='received')
+    PUBSUB_DROPPED.set(stats['dropped'])
+    PUBSUB_CONNECTED.set(1 if stats['connected'] else 0)
 
 # Helper functions
 def hash_password(password):
-    """Hash a password using bcrypt"""
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    """Hash a password using bcrypt on the hashing pool"""
+    return password_hasher.hash(password)
 
 def check_password(password, hashed):
-    """Check if password matches the hashed password"""
-    return bcrypt.checkpw(password.encode('utf-8'), hashed)
+    """Check if password matches the hashed password on the hashing pool"""
+    return password_hasher.check(password, hashed)
+
+def auth_unavailable(template, error_msg, status, retry_after):
+    """Throttled or overloaded login/registration response with Retry-After"""
+    headers = {'Retry-After': str(retry_after)}
+    if request.is_json:
+        return jsonify({'success': False, 'errors': [error_msg]}), status, headers
+    flash(error_msg, 'error')
+    return render_template(template), status, headers
 
 def validate_email(email):
     """Validate email format"""
@@ -105,77 +395,338 @@ def get_file_folder(file_type):
     else:
         return 'documents'
 
+def hash_stream(stream):
+    """Return (sha256 hex digest, size) of a seekable stream, leaving it rewound"""
+    hasher = hashlib.sha256()
+    size = 0
+    stream.seek(0)
+    for block in iter(lambda: stream.read(HASH_BLOCK_SIZE), b''):
+        hasher.update(block)
+        size += len(block)
+    stream.seek(0)
+    return hasher.hexdigest(), size
+
+def acquire_blob(sha256, file_extension, folder, file_size, materialize):
+    """Take a reference to the content-addressed blob for some content.
+
+    Files are stored once per SHA-256 and extension. materialize(path) is only
+    called when the content is not on disk yet, so repeat uploads cost no
+    writes. Returns the blob filename.
+    """
+    filename = f"{sha256}.{file_extension}" if file_extension else sha256
+    target_path = os.path.join(UPLOAD_FOLDER, folder, filename)
+
+    while True:
+        stale_claim = datetime.now(timezone.utc) - timedelta(seconds=BLOB_DELETE_TIMEOUT)
+        try:
+            existing = blobs.find_one_and_update(
+                {'_id': filename,
+                 '$or': [{'deleting': {'$exists': False}}, {'deleting_at': {'$lt': stale_claim}}]},
+                {
+                    '$inc': {'ref_count': 1},
+                    '$unset': {'deleting': '', 'deleting_at': ''},
+                    '$setOnInsert': {
+                        'file_path': os.path.join(folder, filename),
+                        'file_size': file_size,
+                        'created_at': datetime.now(timezone.utc)
+                    }
+                },
+                upsert=True
+            )
+            break
+        except DuplicateKeyError:
+            # release_blob() is deleting this file; store it again once that is done
+            time.sleep(BLOB_DELETE_POLL_SECONDS)
+
+    if existing is None or not os.path.exists(target_path):
+        try:
+            # Write beside the target and rename so readers never see a partial file
+            temp_path = os.path.join(PARTIAL_UPLOAD_FOLDER, f"{uuid.uuid4().hex}.blob")
+            materialize(temp_path)
+            # Make the bytes durable before the upload is acknowledged
+            with open(temp_path, 'rb') as stored:
+                os.fsync(stored.fileno())
+            os.replace(temp_path, target_path)
+        except Exception:
+            release_blob(os.path.join(folder, filename))
+            raise
+
+    return filename
+
+def release_blob(file_path):
+    """Drop a reference to an uploaded file, deleting it once nothing uses it"""
+    filename = os.path.basename(file_path)
+    blob = blobs.find_one_and_update(
+        {'_id': filename},
+        {'$inc': {'ref_count': -1}},
+        return_document=ReturnDocument.AFTER
+    )
+
+    claim = None
+    if blob is not None:
+        if blob['ref_count'] > 0:
+            return
+        # Claim the delete unless someone took a new reference since our decrement.
+        # acquire_blob() waits for a claimed blob, so it never reuses a file being removed.
+        claim = uuid.uuid4().hex
+        claimed = blobs.update_one(
+            {'_id': filename, 'ref_count': {'$lte': 0}, 'deleting': {'$exists': False}},
+            {'$set': {'deleting': claim, 'deleting_at': datetime.now(timezone.utc)}}
+        )
+        if claimed.modified_count == 0:
+            return
+
+    # Unreferenced blob, or a file uploaded before content addressing
+    full_path = os.path.join(UPLOAD_FOLDER, file_path)
+    if os.path.exists(full_path):
+        os.remove(full_path)
+    thumbnails.remove_thumbnail(full_path)
+    if claim is not None:
+        blobs.delete_one({'_id': filename, 'deleting': claim})
+
+def get_thumbnail_path(file_path):
+    """Relative path of a file's thumbnail, or None if it cannot have one"""
+    if not file_path or not thumbnails.can_thumbnail(file_path):
+        return None
+    folder, filename = os.path.split(file_path)
+    return f"{folder}/{thumbnails.thumbnail_name(filename)}"
+
 def save_uploaded_file(file):
     """Save uploaded file and return file info"""
     if not file or not allowed_file(file.filename):
         return None
 
-    # Generate unique filename
     original_filename = secure_filename(file.filename)
     file_extension = original_filename.rsplit('.', 1)[1].lower() if '.' in original_filename else ''
-    unique_filename = f"{uuid.uuid4().hex}.{file_extension}"
 
     # Determine file type and folder
     file_type = get_file_type(original_filename)
     folder = get_file_folder(file_type)
 
-    # Create full path
-    file_path = os.path.join(UPLOAD_FOLDER, folder, unique_filename)
-
     try:
-        # Save file
-        file.save(file_path)
-
-        # Get file size
-        file_size = os.path.getsize(file_path)
+        # Hash first so content we already have is never written again
+        sha256, file_size = hash_stream(file.stream)
+        filename = acquire_blob(sha256, file_extension, folder, file_size, file.save)
 
         return {
             'original_name': original_filename,
-            'filename': unique_filename,  # Use just the unique filename
-            'file_path': os.path.join(folder, unique_filename),
+            'filename': filename,
+            'file_path': os.path.join(folder, filename),
             'file_type': file_type,
             'file_size': file_size,
-            'folder': folder
+            'folder': folder,
+            'sha256': sha256
         }
-    except Exception as e:
-        print(f"Error saving file: {e}")
+    except Exception:
+        logger.exception("Error saving file")
         return None
 
-def get_user_conversations(user_id):
-    """Get all conversations for a user"""
+def store_completed_upload(partial_path, original_name, sha256):
+    """Move a fully received chunked upload into the blob store and return file info"""
+    original_filename = secure_filename(original_name)
+    file_extension = original_filename.rsplit('.', 1)[1].lower() if '.' in original_filename else ''
+
+    file_type = get_file_type(original_filename)
+    folder = get_file_folder(file_type)
+    file_size = os.path.getsize(partial_path)
+    filename = acquire_blob(sha256, file_extension, folder, file_size,
+                            lambda temp_path: os.replace(partial_path, temp_path))
+
+    # Already stored: the received copy is redundant
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+
+    return {
+        'original_name': original_filename,
+        'filename': filename,
+        'file_path': os.path.join(folder, filename),
+        'file_type': file_type,
+        'file_size': file_size,
+        'folder': folder,
+        'sha256': sha256
+    }
+
+def deliver_event(conversation_id, event_type, data, skip=None):
+    """Deliver a live event to this worker's SSE streams and gateway subscribers"""
+    event = broker.publish(conversation_id, event_type, data)
+    gateway.registry.broadcast(conversation_id, gateway_event(conversation_id, event), skip=skip)
+
+def publish_event(conversation_id, event_type, data, skip=None):
+    """Publish a live event to everyone streaming a conversation, on every worker.
+
+    skip is a gateway connection that already has the event.
+    """
+    conversation_id = str(conversation_id)
     try:
-        user_conversations = conversations.find({
-            'participants': ObjectId(user_id)
-        }).sort('last_message_time', -1)
+        deliver_event(conversation_id, event_type, data, skip)
+        pubsub_backend.publish({'topic': conversation_id, 'kind': 'event', 'type': event_type, 'data': data})
+    except Exception:
+        logger.exception("Error publishing %s event", event_type)
+
+def publish_frame(conversation_id, payload, exclude_user=None):
+    """Relay an ephemeral gateway frame (typing, receipts) to a conversation on every worker"""
+    gateway.registry.broadcast(conversation_id, payload, exclude_user=exclude_user, droppable=True)
+    pubsub_backend.publish({'topic': conversation_id, 'kind': 'frame', 'payload': payload,
+                            'exclude_user': exclude_user})
+
+def deliver_remote(message):
+    """Deliver a message published by another worker to this worker's clients"""
+    if message['kind'] == 'invalidate':
+        dashboard_cache.invalidate(message['users'])
+    elif message['kind'] == 'frame':
+        gateway.registry.broadcast(message['topic'], message['payload'],
+                                   exclude_user=message.get('exclude_user'), droppable=True)
+    elif message['kind'] == 'event':
+        deliver_event(message['topic'], message['type'], message['data'])
 
-        conversation_list = []
-        for conv in user_conversations:
-            # Get the other participant
-            other_participant_id = None
-            for participant_id in conv['participants']:
-                if str(participant_id) != user_id:
-                    other_participant_id = participant_id
-                    break
+try:
+    pubsub_backend.start(deliver_remote)
+except Exception:
+    logger.exception("Failed to start the %s pub/sub backend", PUBSUB_BACKEND)
+
+def flush_presence(changes, departed):
+    """Persist last-seen times and push coalesced status changes to conversation partners.
+
+    One write for everyone who went offline, one query for the partners of
+    every changed user, and one frame per connected recipient.
+    """
+    if departed:
+        users.bulk_write([
+            UpdateOne({'_id': ObjectId(user_id)}, {'$set': {'last_seen': datetime.fromtimestamp(seen_at, timezone.utc)}})
+            for user_id, seen_at in departed.items()
+        ], ordered=False)
+    if not changes:
+        return 0
+    PRESENCE_CHANGES.inc(len(changes))
+
+    connected = gateway.registry.connected_users()
+    if not connected:
+        return 0
+    batches = {}
+    shared = conversations.find({'$and': [
+        {'participants': {'$in': [ObjectId(user_id) for user_id in changes]}},
+        {'participants': {'$in': [ObjectId(user_id) for user_id in connected]}}
+    ]}, {'participants': 1})
+    for conversation in shared:
+        members = [str(participant) for participant in conversation['participants']]
+        for member in members:
+            if member not in changes:
+                continue
+            for recipient in members:
+                if recipient != member and recipient in connected:
+                    batches.setdefault(recipient, {})[member] = changes[member]
 
-            if other_participant_id:
-                other_user = users.find_one({'_id': other_participant_id})
-                if other_user:
-                    conversation_list.append({
-                        'id': str(conv['_id']),
-                        'other_user': {
-                            'id': str(other_user['_id']),
-                            'name': other_user['name'],
-                            'email': other_user['email']
-                        },
-                        'last_message': conv.get('last_message', ''),
-                        'last_message_time': conv.get('last_message_time'),
-                        'unread_count': conv.get('unread_count', {}).get(user_id, 0)
-                    })
-
-        return conversation_list
-    except Exception as e:
-        print(f"Error getting conversations: {e}")
-        return []
+    for recipient, statuses in batches.items():
+        gateway.registry.send_to_users([recipient], {'type': 'presence', 'users': statuses}, droppable=True)
+    return len(batches)
+
+if PRESENCE_FLUSH_SECONDS > 0:
+    presence.start(PRESENCE_FLUSH_SECONDS, flush_presence)
+
+def gateway_event(conversation_id, event):
+    """A pubsub event as a gateway frame"""
+    return {'type': event.type, 'id': event.id, 'conversation_id': conversation_id, 'data': event.data}
+
+def format_sse(event):
+    """Serialise a pubsub event in text/event-stream format"""
+    payload = json.dumps(event.data, default=str)
+    return f"id: {event.id}\nevent: {event.type}\ndata: {payload}\n\n"
+
+def get_user_conversations(user_id, limit=CONVERSATION_PAGE_SIZE, before=None):
+    """Get a page of a user's conversations, most recent first.
+
+    Participants are joined in the same aggregation, so a page costs one
+    query. ``before`` is a decoded cursor; returns (conversation_list, next_cursor).
+    """
+    try:
+        return query_user_conversations(user_id, limit, before)
+    except Exception:
+        logger.exception("Error getting conversations")
+        return [], None
+
+def query_user_conversations(user_id, limit=CONVERSATION_PAGE_SIZE, before=None):
+    """get_user_conversations() without the error handling"""
+    match = {'participants': ObjectId(user_id)}
+    if before:
+        match['$or'] = keyset_filter('last_message_time', before, '$lt')
+
+    user_conversations = list(conversations.aggregate([
+        {'$match': match},
+        {'$sort': {'last_message_time': -1, '_id': -1}},
+        {'$limit': limit + 1},
+        {'$lookup': {
+            'from': users.name,
+            'localField': 'participants',
+            'foreignField': '_id',
+            'as': 'participant_users'
+        }},
+        {'$project': {
+            'last_message': 1,
+            'last_message_time': 1,
+            'unread_count': 1,
+            'participant_users._id': 1,
+            'participant_users.name': 1,
+            'participant_users.email': 1
+        }}
+    ]))
+
+    next_cursor = None
+    if len(user_conversations) > limit:
+        user_conversations = user_conversations[:limit]
+        last = user_conversations[-1]
+        next_cursor = encode_cursor(last['last_message_time'], last['_id'])
+
+    conversation_list = []
+    for conv in user_conversations:
+        # Get the other participant
+        other_user = next(
+            (participant for participant in conv.get('participant_users', [])
+             if str(participant['_id']) != user_id),
+            None
+        )
+
+        if other_user:
+            conversation_list.append({
+                'id': str(conv['_id']),
+                'other_user': {
+                    'id': str(other_user['_id']),
+                    'name': other_user['name'],
+                    'email': other_user['email']
+                },
+                'last_message': conv.get('last_message', ''),
+                'last_message_time': conv.get('last_message_time'),
+                'unread_count': conv.get('unread_count', {}).get(user_id, 0)
+            })
+
+    return conversation_list, next_cursor
+
+def is_participant(user_id, conversation_id):
+    """Whether the user belongs to the conversation, served from the membership cache"""
+    key = (str(user_id), str(conversation_id))
+    allowed = membership_cache.get(key)
+    if allowed is None:
+        allowed = conversations.find_one(
+            {'_id': ObjectId(conversation_id), 'participants': ObjectId(user_id)},
+            {'_id': 1}
+        ) is not None
+        membership_cache.set(key, allowed)
+    return allowed
+
+def get_participants(conversation_id):
+    """Participant ids of a conversation as strings, served from a cache"""
+    key = str(conversation_id)
+    participants = participants_cache.get(key)
+    if participants is None:
+        conversation = conversations.find_one({'_id': ObjectId(conversation_id)}, {'participants': 1})
+        participants = tuple(str(p) for p in conversation['participants']) if conversation else ()
+        participants_cache.set(key, participants)
+    return participants
+
+def invalidate_membership(conversation_id, user_ids):
+    """Drop cached membership answers after a conversation's participants change"""
+    participants_cache.invalidate(str(conversation_id))
+    for user_id in user_ids:
+        membership_cache.invalidate((str(user_id), str(conversation_id)))
 
 def create_conversation(user1_id, user2_id):
     """Create a new conversation between two users"""
@@ -194,74 +745,478 @@ def create_conversation(user1_id, user2_id):
             'created_at': datetime.now(timezone.utc),
             'last_message': '',
             'last_message_time': datetime.now(timezone.utc),
+            'updated_at': datetime.now(timezone.utc),
             'unread_count': {user1_id: 0, user2_id: 0}
         }
 
         result = conversations.insert_one(conversation_data)
+        invalidate_membership(result.inserted_id, [user1_id, user2_id])
+        invalidate_dashboards([user1_id, user2_id])
         return str(result.inserted_id)
-    except Exception as e:
-        print(f"Error creating conversation: {e}")
+    except Exception:
+        logger.exception("Error creating conversation")
         return None
 
-def get_conversation_messages(conversation_id, limit=50):
-    """Get messages for a conversation"""
+def prepare_message(message_data):
+    """Fill in a new message's search terms; returns its recipients (everyone but the sender)"""
+    message_data['search_terms'] = search.search_terms(message_data.get('content'), message_data.get('original_name'))
+    sender_id = str(message_data['sender_id'])
+    return [p for p in get_participants(message_data['conversation_id']) if p != sender_id]
+
+def conversation_summary_update(last_message, recipients):
+    """Update setting a conversation's last message and bumping the recipients' unread counters"""
+    now = datetime.now(timezone.utc)
+    update = {
+        '$set': {
+            'last_message': last_message,
+            'last_message_time': now,
+            'updated_at': now
+        }
+    }
+    if recipients:
+        update['$inc'] = {f'unread_count.{recipient}': 1 for recipient in recipients}
+    return update
+
+def store_message(message_data, last_message):
+    """Insert a message and update its conversation's summary"""
+    recipients = prepare_message(message_data)
+
+    if message_writer is not None:
+        inserted_id = message_writer.submit(message_data, last_message, recipients)
+    else:
+        inserted_id = messages.insert_one(message_data).inserted_id
+        conversations.update_one({'_id': message_data['conversation_id']},
+                                 conversation_summary_update(last_message, recipients))
+    invalidate_dashboards([message_data['sender_id'], *recipients])
+    return inserted_id
+
+def mark_conversation_read(user_id, conversation_id):
+    """Reset the user's unread counter for a conversation"""
+    result = conversations.update_one(
+        {'_id': ObjectId(conversation_id), f'unread_count.{user_id}': {'$ne': 0}},
+        {'$set': {f'unread_count.{user_id}': 0, 'updated_at': datetime.now(timezone.utc)}}
+    )
+    if result.modified_count:
+        invalidate_dashboards([user_id])
+
+def get_unread_total(user_id):
+    """Sum of the user's unread counters, cached until a write bumps the user's dashboard version"""
+    return dashboard_cache.get_or_compute(str(user_id), ('unread_total',), lambda: count_unread(user_id))
+
+def count_unread(user_id):
+    """Sum of the user's unread counters across their conversations"""
+    result = list(conversations.aggregate([
+        {'$match': {'participants': ObjectId(user_id), f'unread_count.{user_id}': {'$gt': 0}}},
+        {'$group': {'_id': None, 'total': {'$sum': f'$unread_count.{user_id}'}}}
+    ]))
+    return result[0]['total'] if result else 0
+
+def get_dashboard(user_id, limit=CONVERSATION_PAGE_SIZE):
+    """First page of a user's conversations and their unread total.
+
+    Served from the dashboard cache until a write to one of the user's
+    conversations bumps their version. Returns a dict with ``conversations``,
+    ``next_cursor`` and ``unread_total``; treat it as read-only.
+    """
+    def load():
+        conversation_list, next_cursor = query_user_conversations(user_id, limit)
+        return {'conversations': conversation_list, 'next_cursor': next_cursor,
+                'unread_total': get_unread_total(user_id)}
+
+    try:
+        return dashboard_cache.get_or_compute(str(user_id), ('dashboard', limit), load)
+    except Exception:
+        logger.exception("Error getting dashboard")
+        return {'conversations': [], 'next_cursor': None, 'unread_total': 0}
+
+def invalidate_dashboards(user_ids):
+    """Bump the dashboard version of users whose conversations changed, here and on other workers"""
+    user_ids = [str(user_id) for user_id in user_ids]
+    try:
+        dashboard_cache.bump(user_ids)
+    except Exception:
+        logger.exception("Error bumping dashboard versions")
+        dashboard_cache.invalidate(user_ids)
+    pubsub_backend.publish({'topic': None, 'kind': 'invalidate', 'users': user_ids})
+
+def new_text_message(conversation_id, user_id, content):
+    """Document for a new text message"""
+    return {
+        'conversation_id': ObjectId(conversation_id),
+        'sender_id': ObjectId(user_id),
+        'content': content,
+        'timestamp': datetime.now(timezone.utc),
+        'message_type': 'text'
+    }
+
+def text_message_event(message_data, username):
+    """A stored text message as returned to the sender and published to the conversation"""
+    return {
+        'id': str(message_data['_id']),
+        'content': message_data['content'],
+        'sender': {
+            'id': str(message_data['sender_id']),
+            'name': username
+        },
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'message_type': 'text',
+        'cursor': encode_message_cursor(message_data)
+    }
+
+def send_text_message(conversation_id, user_id, username, content, skip=None):
+    """Store a text message from a participant, publish it and return it"""
+    message_data = new_text_message(conversation_id, user_id, content)
+    store_message(message_data, content)
+
+    message = text_message_event(message_data, username)
+    publish_event(conversation_id, 'message', message, skip=skip)
+    return message
+
+def send_file_message(conversation_id, file_info, is_voice=False):
+    """Store a file or voice message for the current user, publish it and return it"""
+    if is_voice:
+        content = "🎵 Voice message"
+        last_message = "🎵 Voice message"
+        message_type = 'audio'
+    else:
+        content = f"Shared {file_info['original_name']}"
+        last_message = f"📎 {file_info['original_name']}"
+        message_type = file_info['file_type']
+
+    # Create message
+    message_data = {
+        'conversation_id': ObjectId(conversation_id),
+        'sender_id': ObjectId(session['user_id']),
+        'content': content,
+        'timestamp': datetime.now(timezone.utc),
+        'message_type': message_type,
+        'file_name': file_info['filename'],
+        'original_name': file_info['original_name'],
+        'file_size': file_info['file_size'],
+        'file_path': file_info['file_path']
+    }
+    if file_info.get('sha256'):
+        message_data['sha256'] = file_info['sha256']
+
+    inserted_id = store_message(message_data, last_message)
+
+    # Thumbnails and media probing run off the request path
+    try:
+        job_id = job_queue.enqueue(
+            'process_upload',
+            {'message_id': str(inserted_id), 'file_path': file_info['file_path']},
+            owner_id=session['user_id']
+        )
+    except Exception:
+        logger.exception("Error queueing upload processing")
+        job_id = None
+
+    message = {
+        'id': str(inserted_id),
+        'content': message_data['content'],
+        'sender': {
+            'id': session['user_id'],
+            'name': session['username']
+        },
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'message_type': message_type,
+        'file_name': file_info['filename'],
+        'original_name': file_info['original_name'],
+        'file_size': file_info['file_size'],
+        'thumbnail_path': get_thumbnail_path(file_info['file_path']),
+        'cursor': encode_message_cursor(message_data)
+    }
+    publish_event(conversation_id, 'message', message)
+    return message, job_id
+
+@job_queue.handler('process_upload')
+def process_upload(message_id, file_path):
+    """Post-upload work: thumbnail generation and media probing"""
+    full_path = os.path.join(UPLOAD_FOLDER, file_path)
+    thumbnail = thumbnails.generate_thumbnail(full_path) if thumbnails.can_thumbnail(file_path) else None
+    media_info = thumbnails.probe_media(full_path)
+    messages.update_one({'_id': ObjectId(message_id)}, {'$set': {'media_info': media_info}})
+    return {
+        'thumbnail_path': get_thumbnail_path(file_path) if thumbnail else None,
+        'media_info': media_info
+    }
+
+def get_sender_names(sender_ids):
+    """Resolve sender ids to display names with a single query"""
+    unique_ids = list(set(sender_ids))
+    if not unique_ids:
+        return {}
+
+    senders = users.find({'_id': {'$in': unique_ids}}, {'name': 1})
+    return {sender['_id']: sender['name'] for sender in senders}
+
+def encode_cursor(timestamp, doc_id):
+    """Build an opaque pagination cursor from a (timestamp, _id) sort key"""
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return f"{int(timestamp.timestamp() * 1000)}_{doc_id}"
+
+def decode_cursor(cursor):
+    """Parse a cursor produced by encode_cursor, raising ValueError if malformed"""
+    try:
+        millis, doc_id = cursor.split('_', 1)
+        timestamp = datetime.fromtimestamp(int(millis) / 1000, tz=timezone.utc)
+        return timestamp, ObjectId(doc_id)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}") from None
+
+def encode_message_cursor(msg):
+    """Pagination cursor for a message document"""
+    return encode_cursor(msg['timestamp'], msg['_id'])
+
+def keyset_filter(field, cursor, operator):
+    """Filter for documents strictly past a (field, _id) cursor"""
+    timestamp, doc_id = cursor
+    return [
+        {field: {operator: timestamp}},
+        {field: timestamp, '_id': {operator: doc_id}}
+    ]
+
+def parse_page_size(value, default=MESSAGE_PAGE_SIZE):
+    """Clamp a requested page size to the allowed range"""
+    try:
+        limit = int(value) if value is not None else default
+    except (TypeError, ValueError):
+        limit = default
+    return max(1, min(limit, MAX_MESSAGE_PAGE_SIZE))
+
+def format_message(msg, sender_name):
+    """Shape a message document for templates and API responses"""
+    message_data = {
+        'id': str(msg['_id']),
+        'conversation_id': str(msg['conversation_id']),
+        'content': msg['content'],
+        'sender': {
+            'id': str(msg['sender_id']),
+            'name': sender_name
+        },
+        'timestamp': msg['timestamp'],
+        'message_type': msg.get('message_type', 'text'),
+        'cursor': encode_message_cursor(msg)
+    }
+
+    # Add file information for file messages
+    if msg.get('message_type') in ['image', 'video', 'audio', 'file']:
+        message_data.update({
+            'file_name': msg.get('file_name', ''),
+            'file_size': msg.get('file_size', 0),
+            'file_path': msg.get('file_path', ''),
+            'original_name': msg.get('original_name', ''),
+            'thumbnail_path': get_thumbnail_path(msg.get('file_path'))
+        })
+
+    return message_data
+
+def get_conversation_messages(conversation_id, limit=MESSAGE_PAGE_SIZE, before=None, after=None):
+    """Get one page of messages for a conversation.
+
+    Pages are keyed on (timestamp, _id), so every page costs the same indexed
+    range scan however deep into history it is. Without cursors the newest page
+    is returned. ``before``/``after`` are decoded cursors; messages are always
+    returned oldest first. Returns (message_list, next_cursor) where next_cursor
+    continues in the same direction and is None when there is nothing more.
+    """
     try:
-        conversation_messages = messages.find({
-            'conversation_id': ObjectId(conversation_id)
-        }).sort('timestamp', 1).limit(limit)
+        query = {'conversation_id': ObjectId(conversation_id)}
+        if after:
+            query['$or'] = keyset_filter('timestamp', after, '$gt')
+            direction = 1
+        else:
+            if before:
+                query['$or'] = keyset_filter('timestamp', before, '$lt')
+            direction = -1
+
+        # Fetch one extra document to learn whether another page exists
+        conversation_messages = list(messages.find(query).sort(
+            [('timestamp', direction), ('_id', direction)]
+        ).limit(limit + 1))
+
+        has_more = len(conversation_messages) > limit
+        conversation_messages = conversation_messages[:limit]
+        next_cursor = encode_message_cursor(conversation_messages[-1]) if has_more else None
+        if direction == -1:
+            conversation_messages.reverse()
+
+        sender_names = get_sender_names(msg['sender_id'] for msg in conversation_messages)
 
         message_list = []
         for msg in conversation_messages:
             try:
-                sender = users.find_one({'_id': msg['sender_id']})
-                if not sender:
-                    print(f"Warning: Sender not found for message {msg['_id']}")
+                sender_name = sender_names.get(msg['sender_id'])
+                if sender_name is None:
+                    logger.warning("Sender not found for message %s", msg['_id'])
                     continue
 
-                message_data = {
-                    'id': str(msg['_id']),
-                    'content': msg['content'],
-                    'sender': {
-                        'id': str(sender['_id']),
-                        'name': sender['name']
-                    },
-                    'timestamp': msg['timestamp'],
-                    'message_type': msg.get('message_type', 'text')
-                }
-
-                # Add file information for file messages
-                if msg.get('message_type') in ['image', 'video', 'audio', 'file']:
-                    message_data.update({
-                        'file_name': msg.get('file_name', ''),
-                        'file_size': msg.get('file_size', 0),
-                        'file_path': msg.get('file_path', ''),
-                        'original_name': msg.get('original_name', '')
-                    })
-
-                message_list.append(message_data)
+                message_list.append(format_message(msg, sender_name))
             except Exception as msg_error:
-                print(f"Error processing message {msg.get('_id', 'unknown')}: {msg_error}")
+                logger.exception("Error processing message %s", msg.get('_id', 'unknown'))
                 continue
 
-        return message_list
-    except Exception as e:
-        print(f"Error getting messages: {e}")
-        return []
+        return message_list, next_cursor
+    except Exception:
+        logger.exception("Error getting messages")
+        return [], None
+
+def search_messages(user_id, query, limit=MESSAGE_PAGE_SIZE, before=None, conversation_id=None):
+    """Search the user's messages, newest first.
+
+    Every query term must appear in a message. The longest term leads the
+    $all so the planner's index bounds start from the most selective one.
+    Returns (results, next_cursor).
+    """
+    terms = search.query_terms(query)
+    if not terms:
+        return [], None
+
+    if conversation_id:
+        conversation_ids = [ObjectId(conversation_id)]
+    else:
+        conversation_ids = [conv['_id'] for conv in conversations.find({'participants': ObjectId(user_id)}, {'_id': 1})]
+
+    match = {'search_terms': {'$all': terms}, 'conversation_id': {'$in': conversation_ids}}
+    if before:
+        match['$or'] = keyset_filter('timestamp', before, '$lt')
+
+    found = list(messages.find(match, {'search_terms': 0}).sort(
+        [('timestamp', -1), ('_id', -1)]
+    ).limit(limit + 1))
+
+    next_cursor = None
+    if len(found) > limit:
+        found = found[:limit]
+        next_cursor = encode_message_cursor(found[-1])
+
+    sender_names = get_sender_names(msg['sender_id'] for msg in found)
+    results = []
+    for msg in found:
+        text = msg.get('content') if msg.get('message_type') == 'text' else msg.get('original_name')
+        results.append({
+            'id': str(msg['_id']),
+            'conversation_id': str(msg['conversation_id']),
+            'sender': {
+                'id': str(msg['sender_id']),
+                'name': sender_names.get(msg['sender_id'], 'Unknown')
+            },
+            'timestamp': msg['timestamp'].isoformat(),
+            'message_type': msg.get('message_type', 'text'),
+            'snippet': search.highlight(text, terms),
+            'cursor': encode_message_cursor(msg)
+        })
+    return results, next_cursor
+
+def encode_sync_token(timestamp, after=None):
+    """Build an opaque sync token for a point in time.
+
+    ``after`` is the (timestamp, _id) of the last message returned when more
+    are pending; the next page resumes strictly after it.
+    """
+    payload = {'v': 1, 't': int(timestamp.timestamp() * 1000)}
+    if after is not None:
+        payload['after'] = encode_cursor(*after)
+    return base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii')
+
+def decode_sync_token(token):
+    """Parse a sync token into (since, after), raising ValueError if it is malformed"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+        if payload.get('v') != 1:
+            raise ValueError
+        after = decode_cursor(payload['after']) if payload.get('after') else None
+        return datetime.fromtimestamp(payload['t'] / 1000, tz=timezone.utc), after
+    except Exception:
+        raise ValueError(f"Invalid sync token: {token}") from None
+
+def get_account_changes(user_id, since, after=None):
+    """Collect everything that changed across a user's conversations since a time.
+
+    Every write bumps the conversation's ``updated_at``, so an idle account costs
+    one indexed query. Messages and deletion tombstones are only read for the
+    conversations that changed. ``after`` continues a previous page of messages.
+    Returns a dict with conversations, messages, deleted message ids, the new
+    token and whether more messages are pending.
+    """
+    now = datetime.now(timezone.utc)
+    window_start = since - timedelta(seconds=SYNC_OVERLAP_SECONDS)
+
+    changed_conversations = list(conversations.find(
+        {'participants': ObjectId(user_id), 'updated_at': {'$gte': window_start}},
+        {'last_message': 1, 'last_message_time': 1, 'unread_count': 1, 'updated_at': 1}
+    ))
+    if not changed_conversations:
+        return {'conversations': [], 'messages': [], 'deleted': [],
+                'token': encode_sync_token(now), 'has_more': False}
+
+    conversation_ids = [conv['_id'] for conv in changed_conversations]
+
+    message_filter = {'conversation_id': {'$in': conversation_ids}}
+    if after:
+        message_filter['$or'] = keyset_filter('timestamp', after, '$gt')
+    else:
+        message_filter['timestamp'] = {'$gt': window_start}
+    new_messages = list(messages.find(message_filter).sort(
+        [('timestamp', 1), ('_id', 1)]
+    ).limit(SYNC_MAX_MESSAGES + 1))
+
+    has_more = len(new_messages) > SYNC_MAX_MESSAGES
+    if has_more:
+        # Resume after the last message we return; messages sharing its timestamp are not skipped
+        new_messages = new_messages[:SYNC_MAX_MESSAGES]
+        last = new_messages[-1]
+        last_timestamp = last['timestamp']
+        if last_timestamp.tzinfo is None:
+            last_timestamp = last_timestamp.replace(tzinfo=timezone.utc)
+        token = encode_sync_token(last_timestamp + timedelta(seconds=SYNC_OVERLAP_SECONDS),
+                                  after=(last_timestamp, last['_id']))
+    else:
+        token = encode_sync_token(now)
+
+    tombstones = message_tombstones.find({
+        'conversation_id': {'$in': conversation_ids},
+        'deleted_at': {'$gt': window_start}
+    }, {'message_id': 1, 'conversation_id': 1})
+
+    sender_names = get_sender_names(msg['sender_id'] for msg in new_messages)
+
+    return {
+        'conversations': [{
+            'id': str(conv['_id']),
+            'last_message': conv.get('last_message', ''),
+            'last_message_time': conv.get('last_message_time'),
+            'unread_count': conv.get('unread_count', {}).get(user_id, 0)
+        } for conv in changed_conversations],
+        'messages': [
+            format_message(msg, sender_names[msg['sender_id']])
+            for msg in new_messages if msg['sender_id'] in sender_names
+        ],
+        'deleted': [{
+            'id': str(tombstone['message_id']),
+            'conversation_id': str(tombstone['conversation_id'])
+        } for tombstone in tombstones],
+        'token': token,
+        'has_more': has_more
+    }
 
 def get_conversation_media(conversation_id):
     """Get all media files from a conversation"""
     try:
-        media_messages = messages.find({
+        media_messages = list(messages.find({
             'conversation_id': ObjectId(conversation_id),
             'message_type': {'$in': ['image', 'video', 'audio', 'file']}
-        }).sort('timestamp', -1)
+        }).sort('timestamp', -1))
+
+        sender_names = get_sender_names(msg['sender_id'] for msg in media_messages)
 
         media_list = []
         for msg in media_messages:
             try:
-                sender = users.find_one({'_id': msg['sender_id']})
-                if not sender:
-                    print(f"Warning: Sender not found for media message {msg['_id']}")
+                sender_name = sender_names.get(msg['sender_id'])
+                if sender_name is None:
+                    logger.warning("Sender not found for media message %s", msg['_id'])
                     continue
 
                 media_list.append({
@@ -270,20 +1225,21 @@ def get_conversation_media(conversation_id):
                     'original_name': msg.get('original_name', ''),
                     'file_size': msg.get('file_size', 0),
                     'file_path': msg.get('file_path', ''),
+                    'thumbnail_path': get_thumbnail_path(msg.get('file_path')),
                     'message_type': msg.get('message_type', 'file'),
                     'timestamp': msg['timestamp'],
                     'sender': {
-                        'id': str(sender['_id']),
-                        'name': sender['name']
+                        'id': str(msg['sender_id']),
+                        'name': sender_name
                     }
                 })
             except Exception as media_error:
-                print(f"Error processing media message {msg.get('_id', 'unknown')}: {media_error}")
+                logger.exception("Error processing media message %s", msg.get('_id', 'unknown'))
                 continue
 
         return media_list
-    except Exception as e:
-        print(f"Error getting media: {e}")
+    except Exception:
+        logger.exception("Error getting media")
         return []
 
 # Routes
@@ -349,7 +1305,16 @@ def register():
             'is_active': True
         }
 
-        result = users.insert_one(user_data)
+        try:
+            result = users.insert_one(user_data)
+        except DuplicateKeyError:
+            # Lost a race with a concurrent registration for the same email
+            error_msg = "An account with this email already exists"
+            if request.is_json:
+                return jsonify({'success': False, 'errors': [error_msg]}), 400
+            else:
+                flash(error_msg, 'error')
+                return render_template('register.html')
 
         if result.inserted_id:
             success_msg = "Account created successfully! Please log in."
@@ -366,9 +1331,13 @@ def register():
                 flash(error_msg, 'error')
                 return render_template('register.html')
 
-    except Exception as e:
+    except HasherBusy:
+        AUTH_REJECTED.inc(reason='busy')
+        return auth_unavailable('register.html', "The server is busy. Please try again in a moment.",
+                                503, HASHER_BUSY_RETRY_SECONDS)
+    except Exception:
         error_msg = "An error occurred during registration. Please try again."
-        print(f"Registration error: {e}")
+        logger.exception("Registration error")
         if request.is_json:
             return jsonify({'success': False, 'errors': [error_msg]}), 500
         else:
@@ -397,9 +1366,19 @@ def login():
                 flash(error_msg, 'error')
                 return render_template('login.html')
 
+        # Throttle credential stuffing before spending any bcrypt time on it
+        client_ip = request.remote_addr or 'unknown'
+        retry_after = max(login_ip_throttle.retry_after(client_ip), login_account_throttle.retry_after(email))
+        if retry_after:
+            AUTH_REJECTED.inc(reason='throttled')
+            return auth_unavailable('login.html', "Too many failed login attempts. Please try again later.",
+                                    429, retry_after)
+
         # Find user
         user = users.find_one({'email': email})
         if not user or not check_password(password, user['password']):
+            login_ip_throttle.record(client_ip)
+            login_account_throttle.record(email)
             error_msg = "Invalid email or password"
             if request.is_json:
                 return jsonify({'success': False, 'errors': [error_msg]}), 401
@@ -421,12 +1400,16 @@ def login():
         session['username'] = user['name']
         session['email'] = user['email']
         session.permanent = remember
+        login_account_throttle.reset(email)
 
-        # Update last login
-        users.update_one(
-            {'_id': user['_id']},
-            {'$set': {'last_login': datetime.now(timezone.utc)}}
-        )
+        # Update last login, upgrading the hash if BCRYPT_ROUNDS has changed since it was made
+        updates = {'last_login': datetime.now(timezone.utc)}
+        if password_hasher.needs_rehash(user['password']):
+            try:
+                updates['password'] = hash_password(password)
+            except HasherBusy:
+                pass  # upgraded on a later login
+        users.update_one({'_id': user['_id']}, {'$set': updates})
 
         success_msg = f"Welcome back, {user['name']}!"
         if request.is_json:
@@ -435,9 +1418,13 @@ def login():
             flash(success_msg, 'success')
             return redirect(url_for('home'))
 
-    except Exception as e:
+    except HasherBusy:
+        AUTH_REJECTED.inc(reason='busy')
+        return auth_unavailable('login.html', "The server is busy. Please try again in a moment.",
+                                503, HASHER_BUSY_RETRY_SECONDS)
+    except Exception:
         error_msg = "An error occurred during login. Please try again."
-        print(f"Login error: {e}")
+        logger.exception("Login error")
         if request.is_json:
             return jsonify({'success': False, 'errors': [error_msg]}), 500
         else:
@@ -459,15 +1446,18 @@ def home():
         flash('Please log in to access the dashboard.', 'warning')
         return redirect(url_for('login'))
 
-    # Get user's conversations
-    user_conversations = get_user_conversations(session['user_id'])
-
-    # Debug: Print conversation data
-    print(f"User {session['user_id']} has {len(user_conversations)} conversations:")
-    for conv in user_conversations:
-        print(f"  - Conversation ID: {conv['id']}, Other user: {conv['other_user']['name']}")
+    # Get the first page of the user's conversations
+    page_size = parse_page_size(request.args.get('limit'), default=CONVERSATION_PAGE_SIZE)
+    dashboard = get_dashboard(session['user_id'], limit=page_size)
 
-    return render_template('home.html', user=session, conversations=user_conversations)
+    return render_template('home.html',
+                           user=session,
+                           conversations=dashboard['conversations'],
+                           unread_total=dashboard['unread_total'],
+                           conversations_cursor=dashboard['next_cursor'],
+                           page_size=page_size,
+                           presence_heartbeat_seconds=PRESENCE_HEARTBEAT_SECONDS,
+                           presence_max_ids=PRESENCE_MAX_IDS)
 
 @app.route('/chat')
 def chat():
@@ -477,10 +1467,16 @@ def chat():
         return redirect(url_for('login'))
 
     conversation_id = request.args.get('id')
-    print(f"Chat route called with conversation_id: {conversation_id}")
+    logger.debug("Chat route called", extra={'conversation_id': conversation_id})
+
+    try:
+        before = decode_cursor(request.args['before']) if request.args.get('before') else None
+    except ValueError:
+        before = None
+    page_size = parse_page_size(request.args.get('limit'))
 
     if not conversation_id:
-        print("No conversation ID provided")
+        logger.debug("No conversation ID provided")
         flash('No conversation selected.', 'warning')
         return redirect(url_for('home'))
 
@@ -503,24 +1499,29 @@ def chat():
             flash('User not found.', 'error')
             return redirect(url_for('home'))
 
+        # Opening the conversation reads it
+        if conversation.get('unread_count', {}).get(session['user_id']):
+            mark_conversation_read(session['user_id'], conversation_id)
+
         # Get messages and media
-        print(f"Getting messages for conversation {conversation_id}")
-        conversation_messages = get_conversation_messages(conversation_id)
-        print(f"Found {len(conversation_messages)} messages")
+        conversation_messages, older_cursor = get_conversation_messages(conversation_id, limit=page_size, before=before)
+        logger.debug("Loaded chat messages", extra={'conversation_id': conversation_id, 'count': len(conversation_messages)})
 
-        print(f"Getting media for conversation {conversation_id}")
         conversation_media = get_conversation_media(conversation_id)
-        print(f"Found {len(conversation_media)} media files")
+        logger.debug("Loaded chat media", extra={'conversation_id': conversation_id, 'count': len(conversation_media)})
 
         return render_template('chat.html',
                              user=session,
                              conversation_id=conversation_id,
                              other_user=other_user,
                              messages=conversation_messages,
-                             shared_media=conversation_media)
+                             older_cursor=older_cursor,
+                             page_size=page_size,
+                             shared_media=conversation_media,
+                             presence_heartbeat_seconds=PRESENCE_HEARTBEAT_SECONDS)
 
-    except Exception as e:
-        print(f"Error loading chat: {e}")
+    except Exception:
+        logger.exception("Error loading chat")
         flash('Error loading conversation.', 'error')
         return redirect(url_for('home'))
 
@@ -540,67 +1541,374 @@ def send_message():
             return jsonify({'success': False, 'error': 'Missing required fields'}), 400
 
         # Verify user is part of conversation
-        conversation = conversations.find_one({'_id': ObjectId(conversation_id)})
-        if not conversation or ObjectId(session['user_id']) not in conversation['participants']:
+        if not is_participant(session['user_id'], conversation_id):
             return jsonify({'success': False, 'error': 'Access denied'}), 403
 
-        # Create message
-        message_data = {
-            'conversation_id': ObjectId(conversation_id),
-            'sender_id': ObjectId(session['user_id']),
-            'content': content,
-            'timestamp': datetime.now(timezone.utc),
-            'message_type': 'text'
-        }
+        message = send_text_message(conversation_id, session['user_id'], session['username'], content)
+        return jsonify({'success': True, 'message': message})
+
+    except Exception:
+        logger.exception("Error sending message")
+        return jsonify({'success': False, 'error': 'Failed to send message'}), 500
+
+@app.route('/api/get_messages/<conversation_id>')
+def get_messages(conversation_id):
+    """Get a page of messages for a conversation.
+
+    Query parameters: ``before`` or ``after`` (cursor from a previous response
+    or message) and ``limit`` (page size). Without a cursor the newest page is
+    returned.
+    """
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Not authenticated'}), 401
+
+    try:
+        before = decode_cursor(request.args['before']) if request.args.get('before') else None
+        after = decode_cursor(request.args['after']) if request.args.get('after') else None
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+
+    if before and after:
+        return jsonify({'success': False, 'error': 'Use either before or after, not both'}), 400
 
-        result = messages.insert_one(message_data)
-
-        # Update conversation last message
-        conversations.update_one(
-            {'_id': ObjectId(conversation_id)},
-            {
-                '$set': {
-                    'last_message': content,
-                    'last_message_time': datetime.now(timezone.utc)
-                }
-            }
+    try:
+        # Verify user is part of conversation
+        if not is_participant(session['user_id'], conversation_id):
+            return jsonify({'success': False, 'error': 'Access denied'}), 403
+
+        conversation_messages, next_cursor = get_conversation_messages(
+            conversation_id,
+            limit=parse_page_size(request.args.get('limit')),
+            before=before,
+            after=after
         )
+        return jsonify({
+            'success': True,
+            'messages': conversation_messages,
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
+        })
+
+    except Exception:
+        logger.exception("Error getting messages")
+        return jsonify({'success': False, 'error': 'Failed to get messages'}), 500
 
+@app.route('/api/search')
+def search_api():
+    """Search messages in the current user's conversations.
+
+    ``q`` is required; ``conversation_id`` narrows the search to one
+    conversation. Results are newest first and paged with ``before``/``limit``.
+    """
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Not authenticated'}), 401
+
+    query = request.args.get('q', '').strip()
+    if not search.query_terms(query):
+        return jsonify({'success': False, 'error': 'Search query is required'}), 400
+
+    try:
+        before = decode_cursor(request.args['before']) if request.args.get('before') else None
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+
+    conversation_id = request.args.get('conversation_id')
+    try:
+        if conversation_id and not is_participant(session['user_id'], conversation_id):
+            return jsonify({'success': False, 'error': 'Access denied'}), 403
+
+        results, next_cursor = search_messages(
+            session['user_id'],
+            query,
+            limit=parse_page_size(request.args.get('limit')),
+            before=before,
+            conversation_id=conversation_id
+        )
         return jsonify({
             'success': True,
-            'message': {
-                'id': str(result.inserted_id),
-                'content': content,
-                'sender': {
-                    'id': session['user_id'],
-                    'name': session['username']
-                },
-                'timestamp': datetime.now(timezone.utc).isoformat()
-            }
+            'results': results,
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
         })
 
-    except Exception as e:
-        print(f"Error sending message: {e}")
-        return jsonify({'success': False, 'error': 'Failed to send message'}), 500
+    except Exception:
+        logger.exception("Error searching messages")
+        return jsonify({'success': False, 'error': 'Failed to search messages'}), 500
 
-@app.route('/api/get_messages/<conversation_id>')
-def get_messages(conversation_id):
-    """Get messages for a conversation"""
+@app.route('/api/mark_read', methods=['POST'])
+def mark_read():
+    """Reset the current user's unread counter for a conversation"""
     if 'user_id' not in session:
         return jsonify({'success': False, 'error': 'Not authenticated'}), 401
 
     try:
+        data = request.get_json()
+        conversation_id = data.get('conversation_id')
+        if not conversation_id:
+            return jsonify({'success': False, 'error': 'Missing conversation ID'}), 400
+
         # Verify user is part of conversation
-        conversation = conversations.find_one({'_id': ObjectId(conversation_id)})
-        if not conversation or ObjectId(session['user_id']) not in conversation['participants']:
+        if not is_participant(session['user_id'], conversation_id):
             return jsonify({'success': False, 'error': 'Access denied'}), 403
 
-        conversation_messages = get_conversation_messages(conversation_id)
-        return jsonify({'success': True, 'messages': conversation_messages})
+        mark_conversation_read(session['user_id'], conversation_id)
+        return jsonify({'success': True, 'unread_total': get_unread_total(session['user_id'])})
 
-    except Exception as e:
-        print(f"Error getting messages: {e}")
-        return jsonify({'success': False, 'error': 'Failed to get messages'}), 500
+    except Exception:
+        logger.exception("Error marking conversation read")
+        return jsonify({'success': False, 'error': 'Failed to mark conversation read'}), 500
+
+@app.route('/api/unread_total')
+def unread_total():
+    """Total unread messages across the current user's conversations"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Not authenticated'}), 401
+
+    try:
+        return jsonify({'success': True, 'unread_total': get_unread_total(session['user_id'])})
+    except Exception:
+        logger.exception("Error getting unread total")
+        return jsonify({'success': False, 'error': 'Failed to get unread total'}), 500
+
+@app.route('/api/stream/<conversation_id>')
+def stream_messages(conversation_id):
+    """Server-Sent Events stream of live events for a conversation.
+
+    Reconnecting clients send Last-Event-ID and only receive what they missed;
+    if that is no longer available a ``resync`` event tells them to reload.
+    """
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Not authenticated'}), 401
+
+    try:
+        # Verify user is part of conversation
+        if not is_participant(session['user_id'], conversation_id):
+            return jsonify({'success': False, 'error': 'Access denied'}), 403
+    except Exception:
+        logger.exception("Error opening stream")
+        return jsonify({'success': False, 'error': 'Failed to open stream'}), 500
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    subscription, replay = broker.subscribe(conversation_id, last_event_id)
+
+    def generate():
+        try:
+            # Tell the browser how long to wait before reconnecting
+            yield "retry: 3000\n\n"
+            if replay is None:
+                yield "event: resync\ndata: {}\n\n"
+            else:
+                for event in replay:
+                    yield format_sse(event)
+
+            while True:
+                event = subscription.get(timeout=STREAM_HEARTBEAT_SECONDS)
+                if subscription.overflowed:
+                    # The client fell too far behind; make it resync and reconnect
+                    yield "event: resync\ndata: {}\n\n"
+                    break
+                if event is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_sse(event)
+        finally:
+            subscription.close()
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def same_origin():
+    """Whether a browser request was made by one of our own pages"""
+    origin = request.headers.get('Origin')
+    return not origin or urlparse(origin).netloc == request.host
+
+@app.route('/ws', websocket=True)
+def websocket_gateway():
+    """WebSocket connection for messages, typing indicators and delivery acks.
+
+    The session is checked once at the handshake; after that every frame is
+    served from the connection without a session decode.
+    """
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Not authenticated'}), 401
+
+    # Browsers send cookies on cross-site WebSocket handshakes
+    if not same_origin():
+        return jsonify({'success': False, 'error': 'Cross-origin WebSocket rejected'}), 403
+
+    try:
+        ws = WebSocket.accept(request.environ, max_message_size=WS_MAX_MESSAGE_SIZE)
+    except ProtocolError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    # A connection's lifetime is not a request latency
+    request.metrics_started = None
+    gateway.serve(ws, session['user_id'], session['username'])
+    return UpgradedResponse()
+
+def ws_conversation_id(frame):
+    conversation_id = frame.get('conversation_id')
+    if isinstance(conversation_id, str) and ObjectId.is_valid(conversation_id):
+        return conversation_id
+    return None
+
+def ws_error(error):
+    return {'type': 'error', 'error': error}
+
+@gateway.on_connect
+def connection_opened(connection):
+    presence.heartbeat(connection.user_id)
+
+@gateway.on_disconnect
+def connection_closed(connection):
+    if not gateway.registry.for_user(connection.user_id):
+        presence.disconnect(connection.user_id)
+
+@gateway.handler('presence')
+def ws_presence(connection, frame):
+    """Presence heartbeat; ``idle: true`` when the page is hidden or untouched"""
+    presence.heartbeat(connection.user_id, idle=bool(frame.get('idle')))
+    return None
+
+@gateway.handler('subscribe')
+def ws_subscribe(connection, frame):
+    """Receive a conversation's events, first replaying any missed since last_event_id"""
+    conversation_id = ws_conversation_id(frame)
+    if conversation_id is None:
+        return ws_error('Invalid conversation_id')
+    if conversation_id not in connection.conversations:
+        if len(connection.conversations) >= WS_MAX_SUBSCRIPTIONS:
+            return ws_error('Too many subscriptions')
+        if not is_participant(connection.user_id, conversation_id):
+            return ws_error('Access denied')
+        gateway.registry.join(connection, conversation_id)
+
+    last_event_id = frame.get('last_event_id')
+    replay = broker.history_since(conversation_id, str(last_event_id)) if last_event_id else []
+    if replay is None:
+        connection.send({'type': 'resync', 'conversation_id': conversation_id})
+    else:
+        for event in replay:
+            connection.send(gateway_event(conversation_id, event))
+    return {'type': 'subscribed', 'conversation_id': conversation_id}
+
+@gateway.handler('unsubscribe')
+def ws_unsubscribe(connection, frame):
+    conversation_id = ws_conversation_id(frame)
+    if conversation_id is not None:
+        gateway.registry.leave(connection, conversation_id)
+    return {'type': 'unsubscribed', 'conversation_id': conversation_id}
+
+@gateway.handler('message')
+def ws_send_message(connection, frame):
+    """Send a text message; subscribed conversations need no membership lookup"""
+    conversation_id = ws_conversation_id(frame)
+    content = frame.get('content')
+    content = content.strip() if isinstance(content, str) else ''
+    if not conversation_id or not content:
+        return ws_error('Missing required fields')
+    if conversation_id not in connection.conversations and not is_participant(connection.user_id, conversation_id):
+        return ws_error('Access denied')
+
+    message = send_text_message(conversation_id, connection.user_id, connection.username, content, skip=connection)
+    return {'type': 'sent', 'conversation_id': conversation_id, 'message': message}
+
+@gateway.handler('typing')
+def ws_typing(connection, frame):
+    """Relay a typing indicator to the other participants; never stored"""
+    conversation_id = ws_conversation_id(frame)
+    if conversation_id not in connection.conversations:
+        return ws_error('Not subscribed')
+    publish_frame(conversation_id, {
+        'type': 'typing',
+        'conversation_id': conversation_id,
+        'user': {'id': connection.user_id, 'name': connection.username},
+        'typing': bool(frame.get('typing', True))
+    }, exclude_user=connection.user_id)
+    return None
+
+@gateway.handler('ack')
+def ws_ack(connection, frame):
+    """Delivery receipt for a message, relayed to the other participants.
+
+    With ``read: true`` the conversation is also marked read.
+    """
+    conversation_id = ws_conversation_id(frame)
+    message_id = frame.get('message_id')
+    if conversation_id not in connection.conversations:
+        return ws_error('Not subscribed')
+    if not isinstance(message_id, str) or not ObjectId.is_valid(message_id):
+        return ws_error('Invalid message_id')
+
+    publish_frame(conversation_id, {
+        'type': 'delivered',
+        'conversation_id': conversation_id,
+        'message_id': message_id,
+        'user_id': connection.user_id
+    }, exclude_user=connection.user_id)
+    if frame.get('read'):
+        mark_conversation_read(connection.user_id, conversation_id)
+    return None
+
+@app.route('/api/conversations')
+def list_conversations():
+    """Get a page of the current user's conversations.
+
+    Query parameters: ``before`` (cursor from a previous response) and ``limit``.
+    """
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Not authenticated'}), 401
+
+    try:
+        before = decode_cursor(request.args['before']) if request.args.get('before') else None
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+
+    limit = parse_page_size(request.args.get('limit'), default=CONVERSATION_PAGE_SIZE)
+    if before:
+        user_conversations, next_cursor = get_user_conversations(session['user_id'], limit=limit, before=before)
+    else:
+        dashboard = get_dashboard(session['user_id'], limit=limit)
+        user_conversations, next_cursor = dashboard['conversations'], dashboard['next_cursor']
+    return jsonify({
+        'success': True,
+        'conversations': user_conversations,
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None
+    })
+
+@app.route('/api/sync')
+def sync():
+    """Incremental sync across all of the current user's conversations.
+
+    Pass the token from the previous response as ``since``. Without one, or
+    with a token older than deletion history is kept, the response has
+    ``reset: true`` and the client should reload its conversations in full.
+    Results may overlap the previous sync slightly; clients dedupe by id.
+    """
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Not authenticated'}), 401
+
+    since_token = request.args.get('since')
+    if not since_token:
+        return jsonify({'success': True, 'reset': True, 'token': encode_sync_token(datetime.now(timezone.utc))})
+
+    try:
+        since, after = decode_sync_token(since_token)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid sync token'}), 400
+
+    if since < datetime.now(timezone.utc) - timedelta(days=TOMBSTONE_RETENTION_DAYS):
+        return jsonify({'success': True, 'reset': True, 'token': encode_sync_token(datetime.now(timezone.utc))})
+
+    try:
+        changes = get_account_changes(session['user_id'], since, after)
+        return jsonify({'success': True, 'reset': False, **changes})
+    except Exception:
+        logger.exception("Error syncing")
+        return jsonify({'success': False, 'error': 'Failed to sync'}), 500
 
 @app.route('/api/create_conversation', methods=['POST'])
 def create_conversation_api():
@@ -635,8 +1943,8 @@ def create_conversation_api():
         else:
             return jsonify({'success': False, 'error': 'Failed to create conversation'}), 500
 
-    except Exception as e:
-        print(f"Error creating conversation: {e}")
+    except Exception:
+        logger.exception("Error creating conversation")
         return jsonify({'success': False, 'error': 'Failed to create conversation'}), 500
 
 @app.route('/api/upload_file', methods=['POST'])
@@ -651,8 +1959,7 @@ def upload_file():
             return jsonify({'success': False, 'error': 'Missing conversation ID'}), 400
 
         # Verify user is part of conversation
-        conversation = conversations.find_one({'_id': ObjectId(conversation_id)})
-        if not conversation or ObjectId(session['user_id']) not in conversation['participants']:
+        if not is_participant(session['user_id'], conversation_id):
             return jsonify({'success': False, 'error': 'Access denied'}), 403
 
         # Check if file was uploaded
@@ -668,51 +1975,11 @@ def upload_file():
         if not file_info:
             return jsonify({'success': False, 'error': 'Invalid file type or upload failed'}), 400
 
-        # Create message
-        message_data = {
-            'conversation_id': ObjectId(conversation_id),
-            'sender_id': ObjectId(session['user_id']),
-            'content': f"Shared {file_info['original_name']}",
-            'timestamp': datetime.now(timezone.utc),
-            'message_type': file_info['file_type'],
-            'file_name': file_info['filename'],
-            'original_name': file_info['original_name'],
-            'file_size': file_info['file_size'],
-            'file_path': file_info['file_path']
-        }
-
-        result = messages.insert_one(message_data)
-
-        # Update conversation last message
-        conversations.update_one(
-            {'_id': ObjectId(conversation_id)},
-            {
-                '$set': {
-                    'last_message': f"📎 {file_info['original_name']}",
-                    'last_message_time': datetime.now(timezone.utc)
-                }
-            }
-        )
-
-        return jsonify({
-            'success': True,
-            'message': {
-                'id': str(result.inserted_id),
-                'content': message_data['content'],
-                'sender': {
-                    'id': session['user_id'],
-                    'name': session['username']
-                },
-                'timestamp': datetime.now(timezone.utc).isoformat(),
-                'message_type': file_info['file_type'],
-                'file_name': file_info['filename'],
-                'original_name': file_info['original_name'],
-                'file_size': file_info['file_size']
-            }
-        })
+        message, job_id = send_file_message(conversation_id, file_info)
+        return jsonify({'success': True, 'message': message, 'job_id': str(job_id) if job_id else None})
 
-    except Exception as e:
-        print(f"Error uploading file: {e}")
+    except Exception:
+        logger.exception("Error uploading file")
         return jsonify({'success': False, 'error': 'Failed to upload file'}), 500
 
 @app.route('/api/upload_voice', methods=['POST'])
@@ -727,8 +1994,7 @@ def upload_voice():
             return jsonify({'success': False, 'error': 'Missing conversation ID'}), 400
 
         # Verify user is part of conversation
-        conversation = conversations.find_one({'_id': ObjectId(conversation_id)})
-        if not conversation or ObjectId(session['user_id']) not in conversation['participants']:
+        if not is_participant(session['user_id'], conversation_id):
             return jsonify({'success': False, 'error': 'Access denied'}), 403
 
         # Check if voice file was uploaded
@@ -744,83 +2010,373 @@ def upload_voice():
         if not file_info:
             return jsonify({'success': False, 'error': 'Failed to save voice message'}), 400
 
-        # Create message
-        message_data = {
-            'conversation_id': ObjectId(conversation_id),
-            'sender_id': ObjectId(session['user_id']),
-            'content': "🎵 Voice message",
-            'timestamp': datetime.now(timezone.utc),
-            'message_type': 'audio',
-            'file_name': file_info['filename'],
-            'original_name': file_info['original_name'],
-            'file_size': file_info['file_size'],
-            'file_path': file_info['file_path']
-        }
+        message, job_id = send_file_message(conversation_id, file_info, is_voice=True)
+        return jsonify({'success': True, 'message': message, 'job_id': str(job_id) if job_id else None})
 
-        result = messages.insert_one(message_data)
-
-        # Update conversation last message
-        conversations.update_one(
-            {'_id': ObjectId(conversation_id)},
-            {
-                '$set': {
-                    'last_message': "🎵 Voice message",
-                    'last_message_time': datetime.now(timezone.utc)
-                }
-            }
-        )
+    except Exception:
+        logger.exception("Error uploading voice")
+        return jsonify({'success': False, 'error': 'Failed to upload voice message'}), 500
+
+@app.route('/api/uploads', methods=['POST'])
+def init_upload():
+    """Start a resumable chunked upload.
+
+    JSON body: conversation_id, filename, size and kind ('file' or 'voice').
+    Chunks are then sent with PUT /api/uploads/<upload_id> and an
+    Upload-Offset header, and the message is created by
+    POST /api/uploads/<upload_id>/complete.
+    """
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Not authenticated'}), 401
+
+    try:
+        data = request.get_json()
+        conversation_id = data.get('conversation_id')
+        filename = data.get('filename', '')
+        kind = data.get('kind', 'file')
+
+        try:
+            size = int(data.get('size'))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'File size is required'}), 400
+
+        if not conversation_id or not filename:
+            return jsonify({'success': False, 'error': 'Missing required fields'}), 400
+
+        if kind not in ('file', 'voice'):
+            return jsonify({'success': False, 'error': 'Invalid upload kind'}), 400
+
+        if not allowed_file(secure_filename(filename)):
+            return jsonify({'success': False, 'error': 'Invalid file type'}), 400
+
+        if size < 0 or size > MAX_FILE_SIZE:
+            return jsonify({'success': False, 'error': 'File is too large'}), 413
+
+        # Verify user is part of conversation
+        if not is_participant(session['user_id'], conversation_id):
+            return jsonify({'success': False, 'error': 'Access denied'}), 403
+
+        upload_id = uuid.uuid4().hex
+        chunked_uploads.create_partial(os.path.join(PARTIAL_UPLOAD_FOLDER, upload_id))
+        upload_sessions.insert_one({
+            '_id': upload_id,
+            'user_id': ObjectId(session['user_id']),
+            'conversation_id': ObjectId(conversation_id),
+            'original_name': filename,
+            'kind': kind,
+            'size': size,
+            'offset': 0,
+            'status': 'uploading',
+            'created_at': datetime.now(timezone.utc),
+            'updated_at': datetime.now(timezone.utc)
+        })
 
         return jsonify({
             'success': True,
-            'message': {
-                'id': str(result.inserted_id),
-                'content': message_data['content'],
-                'sender': {
-                    'id': session['user_id'],
-                    'name': session['username']
-                },
-                'timestamp': datetime.now(timezone.utc).isoformat(),
-                'message_type': 'audio',
-                'file_name': file_info['filename'],
-                'original_name': file_info['original_name'],
-                'file_size': file_info['file_size']
-            }
+            'upload_id': upload_id,
+            'offset': 0,
+            'chunk_size': UPLOAD_CHUNK_SIZE
         })
 
-    except Exception as e:
-        print(f"Error uploading voice: {e}")
-        return jsonify({'success': False, 'error': 'Failed to upload voice message'}), 500
+    except Exception:
+        logger.exception("Error starting upload")
+        return jsonify({'success': False, 'error': 'Failed to start upload'}), 500
+
+def get_upload_session(upload_id):
+    """Fetch an upload session owned by the current user"""
+    return upload_sessions.find_one({'_id': upload_id, 'user_id': ObjectId(session['user_id'])})
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    """Report the last acknowledged offset so an interrupted upload can resume"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Not authenticated'}), 401
+
+    upload = get_upload_session(upload_id)
+    if not upload:
+        return jsonify({'success': False, 'error': 'Upload not found'}), 404
+
+    return jsonify({
+        'success': True,
+        'offset': upload['offset'],
+        'size': upload['size'],
+        'status': upload['status']
+    })
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """Append the request body to an upload at the offset in Upload-Offset"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Not authenticated'}), 401
+
+    try:
+        upload = get_upload_session(upload_id)
+        if not upload:
+            return jsonify({'success': False, 'error': 'Upload not found'}), 404
+
+        if upload['status'] != 'uploading':
+            return jsonify({'success': False, 'error': 'Upload is already complete'}), 409
+
+        try:
+            offset = int(request.headers.get('Upload-Offset', request.args.get('offset')))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'Upload-Offset header is required'}), 400
+
+        if offset != upload['offset']:
+            return jsonify({'success': False, 'error': 'Offset mismatch', 'offset': upload['offset']}), 409
+
+        if request.content_length and request.content_length > MAX_UPLOAD_CHUNK_SIZE:
+            return jsonify({'success': False, 'error': 'Chunk is too large'}), 413
+
+        partial_path = os.path.join(PARTIAL_UPLOAD_FOLDER, upload_id)
+        try:
+            new_offset = chunked_uploads.append_chunk(
+                partial_path, upload_id, offset, request.stream,
+                min(upload['size'] - offset, MAX_UPLOAD_CHUNK_SIZE)
+            )
+        except chunked_uploads.ChunkError as e:
+            return jsonify({'success': False, 'error': str(e), 'offset': offset}), 400
+
+        # Only acknowledge the chunk if nobody else advanced the upload meanwhile
+        result = upload_sessions.update_one(
+            {'_id': upload_id, 'offset': offset},
+            {'$set': {'offset': new_offset, 'updated_at': datetime.now(timezone.utc)}}
+        )
+        if result.matched_count == 0:
+            current = get_upload_session(upload_id)
+            return jsonify({'success': False, 'error': 'Offset mismatch', 'offset': current['offset']}), 409
+
+        return jsonify({'success': True, 'offset': new_offset, 'size': upload['size']})
+
+    except Exception:
+        logger.exception("Error uploading chunk")
+        return jsonify({'success': False, 'error': 'Failed to upload chunk'}), 500
+
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """Finish a chunked upload and send it as a message, like upload_file"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Not authenticated'}), 401
+
+    try:
+        upload = get_upload_session(upload_id)
+        if not upload:
+            return jsonify({'success': False, 'error': 'Upload not found'}), 404
+
+        # A retried completion returns the message created the first time
+        if upload['status'] == 'complete':
+            return jsonify({'success': True, 'message': upload['message'], 'job_id': upload.get('job_id')})
+
+        if upload['offset'] != upload['size']:
+            return jsonify({'success': False, 'error': 'Upload is incomplete', 'offset': upload['offset']}), 409
+
+        claimed = upload_sessions.find_one_and_update(
+            {'_id': upload_id, 'status': 'uploading', 'offset': upload['size']},
+            {'$set': {'status': 'finalizing', 'updated_at': datetime.now(timezone.utc)}}
+        )
+        if not claimed:
+            return jsonify({'success': False, 'error': 'Upload is already being completed'}), 409
+
+        partial_path = os.path.join(PARTIAL_UPLOAD_FOLDER, upload_id)
+        sha256 = chunked_uploads.finish(partial_path, upload_id, upload['size'])
+        file_info = store_completed_upload(partial_path, upload['original_name'], sha256)
+        message, job_id = send_file_message(str(upload['conversation_id']), file_info, is_voice=upload['kind'] == 'voice')
+
+        job_id = str(job_id) if job_id else None
+        upload_sessions.update_one(
+            {'_id': upload_id},
+            {'$set': {'status': 'complete', 'message': message, 'job_id': job_id, 'updated_at': datetime.now(timezone.utc)}}
+        )
+
+        return jsonify({'success': True, 'message': message, 'job_id': job_id})
+
+    except Exception:
+        logger.exception("Error completing upload")
+        upload_sessions.update_one({'_id': upload_id, 'status': 'finalizing'}, {'$set': {'status': 'uploading'}})
+        return jsonify({'success': False, 'error': 'Failed to complete upload'}), 500
+
+def purge_stale_uploads():
+    """Remove partial files whose upload session has expired"""
+    cutoff = datetime.now(timezone.utc).timestamp() - STALE_UPLOAD_HOURS * 60 * 60
+    removed = 0
+    for upload_id in os.listdir(PARTIAL_UPLOAD_FOLDER):
+        partial_path = os.path.join(PARTIAL_UPLOAD_FOLDER, upload_id)
+        if os.path.getmtime(partial_path) > cutoff:
+            continue
+        if upload_sessions.find_one({'_id': upload_id, 'status': 'uploading'}, {'_id': 1}):
+            continue
+        os.remove(partial_path)
+        chunked_uploads.discard_state(upload_id)
+        removed += 1
+    return removed
+
+@app.cli.command('purge-uploads')
+def purge_uploads_command():
+    """Delete abandoned partial chunked uploads"""
+    click.echo(f"Removed {purge_stale_uploads()} stale partial uploads")
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    """Status of a background job started by the current user"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Not authenticated'}), 401
+
+    try:
+        job = job_queue.get(ObjectId(job_id))
+    except Exception:
+        job = None
+
+    if not job or job.get('owner_id') != session['user_id']:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+
+    return jsonify({
+        'success': True,
+        'job': {
+            'id': str(job['_id']),
+            'name': job['name'],
+            'status': job['status'],
+            'attempts': job['attempts'],
+            'max_attempts': job['max_attempts'],
+            'error': job.get('error'),
+            'result': job.get('result'),
+            'created_at': job['created_at'],
+            'updated_at': job['updated_at']
+        }
+    })
+
+def format_last_seen(seen_at):
+    if isinstance(seen_at, datetime):
+        return seen_at.replace(tzinfo=seen_at.tzinfo or timezone.utc).isoformat()
+    return datetime.fromtimestamp(seen_at, timezone.utc).isoformat() if seen_at else None
+
+@app.route('/api/presence')
+def get_presence():
+    """Presence of many users at once: ``?ids=<user_id>,<user_id>,...``
+
+    Only the caller and people who share a conversation with them are
+    answered; other ids are left out.
+    """
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Not authenticated'}), 401
+
+    user_ids = list(dict.fromkeys(i for i in request.args.get('ids', '').split(',') if i))
+    if not user_ids:
+        return jsonify({'success': False, 'error': 'Missing ids'}), 400
+    if len(user_ids) > PRESENCE_MAX_IDS:
+        return jsonify({'success': False, 'error': f'At most {PRESENCE_MAX_IDS} ids per request'}), 400
+    if not all(ObjectId.is_valid(user_id) for user_id in user_ids):
+        return jsonify({'success': False, 'error': 'Invalid user id'}), 400
+
+    try:
+        current_user = session['user_id']
+        others = [ObjectId(user_id) for user_id in user_ids if user_id != current_user]
+        visible = {current_user}
+        if others:
+            visible.update(str(user_id) for user_id in conversations.distinct('participants', {'$and': [
+                {'participants': ObjectId(current_user)},
+                {'participants': {'$in': others}}
+            ]}))
+
+        statuses = presence.statuses([user_id for user_id in user_ids if user_id in visible])
+        # Offline users' last heartbeat was persisted when they went offline
+        unknown = [ObjectId(user_id) for user_id, state in statuses.items() if state['last_seen'] is None]
+        if unknown:
+            for user in users.find({'_id': {'$in': unknown}, 'last_seen': {'$ne': None}}, {'last_seen': 1}):
+                statuses[str(user['_id'])]['last_seen'] = user['last_seen']
+        for state in statuses.values():
+            state['last_seen'] = format_last_seen(state['last_seen'])
+
+        return jsonify({'success': True, 'presence': statuses})
+    except Exception:
+        logger.exception("Error getting presence")
+        return jsonify({'success': False, 'error': 'Failed to get presence'}), 500
+
+@app.route('/api/presence/heartbeat', methods=['POST'])
+def presence_heartbeat():
+    """Presence heartbeat for pages without a WebSocket connection"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Not authenticated'}), 401
+
+    data = request.get_json(silent=True) or {}
+    presence.heartbeat(session['user_id'], idle=bool(data.get('idle')))
+    return jsonify({'success': True, 'status': presence.status(session['user_id'])})
+
+@app.route('/api/cache_stats')
+def cache_stats():
+    """Hit/miss counters for the in-process caches"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Not authenticated'}), 401
+
+    return jsonify({'success': True, 'caches': {
+        'membership': membership_cache.stats(),
+        'participants': participants_cache.stats()
+    }})
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics; set METRICS_TOKEN to require a bearer token"""
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    """Serve uploaded files with proper path handling and download support"""
-    try:
-        # Construct the full path to search for the file
-        for folder in ['images', 'videos', 'audio', 'documents']:
-            file_dir = os.path.join(UPLOAD_FOLDER, folder)
-            file_path = os.path.join(file_dir, filename)
-            
-            if os.path.exists(file_path):
-                # Get MIME type based on file extension
-                content_type, _ = mimetypes.guess_type(file_path)
-                
-                # Handle PDFs: force download instead of preview
-                if filename.lower().endswith('.pdf'):
-                    return send_file(
-                        file_path,
-                        mimetype='application/pdf',
-                        as_attachment=True,
-                        download_name=filename
-                    )
-                
-                # Return the file with appropriate content type
-                return send_file(file_path, mimetype=content_type)
+    """Serve uploaded files with validators, range requests and download support.
 
-        # If we get here, the file wasn't found
-        print(f"File not found: {filename}")
+    Stored names are content hashes or random ids and never change content,
+    so responses are cacheable forever. Conditional requests get 304 and
+    Range requests get 206 for media seeking.
+    """
+    try:
+        # Files live in the folder their extension maps to, as recorded in file_path
+        if '/' in filename:
+            folder, name = filename.split('/', 1)
+        else:
+            original_name = thumbnails.source_name(filename) if thumbnails.is_thumbnail(filename) else filename
+            folder, name = get_file_folder(get_file_type(original_name)), filename
+
+        if folder not in UPLOAD_SUBFOLDERS or not name or name != os.path.basename(name):
+            return jsonify({'error': 'File not found'}), 404
+
+        file_path = os.path.join(UPLOAD_FOLDER, folder, name)
+
+        # Content-addressed names are the file's SHA-256: a free strong ETag
+        stem = name.split('.', 1)[0]
+        etag = stem if SHA256_PATTERN.match(stem) else True
+
+        if thumbnails.is_thumbnail(name):
+            # Thumbnails that were never generated are made on first request
+            if not os.path.exists(file_path):
+                source_path = os.path.join(UPLOAD_FOLDER, folder, thumbnails.source_name(name))
+                if not thumbnails.generate_thumbnail(source_path):
+                    return jsonify({'error': 'File not found'}), 404
+            if etag is not True:
+                etag = f"{etag}-thumbnail"
+
+        # Handle PDFs: force download instead of preview
+        if name.lower().endswith('.pdf'):
+            response = send_file(
+                file_path,
+                mimetype='application/pdf',
+                as_attachment=True,
+                download_name=name,
+                etag=etag,
+                max_age=UPLOAD_CACHE_MAX_AGE
+            )
+        else:
+            # Get MIME type based on file extension
+            content_type, _ = mimetypes.guess_type(name)
+            response = send_file(file_path, mimetype=content_type, etag=etag, max_age=UPLOAD_CACHE_MAX_AGE)
+
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+    except FileNotFoundError:
+        logger.warning("File not found: %s", filename)
         return jsonify({'error': 'File not found'}), 404
-    except Exception as e:
-        print(f"Error serving file: {e}")
+    except Exception:
+        logger.exception("Error serving file")
         return jsonify({'error': 'Error serving file'}), 500
 
 @app.route('/api/get_media/<conversation_id>')
@@ -831,15 +2387,14 @@ def get_media(conversation_id):
 
     try:
         # Verify user is part of conversation
-        conversation = conversations.find_one({'_id': ObjectId(conversation_id)})
-        if not conversation or ObjectId(session['user_id']) not in conversation['participants']:
+        if not is_participant(session['user_id'], conversation_id):
             return jsonify({'success': False, 'error': 'Access denied'}), 403
 
         media_files = get_conversation_media(conversation_id)
         return jsonify({'success': True, 'media': media_files})
 
-    except Exception as e:
-        print(f"Error getting media: {e}")
+    except Exception:
+        logger.exception("Error getting media")
         return jsonify({'success': False, 'error': 'Failed to get media'}), 500
 
 @app.route('/api/delete_message', methods=['POST'])
@@ -864,19 +2419,29 @@ def delete_message():
         if str(message['sender_id']) != session['user_id']:
             return jsonify({'success': False, 'error': 'Cannot delete messages from other users'}), 403
 
-        # Delete any associated files if it's a media message
-        if message.get('message_type') in ['image', 'video', 'audio', 'file'] and message.get('file_path'):
-            try:
-                file_path = message['file_path']
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-            except Exception as e:
-                print(f"Error deleting file: {e}")
-
         # Delete the message
         result = messages.delete_one({'_id': ObjectId(message_id)})
-        
+
         if result.deleted_count > 0:
+            # Release the message's file; it is removed once no message uses it
+            if message.get('file_path'):
+                try:
+                    release_blob(message['file_path'])
+                except Exception:
+                    logger.exception("Error deleting file")
+
+            # Leave a tombstone so incremental sync can report the deletion
+            deleted_at = datetime.now(timezone.utc)
+            message_tombstones.insert_one({
+                'message_id': message['_id'],
+                'conversation_id': message['conversation_id'],
+                'deleted_at': deleted_at
+            })
+            conversations.update_one(
+                {'_id': message['conversation_id']},
+                {'$set': {'updated_at': deleted_at}}
+            )
+
             # Update last message in conversation if this was the last message
             conversation = conversations.find_one({'_id': message['conversation_id']})
             if str(conversation.get('last_message', '')) == str(message.get('content', '')):
@@ -906,13 +2471,15 @@ def delete_message():
                             }
                         }
                     )
-                    
+
+            invalidate_dashboards(get_participants(message['conversation_id']))
+            publish_event(message['conversation_id'], 'delete', {'id': message_id})
             return jsonify({'success': True})
             
         return jsonify({'success': False, 'error': 'Failed to delete message'}), 500
 
-    except Exception as e:
-        print(f"Error deleting message: {e}")
+    except Exception:
+        logger.exception("Error deleting message")
         return jsonify({'success': False, 'error': 'Failed to delete message'}), 500
 
 # Error handlers
@@ -0,0 +1,366 @@
+"""
+ASGI entry point for the ChatFlow application.
+Long-lived connections run as coroutines on the event loop: the WebSocket
+gateway and the Server-Sent Events streams hold no thread while idle, so
+thousands of them share the small pools below. Sending a message is also
+served natively, writing the message and its conversation summary
+concurrently through the async data layer. Every other route is the
+regular Flask view, run on a bounded thread pool.
+
+Run with an ASGI server, e.g. `uvicorn asgi:application --workers 4`.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import io
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import time
+
+from flask import session
+from werkzeug.wrappers import Request
+
+import app as chat_app
+from async_db import AsyncMongo
+
+logger = logging.getLogger('chatflow.asgi')
+
+# Threads for Flask views and gateway handlers, and for database calls
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 16))
+ASYNC_MONGO_WORKERS = int(os.environ.get('ASYNC_MONGO_WORKERS', 16))
+
+# A send_message body is a small JSON document; the gateway allows the same for its frames
+SEND_MESSAGE_MAX_BYTES = chat_app.WS_MAX_MESSAGE_SIZE
+
+# Request bodies past this size are spooled to a temporary file instead of held in memory
+REQUEST_SPOOL_BYTES = 1024 * 1024
+
+STREAM_PATH = re.compile(r'^/api/stream/([^/]+)$')
+
+def build_environ(scope, body=b''):
+    """WSGI environ for an ASGI HTTP or WebSocket scope"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client')
+    environ = {
+        'REQUEST_METHOD': scope.get('method', 'GET'),
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]) if server[1] is not None else '80',
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0] if client else '',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http').replace('ws', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').lower()
+        value = value.decode('latin-1')
+        if name == 'content-length':
+            continue
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+            continue
+        key = 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+async def read_body(receive, limit=None):
+    """The request body, or None once it grows past limit bytes"""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return b''.join(chunks)
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if limit is not None and size > limit:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+async def spool_body(receive, limit=None, max_memory=REQUEST_SPOOL_BYTES):
+    """The request body in a rewound file, kept in memory up to max_memory bytes.
+
+    Returns (file, size), or (None, size) once the body grows past limit bytes.
+    """
+    body = tempfile.SpooledTemporaryFile(max_size=max_memory)
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if limit is not None and size > limit:
+            body.close()
+            return None, size
+        body.write(chunk)
+        if not message.get('more_body'):
+            break
+    body.seek(0)
+    return body, size
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+async def send_json(send, payload, status=200):
+    body = chat_app.app.json.dumps(payload).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status, 'headers': [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(body)).encode('latin-1'))
+    ]})
+    await send({'type': 'http.response.body', 'body': body})
+
+def session_user(environ):
+    """(user_id, username, same_origin) from the request's session cookie"""
+    with chat_app.app.request_context(environ):
+        return session.get('user_id'), session.get('username'), chat_app.same_origin()
+
+class ChatFlowASGI:
+    """The Flask app behind an ASGI interface, with native real-time routes"""
+
+    def __init__(self, flask_app, threads=ASGI_THREADS, mongo=None):
+        self.flask_app = flask_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi')
+        self.mongo = mongo or AsyncMongo(ASYNC_MONGO_WORKERS)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            match = STREAM_PATH.match(scope['path'])
+            if match and scope['method'] == 'GET':
+                await self.stream_messages(scope, receive, send, match.group(1))
+            elif scope['path'] == '/api/send_message' and scope['method'] == 'POST':
+                await self.send_message(scope, receive, send)
+            else:
+                await self.wsgi(scope, receive, send)
+        elif scope['type'] == 'websocket':
+            await self.websocket(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                self.mongo.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def wsgi(self, scope, receive, send):
+        """Serve a request with the Flask app on the thread pool"""
+        limit = self.flask_app.config.get('MAX_CONTENT_LENGTH')
+        declared = dict(scope.get('headers', ())).get(b'content-length')
+        too_large = limit is not None and declared is not None and declared.isdigit() and int(declared) > limit
+        body, size = (None, 0) if too_large else await spool_body(receive, limit)
+        environ = build_environ(scope)
+        if body is None:
+            # Flask answers with its own 413 without reading the body
+            environ['CONTENT_LENGTH'] = str(limit + 1)
+        else:
+            environ['wsgi.input'], environ['CONTENT_LENGTH'] = body, str(size)
+
+        try:
+            await self._respond(environ, send)
+        finally:
+            if body is not None:
+                body.close()
+
+    async def _respond(self, environ, send):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                   for name, value in headers]
+
+        def call():
+            iterable = self.flask_app(environ, start_response)
+            return iterable, iter(iterable)
+
+        iterable, chunks = await self.run(call)
+        try:
+            chunk = await self.run(next, chunks, None)
+            await send({'type': 'http.response.start', 'status': response['status'],
+                        'headers': response['headers']})
+            while chunk is not None:
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = await self.run(next, chunks, None)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(iterable, 'close'):
+                await self.run(iterable.close)
+
+    async def store_message(self, message_data, last_message):
+        """store_message() with the message insert and the conversation update in flight together"""
+        recipients = await self.mongo.run(chat_app.prepare_message, message_data)
+        if chat_app.message_writer is not None:
+            inserted_id = await self.mongo.run(chat_app.message_writer.submit, message_data, last_message, recipients)
+        else:
+            # With the id assigned here neither write depends on the other
+            inserted_id = message_data.setdefault('_id', chat_app.ObjectId())
+            await asyncio.gather(
+                self.mongo.collection(chat_app.messages).insert_one(message_data),
+                self.mongo.collection(chat_app.conversations).update_one(
+                    {'_id': message_data['conversation_id']},
+                    chat_app.conversation_summary_update(last_message, recipients)
+                )
+            )
+        await self.mongo.run(chat_app.invalidate_dashboards, [message_data['sender_id'], *recipients])
+        return inserted_id
+
+    async def send_text_message(self, conversation_id, user_id, username, content, skip=None):
+        message_data = chat_app.new_text_message(conversation_id, user_id, content)
+        await self.store_message(message_data, content)
+
+        message = chat_app.text_message_event(message_data, username)
+        chat_app.publish_event(conversation_id, 'message', message, skip=skip)
+        return message
+
+    async def send_message(self, scope, receive, send):
+        """POST /api/send_message, served on the event loop"""
+        started = time.perf_counter()
+        status, payload = await self._send_message(scope, receive)
+        await send_json(send, payload, status)
+        chat_app.REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint='send_message', method='POST')
+        chat_app.REQUESTS.inc(endpoint='send_message', method='POST', status=status)
+
+    async def _send_message(self, scope, receive):
+        body = await read_body(receive, SEND_MESSAGE_MAX_BYTES)
+        user_id, username, _ = session_user(build_environ(scope))
+        if user_id is None:
+            return 401, {'success': False, 'error': 'Not authenticated'}
+        if body is None:
+            return 413, {'success': False, 'error': 'Message too large'}
+
+        try:
+            data = json.loads(body) if body else None
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            return 400, {'success': False, 'error': 'Missing required fields'}
+        conversation_id = data.get('conversation_id')
+        content = data.get('content')
+        content = content.strip() if isinstance(content, str) else ''
+        if not conversation_id or not content:
+            return 400, {'success': False, 'error': 'Missing required fields'}
+
+        try:
+            if not await self.mongo.run(chat_app.is_participant, user_id, conversation_id):
+                return 403, {'success': False, 'error': 'Access denied'}
+            message = await self.send_text_message(conversation_id, user_id, username, content)
+            return 200, {'success': True, 'message': message}
+        except Exception:
+            logger.exception("Error sending message")
+            return 500, {'success': False, 'error': 'Failed to send message'}
+
+    async def stream_messages(self, scope, receive, send, conversation_id):
+        """GET /api/stream/<conversation_id>: the SSE stream, waiting on the event loop"""
+        environ = build_environ(scope)
+        user_id, _, _ = session_user(environ)
+        if user_id is None:
+            return await send_json(send, {'success': False, 'error': 'Not authenticated'}, 401)
+        try:
+            if not await self.mongo.run(chat_app.is_participant, user_id, conversation_id):
+                return await send_json(send, {'success': False, 'error': 'Access denied'}, 403)
+        except Exception:
+            logger.exception("Error opening stream")
+            return await send_json(send, {'success': False, 'error': 'Failed to open stream'}, 500)
+
+        request = Request(environ)
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        loop = asyncio.get_running_loop()
+        subscription, replay = chat_app.broker.subscribe(conversation_id, last_event_id, loop=loop)
+        disconnected = loop.create_task(wait_for_disconnect(receive))
+
+        async def write(text):
+            await send({'type': 'http.response.body', 'body': text.encode('utf-8'), 'more_body': True})
+
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no')
+            ]})
+            # Tell the browser how long to wait before reconnecting
+            await write("retry: 3000\n\n")
+            if replay is None:
+                await write("event: resync\ndata: {}\n\n")
+            else:
+                for event in replay:
+                    await write(chat_app.format_sse(event))
+
+            while True:
+                getter = loop.create_task(subscription.get())
+                done, _ = await asyncio.wait({getter, disconnected}, timeout=chat_app.STREAM_HEARTBEAT_SECONDS,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if getter not in done:
+                    getter.cancel()
+                    if disconnected in done:
+                        return
+                    await write(": keep-alive\n\n")
+                    continue
+                if subscription.overflowed:
+                    # The client fell too far behind; make it resync and reconnect
+                    await write("event: resync\ndata: {}\n\n")
+                    break
+                await write(chat_app.format_sse(getter.result()))
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            subscription.close()
+            disconnected.cancel()
+
+    async def websocket(self, scope, receive, send):
+        """The /ws gateway, with every connection served on the event loop"""
+        if scope['path'] != '/ws':
+            await send({'type': 'websocket.close', 'code': 1008})
+            return
+        if (await receive())['type'] != 'websocket.connect':
+            return
+
+        user_id, username, same_origin = session_user(build_environ(scope))
+        # Browsers send cookies on cross-site WebSocket handshakes
+        if user_id is None or not same_origin:
+            await send({'type': 'websocket.close', 'code': 1008})
+            return
+
+        await send({'type': 'websocket.accept'})
+        await chat_app.gateway.serve_async(receive, send, user_id, username, self.executor)
+
+application = ChatFlowASGI(chat_app.app)
+
+@chat_app.gateway.async_handler('message')
+async def ws_message(connection, frame):
+    """The gateway's message frame, storing the message through the async data layer"""
+    conversation_id = chat_app.ws_conversation_id(frame)
+    content = frame.get('content')
+    content = content.strip() if isinstance(content, str) else ''
+    if not conversation_id or not content:
+        return chat_app.ws_error('Missing required fields')
+    if conversation_id not in connection.conversations and not await application.mongo.run(
+            chat_app.is_participant, connection.user_id, conversation_id):
+        return chat_app.ws_error('Access denied')
+
+    message = await application.send_text_message(conversation_id, connection.user_id, connection.username,
+                                                  content, skip=connection)
+    return {'type': 'sent', 'conversation_id': conversation_id, 'message': message}
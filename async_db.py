@@ -0,0 +1,42 @@
+"""
+Async MongoDB access for the ASGI entry point.
+PyMongo calls run on a bounded thread pool and are awaited from the event
+loop, which is also how Motor works under the hood. A coroutine waiting on
+the database holds a pool thread only while its command is in flight, so
+the pool is sized like the MongoDB connection pool rather than like the
+number of open connections.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+
+class AsyncMongo:
+    """Runs blocking database work on a dedicated pool"""
+
+    def __init__(self, workers=16, executor=None):
+        self.executor = executor or ThreadPoolExecutor(max_workers=workers, thread_name_prefix='mongo-async')
+
+    async def run(self, func, *args, **kwargs):
+        """Await func(*args, **kwargs) on the pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    def collection(self, collection):
+        return AsyncCollection(collection, self)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+class AsyncCollection:
+    """Awaitable versions of the collection methods the ASGI routes use"""
+
+    def __init__(self, collection, mongo):
+        self.collection = collection
+        self.mongo = mongo
+
+    async def insert_one(self, *args, **kwargs):
+        return await self.mongo.run(self.collection.insert_one, *args, **kwargs)
+
+    async def update_one(self, *args, **kwargs):
+        return await self.mongo.run(self.collection.update_one, *args, **kwargs)
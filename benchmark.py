@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for the ChatFlow HTTP endpoints.
+The app runs in-process against mongomock through the Flask test client, so
+no MongoDB server or network is needed. A seeded population of users,
+conversations and messages is driven with a weighted mix of requests, and
+latency percentiles, throughput and database commands per request are
+written as JSON so runs can be compared across commits.
+
+Run with `python benchmark.py --requests 2000 --output bench.json`.
+"""
+
+import argparse
+from datetime import datetime, timedelta, timezone
+import io
+import json
+import os
+import random
+import subprocess
+import tempfile
+import time
+from unittest import mock
+
+import bcrypt
+
+OPERATIONS = ['login', 'home', 'get_messages', 'send_message', 'ws_send_message', 'upload_file']
+DEFAULT_MIX = 'get_messages=50,send_message=25,home=15,upload_file=5,login=5'
+PASSWORD = 'password123'
+
+def parse_mix(value):
+    """Parse 'name=weight,...' into a {name: weight} dict"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - set(OPERATIONS)
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Unknown operations: {', '.join(sorted(unknown))}")
+    return mix
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+def load_app(upload_folder):
+    """Import the app against mongomock with inline background jobs"""
+    import mongomock
+
+    os.environ['JOB_WORKERS'] = '0'
+    with mock.patch('pymongo.MongoClient', mongomock.MongoClient):
+        import app as chat_app
+
+    chat_app.app.config['TESTING'] = True
+    chat_app.UPLOAD_FOLDER = upload_folder
+    chat_app.PARTIAL_UPLOAD_FOLDER = os.path.join(upload_folder, 'partial')
+    for folder in ('images', 'videos', 'audio', 'documents', 'partial'):
+        os.makedirs(os.path.join(upload_folder, folder), exist_ok=True)
+    return chat_app
+
+def instrument(chat_app, counter):
+    """Route every app collection through a command-counting proxy"""
+    from db_metrics import CountingCollection
+
+    for name in ('users', 'messages', 'conversations', 'message_tombstones',
+                 'upload_sessions', 'blobs', 'jobs'):
+        setattr(chat_app, name, CountingCollection(getattr(chat_app, name), counter))
+    chat_app.job_queue.collection = chat_app.jobs
+
+def seed(chat_app, rng, user_count, conversation_count, message_count, bcrypt_rounds):
+    """Insert the benchmark population directly; returns (emails by user id, participants by conversation id)"""
+    import search
+
+    db = chat_app.db
+    for collection in ('users', 'conversations', 'messages'):
+        db.drop_collection(collection)
+    chat_app.membership_cache.clear()
+    chat_app.participants_cache.clear()
+    chat_app.dashboard_cache.clear()
+
+    # One hash for everyone: seeding cost should not depend on the user count.
+    # The app targets the same cost, so logins do not pay for a rehash.
+    chat_app.password_hasher.rounds = bcrypt_rounds
+    password_hash = bcrypt.hashpw(PASSWORD.encode('utf-8'), bcrypt.gensalt(rounds=bcrypt_rounds))
+    now = datetime.now(timezone.utc)
+    user_docs = [{
+        'name': f'Bench User {i}',
+        'email': f'bench{i}@example.com',
+        'password': password_hash,
+        'created_at': now,
+        'last_login': None,
+        'is_active': True
+    } for i in range(user_count)]
+    user_ids = db['users'].insert_many(user_docs).inserted_ids
+    emails = {user_id: doc['email'] for user_id, doc in zip(user_ids, user_docs)}
+
+    pairs = set()
+    max_pairs = user_count * (user_count - 1) // 2
+    while len(pairs) < min(conversation_count, max_pairs):
+        first, second = rng.sample(user_ids, 2)
+        pairs.add(tuple(sorted((first, second))))
+    conversation_docs = [{
+        'participants': list(pair),
+        'created_at': now,
+        'last_message': '',
+        'last_message_time': now,
+        'updated_at': now,
+        'unread_count': {str(pair[0]): 0, str(pair[1]): 0}
+    } for pair in sorted(pairs)]
+    conversation_ids = db['conversations'].insert_many(conversation_docs).inserted_ids
+    participants = dict(zip(conversation_ids, (doc['participants'] for doc in conversation_docs)))
+
+    words = ['lunch', 'meeting', 'project', 'deadline', 'weekend', 'coffee', 'report',
+             'draft', 'review', 'call', 'tomorrow', 'today', 'thanks', 'sounds', 'good']
+    start = now - timedelta(seconds=message_count)
+    message_docs = []
+    for i in range(message_count):
+        conversation_id = rng.choice(conversation_ids)
+        content = ' '.join(rng.choices(words, k=rng.randint(3, 12)))
+        message_docs.append({
+            'conversation_id': conversation_id,
+            'sender_id': rng.choice(participants[conversation_id]),
+            'content': content,
+            'timestamp': start + timedelta(seconds=i),
+            'message_type': 'text',
+            'search_terms': search.search_terms(content)
+        })
+        if len(message_docs) >= 10000:
+            db['messages'].insert_many(message_docs)
+            message_docs = []
+    if message_docs:
+        db['messages'].insert_many(message_docs)
+
+    return emails, participants
+
+class NullWebSocket:
+    """Stands in for a client socket; frames are discarded"""
+    closed = False
+    last_received = 0
+
+    def send_frame(self, frame):
+        pass
+
+    def close(self, code=1000, reason='', timeout=1.0):
+        self.closed = True
+
+class FrameResult:
+    """Gives a gateway reply the status_code the report counts errors by"""
+
+    def __init__(self, reply):
+        self.status_code = 400 if reply and reply.get('type') == 'error' else 200
+
+class Simulation:
+    """Issues one operation at a time as a randomly chosen member of a conversation"""
+
+    def __init__(self, chat_app, rng, emails, participants, upload_size):
+        self.chat_app = chat_app
+        self.rng = rng
+        self.emails = emails
+        self.conversations = list(participants.items())
+        self.upload_size = upload_size
+        self.clients = {}
+        self.connections = {}
+
+    def client_for(self, user_id):
+        """A logged-in test client per user, so sessions persist like browsers"""
+        client = self.clients.get(user_id)
+        if client is None:
+            client = self.chat_app.app.test_client()
+            with client.session_transaction() as sess:
+                sess['user_id'] = str(user_id)
+                sess['username'] = f'User {user_id}'
+                sess['email'] = self.emails[user_id]
+            self.clients[user_id] = client
+        return client
+
+    def pick(self):
+        conversation_id, members = self.rng.choice(self.conversations)
+        return str(conversation_id), self.rng.choice(members)
+
+    def login(self):
+        user_id = self.rng.choice(list(self.emails))
+        client = self.chat_app.app.test_client()
+        return client.post('/login', data={'email': self.emails[user_id], 'password': PASSWORD})
+
+    def home(self):
+        _, user_id = self.pick()
+        return self.client_for(user_id).get('/home')
+
+    def get_messages(self):
+        conversation_id, user_id = self.pick()
+        return self.client_for(user_id).get(f'/api/get_messages/{conversation_id}')
+
+    def send_message(self):
+        conversation_id, user_id = self.pick()
+        return self.client_for(user_id).post('/api/send_message', json={
+            'conversation_id': conversation_id,
+            'content': f'benchmark message {self.rng.random()}'
+        })
+
+    def ws_send_message(self):
+        """A send over an already open gateway connection: no session decode or HTTP framing"""
+        from gateway import GatewayConnection
+
+        conversation_id, user_id = self.pick()
+        connection = self.connections.get(user_id)
+        if connection is None:
+            connection = GatewayConnection(NullWebSocket(), user_id, f'User {user_id}')
+            connection.start()
+            self.chat_app.gateway.registry.add(connection)
+            self.connections[user_id] = connection
+
+        replies = []
+        connection.send = lambda payload, droppable=False: replies.append(payload)
+        self.chat_app.gateway.dispatch(connection, json.dumps({
+            'type': 'message',
+            'conversation_id': conversation_id,
+            'content': f'benchmark message {self.rng.random()}'
+        }))
+        return FrameResult(replies[-1] if replies else None)
+
+    def upload_file(self):
+        conversation_id, user_id = self.pick()
+        # Random bytes so content-addressed storage cannot deduplicate them
+        content = self.rng.randbytes(self.upload_size)
+        return self.client_for(user_id).post('/api/upload_file', data={
+            'conversation_id': conversation_id,
+            'file': (io.BytesIO(content), 'notes.txt')
+        }, content_type='multipart/form-data')
+
+def run(args):
+    from db_metrics import CommandCounter
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as upload_folder:
+        chat_app = load_app(upload_folder)
+        emails, participants = seed(chat_app, rng, args.users, args.conversations,
+                                    args.messages, args.bcrypt_rounds)
+        counter = CommandCounter()
+        instrument(chat_app, counter)
+        simulation = Simulation(chat_app, rng, emails, participants, args.upload_size)
+
+        names = list(args.mix)
+        weights = [args.mix[name] for name in names]
+        samples = {name: {'latencies': [], 'commands': 0, 'errors': 0} for name in names}
+
+        for _ in range(args.warmup):
+            getattr(simulation, rng.choices(names, weights)[0])()
+
+        started = time.perf_counter()
+        for _ in range(args.requests):
+            name = rng.choices(names, weights)[0]
+            counter.reset()
+            request_started = time.perf_counter()
+            response = getattr(simulation, name)()
+            elapsed = time.perf_counter() - request_started
+
+            sample = samples[name]
+            sample['latencies'].append(elapsed * 1000)
+            sample['commands'] += counter.count
+            if response.status_code >= 400:
+                sample['errors'] += 1
+        total_elapsed = time.perf_counter() - started
+
+    endpoints = {}
+    all_latencies = []
+    for name, sample in samples.items():
+        latencies = sorted(sample['latencies'])
+        all_latencies.extend(latencies)
+        count = len(latencies)
+        endpoints[name] = {
+            'requests': count,
+            'errors': sample['errors'],
+            'mean_ms': round(sum(latencies) / count, 3) if count else 0.0,
+            'p50_ms': round(percentile(latencies, 0.50), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+            'commands_per_request': round(sample['commands'] / count, 2) if count else 0.0
+        }
+    all_latencies.sort()
+
+    return {
+        'revision': git_revision(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'config': {
+            'seed': args.seed,
+            'users': args.users,
+            'conversations': len(participants),
+            'messages': args.messages,
+            'requests': args.requests,
+            'warmup': args.warmup,
+            'mix': args.mix,
+            'upload_size': args.upload_size,
+            'bcrypt_rounds': args.bcrypt_rounds
+        },
+        'total': {
+            'requests': args.requests,
+            'elapsed_s': round(total_elapsed, 3),
+            'requests_per_s': round(args.requests / total_elapsed, 1) if total_elapsed else 0.0,
+            'p50_ms': round(percentile(all_latencies, 0.50), 3),
+            'p95_ms': round(percentile(all_latencies, 0.95), 3),
+            'p99_ms': round(percentile(all_latencies, 0.99), 3)
+        },
+        'endpoints': endpoints
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the ChatFlow endpoints offline')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--conversations', type=int, default=200)
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f'operation weights (default: {DEFAULT_MIX})')
+    parser.add_argument('--upload-size', type=int, default=16 * 1024, help='bytes per uploaded file')
+    parser.add_argument('--bcrypt-rounds', type=int, default=12, help='cost of the seeded password hash')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    if args.users < 2:
+        parser.error('--users must be at least 2')
+
+    report = run(args)
+
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print(f"Benchmark report written to {args.output}")
+    else:
+        print(output)
+    return report
+
+if __name__ == "__main__":
+    main()
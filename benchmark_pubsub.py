@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Throughput and fan-out latency benchmark for the pub/sub backends.
+One publisher sends a burst of message events to a topic and every
+subscriber records how long each event took to reach it. For the unix and
+mongo backends each subscriber is a separate process, as it would be for
+separate workers; for inprocess the subscribers are broker subscriptions
+drained by threads, which is the local fan-out every backend ends with.
+
+Run with `python benchmark_pubsub.py --backend unix --subscribers 4 --messages 10000`.
+The mongo backend needs a MongoDB server (`--mongo-uri`); it uses and drops
+the `pubsub_benchmark` collection.
+"""
+
+import argparse
+from datetime import datetime, timezone
+import json
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+import time
+
+from benchmark import git_revision, percentile
+from pubsub import BACKENDS, InProcessBroker, MongoBackend, UnixSocketBackend
+
+TOPIC = 'benchmark'
+BENCHMARK_COLLECTION = 'pubsub_benchmark'
+
+def make_backend(name, options):
+    if name == 'unix':
+        return UnixSocketBackend(options['socket_path'], reconnect_delay=0.1)
+    from pymongo import MongoClient
+
+    collection = MongoClient(options['mongo_uri'])[options['database']][BENCHMARK_COLLECTION]
+    return MongoBackend(collection, await_ms=100)
+
+def subscriber_process(name, options, expected, timeout, ready, results):
+    """Receive events from the publisher and report their latencies"""
+    latencies = []
+    done = threading.Event()
+
+    def deliver(message):
+        latencies.append(time.time() - message['data']['sent_at'])
+        if len(latencies) >= expected:
+            done.set()
+
+    backend = make_backend(name, options)
+    backend.start(deliver)
+    if name == 'unix':
+        backend.wait_connected(timeout)
+    ready.put(os.getpid())
+    done.wait(timeout)
+    results.put({'latencies': latencies, 'finished_at': time.time()})
+    backend.close()
+
+def message(sequence, payload):
+    return {'topic': TOPIC, 'kind': 'event', 'type': 'message',
+            'data': {'seq': sequence, 'content': payload, 'sent_at': time.time()}}
+
+def paced(count, rate):
+    """Yield 0..count-1, sleeping so that at most rate items go out per second (0 is unpaced)"""
+    started = time.perf_counter()
+    for sequence in range(count):
+        if rate:
+            delay = started + sequence / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        yield sequence
+
+def run_inprocess(args, payload):
+    broker = InProcessBroker(max_queue=args.messages)
+    subscriptions = [broker.subscribe(TOPIC)[0] for _ in range(args.subscribers)]
+    results = []
+
+    def drain(subscription):
+        latencies = []
+        while len(latencies) < args.messages:
+            event = subscription.get(timeout=args.timeout)
+            if event is None:
+                break
+            latencies.append(time.time() - event.data['sent_at'])
+        results.append({'latencies': latencies, 'finished_at': time.time()})
+
+    threads = [threading.Thread(target=drain, args=(s,)) for s in subscriptions]
+    for thread in threads:
+        thread.start()
+    started = time.time()
+    for sequence in paced(args.messages, args.rate):
+        item = message(sequence, payload)
+        broker.publish(TOPIC, item['type'], item['data'])
+    published = time.time()
+    for thread in threads:
+        thread.join()
+    return started, published, results
+
+def run_remote(args, payload):
+    options = {'mongo_uri': args.mongo_uri, 'database': args.database,
+               'socket_path': os.path.join(args.socket_dir, 'pubsub-benchmark.sock')}
+    if args.backend == 'mongo':
+        from pymongo import MongoClient
+
+        MongoClient(args.mongo_uri)[args.database].drop_collection(BENCHMARK_COLLECTION)
+
+    # The publisher starts first so the unix hub lives in this process
+    publisher = make_backend(args.backend, options)
+    publisher.start(lambda message: None)
+
+    context = multiprocessing.get_context('spawn')
+    ready, results = context.Queue(), context.Queue()
+    processes = [
+        context.Process(target=subscriber_process,
+                        args=(args.backend, options, args.messages, args.timeout, ready, results))
+        for _ in range(args.subscribers)
+    ]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        ready.get(timeout=args.timeout)
+    if args.backend == 'unix':
+        # Connections are accepted asynchronously; wait until every subscriber is attached
+        deadline = time.time() + args.timeout
+        while publisher.hub.client_count() < args.subscribers + 1 and time.time() < deadline:
+            time.sleep(0.01)
+
+    started = time.time()
+    for sequence in paced(args.messages, args.rate):
+        publisher.publish(message(sequence, payload))
+    publisher.flush(args.timeout)
+    published = time.time()
+
+    collected = []
+    for _ in processes:
+        try:
+            collected.append(results.get(timeout=args.timeout + 5))
+        except queue.Empty:
+            break
+    for process in processes:
+        process.join(5)
+    stats = publisher.stats()
+    publisher.close()
+    return started, published, collected, stats
+
+def run(args):
+    payload = 'x' * args.payload_size
+    stats = None
+    if args.backend == 'inprocess':
+        started, published, results = run_inprocess(args, payload)
+    else:
+        started, published, results, stats = run_remote(args, payload)
+
+    latencies = sorted(latency * 1000 for result in results for latency in result['latencies'])
+    delivered = len(latencies)
+    expected = args.messages * args.subscribers
+    finished = max((result['finished_at'] for result in results), default=published)
+    publish_elapsed = published - started
+    delivery_elapsed = finished - started
+
+    return {
+        'revision': git_revision(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'config': {
+            'backend': args.backend,
+            'subscribers': args.subscribers,
+            'messages': args.messages,
+            'payload_size': args.payload_size,
+            'rate': args.rate
+        },
+        'publish': {
+            'elapsed_s': round(publish_elapsed, 3),
+            'messages_per_s': round(args.messages / publish_elapsed, 1) if publish_elapsed else 0.0,
+            'dropped': stats['dropped'] if stats else 0
+        },
+        'delivery': {
+            'expected': expected,
+            'delivered': delivered,
+            'lost': expected - delivered,
+            'elapsed_s': round(delivery_elapsed, 3),
+            'deliveries_per_s': round(delivered / delivery_elapsed, 1) if delivery_elapsed else 0.0,
+            'mean_ms': round(sum(latencies) / delivered, 3) if delivered else 0.0,
+            'p50_ms': round(percentile(latencies, 0.50), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+            'max_ms': round(latencies[-1], 3) if latencies else 0.0
+        }
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the pub/sub backends')
+    parser.add_argument('--backend', choices=BACKENDS, default='unix')
+    parser.add_argument('--subscribers', type=int, default=4)
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--payload-size', type=int, default=256, help='bytes of message content')
+    parser.add_argument('--rate', type=float, default=0, help='messages per second (default: as fast as possible)')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds to wait for subscribers')
+    parser.add_argument('--mongo-uri', default='mongodb://localhost:27017/')
+    parser.add_argument('--database', default='chat_app')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    if args.subscribers < 1:
+        parser.error('--subscribers must be at least 1')
+
+    with tempfile.TemporaryDirectory() as socket_dir:
+        args.socket_dir = socket_dir
+        report = run(args)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print(f"Benchmark report written to {args.output}")
+    else:
+        print(output)
+    return report
+
+if __name__ == "__main__":
+    main()
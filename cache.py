@@ -0,0 +1,312 @@
+"""
+Small in-process caches for hot read paths.
+Entries are evicted least-recently-used once the cache is full and expire
+after a fixed TTL, so a missed invalidation is bounded in time.
+"""
+
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+import pickle
+import threading
+import time
+
+from pymongo import UpdateOne
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after ttl seconds"""
+
+    def __init__(self, maxsize=10000, ttl=60.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= self.clock():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, self.clock() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Hit/miss counters for monitoring"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+def approximate_size(value):
+    """Rough in-memory footprint of a cached value, in bytes"""
+    return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+class _Flight:
+    __slots__ = ('done', 'value', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+class _UserState:
+    """A user's version, kept only while they have entries or lookups in flight"""
+    __slots__ = ('version', 'generation', 'refs')
+
+    def __init__(self, version):
+        self.version = version
+        self.generation = 0
+        self.refs = 0
+
+class VersionedCache:
+    """Per-user cache whose entries are only valid for the user's current version.
+
+    A write calls bump() for everyone it affects instead of working out
+    which entries to delete; an entry computed for an older version is
+    simply a miss. Entries are evicted least-recently-used once their
+    approximate total size passes max_bytes, and expire after ttl seconds
+    so a missed invalidation is bounded in time. Concurrent misses for the
+    same entry are computed once while the others wait for the result.
+
+    A user's version is forgotten along with their last entry: with nothing
+    cached and nothing being computed there is nothing it could invalidate,
+    so per-user bookkeeping is bounded by the entries as well.
+
+    With a shared store (see MongoCacheStore) versions and values are
+    shared between workers. A bump in another worker only has to be
+    announced through invalidate(); the next lookup re-reads the user's
+    version from the store.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=300.0, store=None, sizer=approximate_size,
+                 wait_timeout=10.0, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.store = store
+        self.sizer = sizer
+        self.wait_timeout = wait_timeout
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.bytes = 0
+        self._entries = OrderedDict()  # (user_id, key) -> (version, value, size, expires_at)
+        self._users = {}  # user_id -> _UserState
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _pin(self, user_id):
+        state = self._users.get(user_id)
+        if state is None:
+            # Local versions restart at 0: no entry or computation remains from before
+            state = self._users[user_id] = _UserState(None if self.store is not None else 0)
+        state.refs += 1
+        return state
+
+    def _unpin(self, user_id, state):
+        state.refs -= 1
+        if state.refs <= 0 and self._users.get(user_id) is state:
+            del self._users[user_id]
+
+    def _version(self, user_id, state):
+        """The user's current version; with a shared store, read from it once per invalidation"""
+        with self._lock:
+            if state.version is not None:
+                return state.version
+            generation = state.generation
+
+        version = self.store.get_version(user_id)
+        with self._lock:
+            # A bump that arrived while we were reading makes the answer stale
+            if state.generation == generation:
+                state.version = version
+        return version
+
+    def get_or_compute(self, user_id, key, compute):
+        """The cached value for (user_id, key), calling compute() on a miss"""
+        with self._lock:
+            state = self._pin(user_id)
+        try:
+            return self._get_or_compute(user_id, key, compute, state)
+        finally:
+            with self._lock:
+                self._unpin(user_id, state)
+
+    def _get_or_compute(self, user_id, key, compute, state):
+        version = self._version(user_id, state)
+        entry_key = (user_id, key)
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry is not None and entry[0] == version and entry[3] > self.clock():
+                self._entries.move_to_end(entry_key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            flight_key = (user_id, key, version)
+            flight = self._inflight.get(flight_key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[flight_key] = _Flight()
+
+        if not leader:
+            if flight.done.wait(self.wait_timeout) and flight.error is None:
+                with self._lock:
+                    self.coalesced += 1
+                return flight.value
+            return compute()
+
+        try:
+            value = None
+            if self.store is not None:
+                value = self.store.get(user_id, key, version)
+            if value is None:
+                value = compute()
+                if self.store is not None:
+                    self.store.set(user_id, key, version, value, self.ttl)
+            flight.value = value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[flight_key]
+            flight.done.set()
+
+        self._put(entry_key, state, version, value)
+        return value
+
+    def _put(self, entry_key, state, version, value):
+        size = self.sizer(value)
+        if size > self.max_bytes:
+            return
+        user_id = entry_key[0]
+        with self._lock:
+            # Computed for a version that has been bumped since; do not keep it
+            if state.version != version or self._users.get(user_id) is not state:
+                return
+            old = self._entries.pop(entry_key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            else:
+                state.refs += 1
+            self._entries[entry_key] = (version, value, size, self.clock() + self.ttl)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                (evicted_user, _), evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted[2]
+                self.evictions += 1
+                self._unpin(evicted_user, self._users[evicted_user])
+
+    def bump(self, user_ids):
+        """A write changed these users' data: move them to a new version"""
+        user_ids = [str(user_id) for user_id in user_ids]
+        if self.store is not None and user_ids:
+            self.store.bump(user_ids)
+        self.invalidate(user_ids)
+
+    def invalidate(self, user_ids):
+        """Forget cached data for users bumped here or in another worker"""
+        with self._lock:
+            for user_id in user_ids:
+                state = self._users.get(str(user_id))
+                if state is None:
+                    continue
+                state.generation += 1
+                # Entries for the old version become misses and are replaced or age out
+                if self.store is None:
+                    state.version += 1
+                else:
+                    state.version = None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._users.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Hit/miss counters and memory use for monitoring"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'users': len(self._users),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+class MongoCacheStore:
+    """Shared versions and values for VersionedCache, kept in MongoDB.
+
+    Values expire through a TTL index on expires_at (migration 7).
+    """
+
+    def __init__(self, versions, values):
+        self.versions = versions
+        self.values = values
+
+    def get_version(self, user_id):
+        document = self.versions.find_one({'_id': user_id}, {'version': 1})
+        return document['version'] if document else 0
+
+    def bump(self, user_ids):
+        self.versions.bulk_write([
+            UpdateOne({'_id': user_id}, {'$inc': {'version': 1}}, upsert=True) for user_id in user_ids
+        ], ordered=False)
+
+    @staticmethod
+    def _id(user_id, key, version):
+        return f"{user_id}:{':'.join(str(part) for part in key)}:{version}"
+
+    def get(self, user_id, key, version):
+        document = self.values.find_one({'_id': self._id(user_id, key, version)}, {'value': 1})
+        return document['value'] if document else None
+
+    def set(self, user_id, key, version, value, ttl):
+        document_id = self._id(user_id, key, version)
+        self.values.replace_one({'_id': document_id}, {
+            '_id': document_id,
+            'value': value,
+            'expires_at': datetime.now(timezone.utc) + timedelta(seconds=ttl)
+        }, upsert=True)
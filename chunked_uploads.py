@@ -0,0 +1,88 @@
+"""
+Disk side of the resumable chunked upload protocol.
+Chunks are streamed straight from the request body into a partial file
+with bounded memory, and a SHA-256 digest is computed as bytes are written.
+"""
+
+import hashlib
+import os
+import threading
+
+READ_BLOCK_SIZE = 64 * 1024
+
+# upload_id -> (hasher, offset the hasher has consumed up to)
+_hashers = {}
+_locks = {}
+_registry_lock = threading.Lock()
+
+class ChunkError(Exception):
+    """Raised when a chunk cannot be appended"""
+
+def _lock_for(upload_id):
+    with _registry_lock:
+        return _locks.setdefault(upload_id, threading.Lock())
+
+def _hasher_at(path, upload_id, offset):
+    """Return a hasher that has consumed exactly the first offset bytes of the file"""
+    cached = _hashers.get(upload_id)
+    if cached and cached[1] == offset:
+        return cached[0]
+
+    # Another worker or a restart lost the running digest; rebuild it from disk
+    hasher = hashlib.sha256()
+    remaining = offset
+    with open(path, 'rb') as partial:
+        while remaining > 0:
+            block = partial.read(min(READ_BLOCK_SIZE, remaining))
+            if not block:
+                raise ChunkError("Partial upload is shorter than its acknowledged offset")
+            hasher.update(block)
+            remaining -= len(block)
+    return hasher
+
+def create_partial(path):
+    """Create an empty partial file for a new upload"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+
+def append_chunk(path, upload_id, offset, stream, max_bytes):
+    """Write a chunk read from stream at offset and return the new offset.
+
+    Anything past offset is discarded first, so a retried chunk after a
+    dropped connection overwrites the bytes that were never acknowledged.
+    """
+    with _lock_for(upload_id):
+        # Hash into a copy so a chunk that fails partway leaves the cached digest at offset
+        hasher = _hasher_at(path, upload_id, offset).copy()
+        written = 0
+        with open(path, 'r+b') as partial:
+            partial.seek(offset)
+            partial.truncate()
+            while True:
+                block = stream.read(READ_BLOCK_SIZE)
+                if not block:
+                    break
+                written += len(block)
+                if written > max_bytes:
+                    partial.truncate(offset)
+                    raise ChunkError("Chunk exceeds the declared upload size")
+                partial.write(block)
+                hasher.update(block)
+            partial.flush()
+            os.fsync(partial.fileno())
+
+        new_offset = offset + written
+        _hashers[upload_id] = (hasher, new_offset)
+        return new_offset
+
+def finish(path, upload_id, size):
+    """Return the SHA-256 of a complete upload and forget its state"""
+    with _lock_for(upload_id):
+        digest = _hasher_at(path, upload_id, size).hexdigest()
+    discard_state(upload_id)
+    return digest
+
+def discard_state(upload_id):
+    with _registry_lock:
+        _hashers.pop(upload_id, None)
+        _locks.pop(upload_id, None)
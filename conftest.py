@@ -0,0 +1,101 @@
+"""
+Shared pytest fixtures for the ChatFlow application.
+The app is imported against an in-memory mongomock client so the suite
+runs without a MongoDB server.
+"""
+
+from datetime import datetime, timedelta, timezone
+import os
+from unittest import mock
+
+import pytest
+
+mongomock = pytest.importorskip('mongomock')
+
+# test_routes.py is a standalone script that needs a live server on :5000
+collect_ignore = ['test_routes.py']
+
+# Background jobs run inline via job_queue.run_pending() instead of on worker threads
+os.environ['JOB_WORKERS'] = '0'
+# Presence changes are flushed by calling flush_presence() directly
+os.environ['PRESENCE_FLUSH_SECONDS'] = '0'
+
+with mock.patch('pymongo.MongoClient', mongomock.MongoClient):
+    import app as chat_app
+
+from db_metrics import CommandCounter, CountingCollection
+
+@pytest.fixture
+def db():
+    """Fresh collections for every test"""
+    for collection in chat_app.db.list_collection_names():
+        chat_app.db.drop_collection(collection)
+    chat_app.membership_cache.clear()
+    chat_app.dashboard_cache.clear()
+    chat_app.login_ip_throttle.reset_all()
+    chat_app.login_account_throttle.reset_all()
+    chat_app.presence.clear()
+    yield chat_app.db
+
+@pytest.fixture
+def command_counter(db, monkeypatch):
+    """Wrap the app collections so tests can assert on command counts"""
+    counter = CommandCounter()
+    for name in ('users', 'messages', 'conversations', 'message_tombstones'):
+        monkeypatch.setattr(chat_app, name, CountingCollection(getattr(chat_app, name), counter))
+    return counter
+
+@pytest.fixture
+def upload_folder(tmp_path, monkeypatch):
+    """Point file storage at a temporary directory"""
+    for folder in ('images', 'videos', 'audio', 'documents', 'partial'):
+        (tmp_path / folder).mkdir()
+    monkeypatch.setattr(chat_app, 'UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setattr(chat_app, 'PARTIAL_UPLOAD_FOLDER', str(tmp_path / 'partial'))
+    return tmp_path
+
+@pytest.fixture
+def client(db):
+    chat_app.app.config['TESTING'] = True
+    with chat_app.app.test_client() as test_client:
+        yield test_client
+
+def make_user(db, name, email):
+    """Insert a user with a cheap placeholder password hash"""
+    result = db['users'].insert_one({
+        'name': name,
+        'email': email,
+        'password': b'not-a-real-hash',
+        'created_at': datetime.now(timezone.utc),
+        'last_login': None,
+        'is_active': True
+    })
+    return result.inserted_id
+
+def make_conversation(db, user1_id, user2_id):
+    result = db['conversations'].insert_one({
+        'participants': [user1_id, user2_id],
+        'created_at': datetime.now(timezone.utc),
+        'last_message': '',
+        'last_message_time': datetime.now(timezone.utc),
+        'unread_count': {str(user1_id): 0, str(user2_id): 0}
+    })
+    return result.inserted_id
+
+def make_messages(db, conversation_id, sender_ids, count):
+    """Insert count text messages alternating between the given senders"""
+    start = datetime.now(timezone.utc) - timedelta(minutes=count)
+    docs = [{
+        'conversation_id': conversation_id,
+        'sender_id': sender_ids[i % len(sender_ids)],
+        'content': f'Message {i}',
+        'timestamp': start + timedelta(seconds=i),
+        'message_type': 'text'
+    } for i in range(count)]
+    return db['messages'].insert_many(docs).inserted_ids
+
+def login_as(test_client, user_id, name='Test User', email='test@example.com'):
+    with test_client.session_transaction() as sess:
+        sess['user_id'] = str(user_id)
+        sess['username'] = name
+        sess['email'] = email
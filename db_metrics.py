@@ -0,0 +1,158 @@
+"""
+Database command accounting.
+Collection proxies count the commands each code path issues, which the
+tests use to pin query counts and the benchmark reports per request. In the
+running app, pymongo monitoring listeners time every command, attribute it
+to the Flask request that issued it and track the connection pool.
+"""
+
+import contextvars
+import threading
+import time
+
+from pymongo import monitoring
+
+COUNTED_METHODS = {
+    'find', 'find_one', 'aggregate', 'count_documents',
+    'insert_one', 'insert_many', 'update_one', 'update_many',
+    'delete_one', 'delete_many', 'bulk_write', 'find_one_and_update',
+}
+
+class CommandCounter:
+    """Counts database commands issued through the wrapped collections"""
+
+    def __init__(self):
+        self.calls = []
+
+    @property
+    def count(self):
+        return len(self.calls)
+
+    def reset(self):
+        self.calls = []
+
+class CountingCollection:
+    """Collection proxy that records every command-issuing method call"""
+
+    def __init__(self, collection, counter):
+        self._collection = collection
+        self._counter = counter
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name not in COUNTED_METHODS:
+            return attr
+
+        def wrapper(*args, **kwargs):
+            self._counter.calls.append((self._collection.name, name))
+            return attr(*args, **kwargs)
+        return wrapper
+
+class RequestStats:
+    """MongoDB commands issued while serving one request"""
+
+    __slots__ = ('commands', 'seconds')
+
+    def __init__(self):
+        self.commands = 0
+        self.seconds = 0.0
+
+_request_stats = contextvars.ContextVar('request_stats', default=None)
+
+def begin_request():
+    """Start attributing commands to a new request"""
+    stats = RequestStats()
+    _request_stats.set(stats)
+    return stats
+
+def end_request():
+    _request_stats.set(None)
+
+def current_request_stats():
+    return _request_stats.get()
+
+class CommandMonitor(monitoring.CommandListener):
+    """Counts and times every command and attributes it to the current request.
+
+    pymongo publishes command events on the thread that issued the command,
+    so the context variable set for the request is visible here.
+    """
+
+    def __init__(self, registry):
+        self.commands = registry.counter(
+            'chatflow_mongo_commands_total', 'MongoDB commands by name and outcome', ['command', 'outcome']
+        )
+        self.durations = registry.histogram(
+            'chatflow_mongo_command_duration_seconds', 'MongoDB command latency', ['command']
+        )
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event, 'success')
+
+    def failed(self, event):
+        self._record(event, 'failure')
+
+    def _record(self, event, outcome):
+        seconds = event.duration_micros / 1e6
+        self.commands.inc(command=event.command_name, outcome=outcome)
+        self.durations.observe(seconds, command=event.command_name)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.commands += 1
+            stats.seconds += seconds
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Connection pool size, checkouts in use and time spent waiting for a connection"""
+
+    def __init__(self, registry):
+        self.connections = registry.gauge(
+            'chatflow_mongo_pool_connections', 'MongoDB pool connections by state', ['state']
+        )
+        self.checkout_failures = registry.counter(
+            'chatflow_mongo_pool_checkout_failures_total', 'Failed MongoDB connection checkouts', ['reason']
+        )
+        self.checkout_wait = registry.histogram(
+            'chatflow_mongo_pool_checkout_wait_seconds', 'Time spent waiting for a pooled connection'
+        )
+        self.connections.set(0, state='open')
+        self.connections.set(0, state='checked_out')
+        self._waits = threading.local()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.connections.inc(state='open')
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.connections.dec(state='open')
+
+    def connection_check_out_started(self, event):
+        self._waits.started = time.monotonic()
+
+    def connection_check_out_failed(self, event):
+        self.checkout_failures.inc(reason=str(event.reason))
+
+    def connection_checked_out(self, event):
+        started = getattr(self._waits, 'started', None)
+        if started is not None:
+            self.checkout_wait.observe(time.monotonic() - started)
+        self.connections.inc(state='checked_out')
+
+    def connection_checked_in(self, event):
+        self.connections.dec(state='checked_out')
@@ -0,0 +1,406 @@
+"""
+Real-time WebSocket gateway for the ChatFlow application.
+Each authenticated client keeps one connection for sending messages, typing
+indicators and delivery acks. Connections are registered by user and by
+subscribed conversation so events are fanned out without touching the
+database; every event is serialised and framed once, however many
+connections receive it. Outbound frames go through a bounded per-connection
+queue drained by a writer thread: ephemeral events (typing, receipts) are
+dropped for slow consumers, and a consumer that cannot keep up with
+messages is disconnected so it resynchronises instead of holding memory.
+"""
+
+import asyncio
+from collections import deque
+import json
+import logging
+import threading
+import time
+
+from websocket import (
+    CLOSE_GOING_AWAY, CLOSE_NORMAL, CLOSE_TRY_AGAIN_LATER, OP_PING, OP_TEXT, ConnectionClosed, decode_frame,
+    encode_frame
+)
+
+logger = logging.getLogger('chatflow.gateway')
+
+PING_FRAME = encode_frame(OP_PING)
+
+def encode_event(payload):
+    """JSON text frame for a gateway event"""
+    return encode_frame(OP_TEXT, json.dumps(payload, default=str))
+
+class GatewayConnection:
+    """One client connection with a bounded outbound queue"""
+
+    def __init__(self, ws, user_id, username, max_queue=256):
+        self.ws = ws
+        self.user_id = str(user_id)
+        self.username = username
+        self.max_queue = max_queue
+        self.conversations = set()
+        self.dropped = 0
+        self.closed = False
+        self._queue = deque()
+        self._ready = threading.Condition()
+        self._writer = None
+
+    def start(self):
+        self._writer = threading.Thread(target=self._write_loop, name='ws-writer', daemon=True)
+        self._writer.start()
+
+    def push(self, frame, droppable=False):
+        """Queue an encoded frame; returns False if it was not queued"""
+        with self._ready:
+            if self.closed:
+                return False
+            if len(self._queue) < self.max_queue:
+                self._queue.append(frame)
+                self._notify()
+                return True
+            if droppable:
+                self.dropped += 1
+                return False
+
+        # Called from the publisher's thread, so never wait on the stuck writer
+        logger.warning("Disconnecting slow WebSocket consumer", extra={'ws_user_id': self.user_id})
+        self.close(CLOSE_TRY_AGAIN_LATER, 'slow consumer', timeout=0)
+        return False
+
+    def send(self, payload, droppable=False):
+        return self.push(encode_event(payload), droppable)
+
+    def queued(self):
+        return len(self._queue)
+
+    def close(self, code=CLOSE_NORMAL, reason='', timeout=1.0):
+        with self._ready:
+            if self.closed:
+                return
+            self.closed = True
+            self._ready.notify_all()
+        self.ws.close(code, reason, timeout)
+
+    def _notify(self):
+        """Wake the writer; called with the queue lock held"""
+        self._ready.notify()
+
+    def _write_loop(self):
+        while True:
+            with self._ready:
+                while not self._queue and not self.closed:
+                    self._ready.wait()
+                if self.closed:
+                    return
+                # Everything queued so far goes out in one write
+                frames = b''.join(self._queue)
+                self._queue.clear()
+            try:
+                self.ws.send_frame(frames)
+            except ConnectionClosed:
+                self.close(CLOSE_GOING_AWAY)
+                return
+
+class AsyncGatewayConnection(GatewayConnection):
+    """A connection served through an ASGI server.
+
+    Frames are queued exactly as for GatewayConnection, from any thread, but
+    are written by a task on the event loop instead of a writer thread, so
+    an idle connection holds no thread at all. Pings are left to the ASGI
+    server's own keepalive.
+    """
+
+    def __init__(self, send, user_id, username, max_queue=256, loop=None):
+        super().__init__(None, user_id, username, max_queue)
+        self._send = send
+        self._loop = loop or asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._wake_pending = False
+        self.close_code = None
+        self.disconnected = False
+
+    def close(self, code=CLOSE_NORMAL, reason='', timeout=1.0):
+        with self._ready:
+            if self.closed:
+                return
+            self.closed = True
+            self.close_code = code
+            self._notify()
+
+    def _notify(self):
+        if not self._wake_pending:
+            self._wake_pending = True
+            try:
+                self._loop.call_soon_threadsafe(self._wakeup.set)
+            except RuntimeError:
+                pass  # the event loop has shut down
+
+    async def write_loop(self):
+        """Send queued frames until the connection closes; run as a task on the loop"""
+        while True:
+            await self._wakeup.wait()
+            with self._ready:
+                self._wakeup.clear()
+                self._wake_pending = False
+                frames = list(self._queue)
+                self._queue.clear()
+                closed = self.closed
+            try:
+                for frame in frames:
+                    opcode, payload = decode_frame(frame)
+                    if opcode == OP_TEXT:
+                        await self._send({'type': 'websocket.send', 'text': payload.decode('utf-8')})
+                if closed:
+                    if not self.disconnected:
+                        await self._send({'type': 'websocket.close', 'code': self.close_code or CLOSE_NORMAL})
+                    return
+            except Exception:
+                # The client went away mid-send
+                self.disconnected = True
+                self.close(CLOSE_GOING_AWAY)
+                return
+
+class ConnectionRegistry:
+    """Open connections indexed by user and by subscribed conversation"""
+
+    def __init__(self):
+        self._by_user = {}
+        self._by_conversation = {}
+        self._lock = threading.Lock()
+
+    def add(self, connection):
+        with self._lock:
+            self._by_user.setdefault(connection.user_id, set()).add(connection)
+
+    def remove(self, connection):
+        with self._lock:
+            _discard(self._by_user, connection.user_id, connection)
+            for conversation_id in connection.conversations:
+                _discard(self._by_conversation, conversation_id, connection)
+            connection.conversations = set()
+
+    def join(self, connection, conversation_id):
+        with self._lock:
+            connection.conversations.add(conversation_id)
+            self._by_conversation.setdefault(conversation_id, set()).add(connection)
+
+    def leave(self, connection, conversation_id):
+        with self._lock:
+            connection.conversations.discard(conversation_id)
+            _discard(self._by_conversation, conversation_id, connection)
+
+    def connected_users(self):
+        with self._lock:
+            return set(self._by_user)
+
+    def for_user(self, user_id):
+        with self._lock:
+            return list(self._by_user.get(str(user_id), ()))
+
+    def for_conversation(self, conversation_id):
+        with self._lock:
+            return list(self._by_conversation.get(str(conversation_id), ()))
+
+    def broadcast(self, conversation_id, payload, exclude_user=None, skip=None, droppable=False):
+        """Send an event to every connection subscribed to a conversation; returns the number queued"""
+        connections = [
+            connection for connection in self.for_conversation(conversation_id)
+            if connection is not skip and connection.user_id != exclude_user
+        ]
+        if not connections:
+            return 0
+        frame = encode_event(payload)
+        return sum(connection.push(frame, droppable) for connection in connections)
+
+    def send_to_users(self, user_ids, payload, droppable=False):
+        """Send an event to every connection of the given users; returns the number queued"""
+        with self._lock:
+            connections = [c for user_id in user_ids for c in self._by_user.get(str(user_id), ())]
+        if not connections:
+            return 0
+        frame = encode_event(payload)
+        return sum(connection.push(frame, droppable) for connection in connections)
+
+    def stats(self):
+        with self._lock:
+            connections = [c for group in self._by_user.values() for c in group]
+            return {
+                'connections': len(connections),
+                'users': len(self._by_user),
+                'conversations': len(self._by_conversation),
+                'queued': sum(c.queued() for c in connections),
+                'dropped': sum(c.dropped for c in connections)
+            }
+
+def _discard(index, key, connection):
+    group = index.get(key)
+    if group is not None:
+        group.discard(connection)
+        if not group:
+            del index[key]
+
+class Gateway:
+    """Runs WebSocket connections and dispatches client frames to handlers.
+
+    Clients send JSON objects with a ``type``; a handler returns the reply
+    (echoing the client's ``ref``, if any) or None.
+    """
+
+    def __init__(self, registry=None, heartbeat_seconds=20, idle_timeout=60, max_queue=256,
+                 clock=time.monotonic):
+        self.registry = registry or ConnectionRegistry()
+        self.heartbeat_seconds = heartbeat_seconds
+        self.idle_timeout = idle_timeout
+        self.max_queue = max_queue
+        self.clock = clock
+        self.handlers = {'ping': lambda connection, frame: {'type': 'pong'}}
+        self.async_handlers = {}
+        self.connect_hooks = []
+        self.disconnect_hooks = []
+        self._frame_counts = {}
+        self._counts_lock = threading.Lock()
+
+    def handler(self, message_type):
+        """Decorator registering the handler for a client frame type"""
+        def register(func):
+            self.handlers[message_type] = func
+            return func
+        return register
+
+    def async_handler(self, message_type):
+        """Decorator registering a coroutine handler, used instead of the
+        regular one when a connection is served through serve_async()"""
+        def register(func):
+            self.async_handlers[message_type] = func
+            return func
+        return register
+
+    def on_connect(self, func):
+        """Decorator for func(connection), called when a connection opens"""
+        self.connect_hooks.append(func)
+        return func
+
+    def on_disconnect(self, func):
+        """Decorator for func(connection), called after a connection is removed"""
+        self.disconnect_hooks.append(func)
+        return func
+
+    def _run_hooks(self, hooks, connection):
+        for hook in hooks:
+            try:
+                hook(connection)
+            except Exception:
+                logger.exception("Error in gateway hook %s", hook.__name__)
+
+    def frame_counts(self):
+        """Client frames handled since start, by type"""
+        with self._counts_lock:
+            return dict(self._frame_counts)
+
+    def serve(self, ws, user_id, username):
+        """Run a connection on the calling thread until it closes"""
+        connection = GatewayConnection(ws, user_id, username, self.max_queue)
+        self.registry.add(connection)
+        connection.start()
+        self._run_hooks(self.connect_hooks, connection)
+        try:
+            while not connection.closed:
+                text = ws.receive(timeout=self.heartbeat_seconds)
+                if text is None:
+                    if self.clock() - ws.last_received > self.idle_timeout:
+                        connection.close(CLOSE_GOING_AWAY, 'heartbeat timeout')
+                        break
+                    connection.push(PING_FRAME)
+                    continue
+                self.dispatch(connection, text)
+        except ConnectionClosed:
+            pass
+        finally:
+            self.registry.remove(connection)
+            connection.close()
+            self._run_hooks(self.disconnect_hooks, connection)
+        return connection
+
+    async def serve_async(self, receive, send, user_id, username, executor):
+        """Run an accepted ASGI WebSocket connection on the event loop until it closes.
+
+        Regular handlers and hooks run on executor, since they may block on
+        the database; between frames the connection holds no thread.
+        """
+        loop = asyncio.get_running_loop()
+        connection = AsyncGatewayConnection(send, user_id, username, self.max_queue, loop)
+        self.registry.add(connection)
+        writer = loop.create_task(connection.write_loop())
+        await loop.run_in_executor(executor, self._run_hooks, self.connect_hooks, connection)
+        try:
+            while not connection.closed:
+                event = await receive()
+                if event['type'] == 'websocket.disconnect':
+                    connection.disconnected = True
+                    break
+                if event['type'] == 'websocket.receive':
+                    text = event.get('text')
+                    await self.dispatch_async(connection, text if text is not None else event.get('bytes'), executor)
+        finally:
+            self.registry.remove(connection)
+            connection.close()
+            await writer
+            await loop.run_in_executor(executor, self._run_hooks, self.disconnect_hooks, connection)
+        return connection
+
+    def dispatch(self, connection, text):
+        frame, handler = self._decode(connection, text, self.handlers)
+        if frame is None:
+            return
+        reply = self._call(handler, connection, frame)
+        self._reply(connection, frame, reply)
+
+    async def dispatch_async(self, connection, text, executor):
+        frame, handler = self._decode(connection, text, self.async_handlers, self.handlers)
+        if frame is None:
+            return
+        if handler is not None and asyncio.iscoroutinefunction(handler):
+            try:
+                reply = await handler(connection, frame)
+            except Exception:
+                logger.exception("Error handling %s frame", frame['type'])
+                reply = {'type': 'error', 'error': 'Internal error'}
+        else:
+            reply = await asyncio.get_running_loop().run_in_executor(
+                executor, self._call, handler, connection, frame
+            )
+        self._reply(connection, frame, reply)
+
+    def _decode(self, connection, text, *handler_maps):
+        """Parse a client frame and count it; returns (frame, handler) or (None, None)"""
+        try:
+            frame = json.loads(text) if isinstance(text, str) else None
+        except ValueError:
+            frame = None
+        if not isinstance(frame, dict):
+            connection.send({'type': 'error', 'error': 'Frames must be JSON objects'})
+            return None, None
+
+        frame_type = frame.get('type')
+        handler = None
+        if isinstance(frame_type, str):
+            handler = next((handlers[frame_type] for handlers in handler_maps if frame_type in handlers), None)
+        counted = frame_type if handler is not None else 'unknown'
+        with self._counts_lock:
+            self._frame_counts[counted] = self._frame_counts.get(counted, 0) + 1
+        return frame, handler
+
+    def _call(self, handler, connection, frame):
+        if handler is None:
+            return {'type': 'error', 'error': 'Unknown frame type'}
+        try:
+            return handler(connection, frame)
+        except Exception:
+            logger.exception("Error handling %s frame", frame['type'])
+            return {'type': 'error', 'error': 'Internal error'}
+
+    def _reply(self, connection, frame, reply):
+        if reply is not None:
+            if 'ref' in frame:
+                reply['ref'] = frame['ref']
+            connection.send(reply)
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Bulk synthetic data generator for the ChatFlow application.
+Where create_test_data.py adds a handful of hand-written users, this script
+produces load-test volumes: any number of users, conversations, messages
+and media files from a seed, so the same arguments always give the same
+data. Conversation sizes and user activity follow a power law, documents
+are written with large unordered insert_many batches, and indexes are built
+once the data is loaded.
+
+Example:
+    python generate_test_data.py --users 100000 --conversations 1000000 \\
+        --messages 50000000 --media 10000 --seed 42 --drop
+"""
+
+import argparse
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+import hashlib
+import itertools
+import logging
+import os
+import random
+import struct
+import time
+
+import bcrypt
+from bson import ObjectId
+from pymongo import MongoClient
+
+from create_test_data import hash_password
+import search
+
+WORDS = (
+    'hey hi hello thanks ok sure lunch dinner coffee meeting project deadline '
+    'report draft review call tomorrow today tonight weekend monday friday '
+    'sounds good great awesome sorry late running traffic see you soon later '
+    'plan trip flight hotel tickets movie game score team office home send '
+    'file photo link address number question answer idea budget invoice'
+).split()
+LAST_NAMES = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Wilson', 'Lee']
+FIRST_NAMES = ['Alex', 'Sam', 'Jordan', 'Taylor', 'Morgan', 'Casey', 'Riley', 'Jamie', 'Avery', 'Quinn']
+# schema_migrations goes too, so the migrations run afterwards rebuild the dropped indexes
+COLLECTIONS = ['users', 'conversations', 'messages', 'blobs', 'message_tombstones', 'schema_migrations']
+
+# High byte of generated ObjectId counters, so ids never repeat across collections
+USER_IDS, CONVERSATION_IDS, MESSAGE_IDS = range(3)
+
+class Progress:
+    """Prints insertion throughput for one phase of the load"""
+
+    def __init__(self, label, total):
+        self.label = label
+        self.total = total
+        self.done = 0
+        self.started = time.monotonic()
+        self.last_report = self.started
+
+    def advance(self, count):
+        self.done += count
+        now = time.monotonic()
+        if now - self.last_report >= 5 or self.done >= self.total:
+            self.last_report = now
+            print(f"  {self.label}: {self.done:,}/{self.total:,} ({self.rate():,.0f} docs/s)")
+
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        return {
+            'documents': self.done,
+            'seconds': round(time.monotonic() - self.started, 2),
+            'docs_per_second': round(self.rate(), 1)
+        }
+
+def make_object_id(timestamp, kind, sequence):
+    """Deterministic ObjectId that still sorts by creation time"""
+    return ObjectId(struct.pack('>IQ', int(timestamp.timestamp()), (kind << 56) | sequence))
+
+def power_law_cum_weights(rng, count, alpha):
+    """Cumulative Pareto weights: a few items get most of the traffic"""
+    return list(itertools.accumulate(rng.paretovariate(alpha) for _ in range(count)))
+
+def hash_passwords(password, count, workers, rounds):
+    """One bcrypt hash per user on a process pool, or a single shared hash"""
+    if workers <= 0:
+        shared = hash_password_with_rounds(password, rounds)
+        return itertools.repeat(shared, count)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(hash_password_with_rounds, itertools.repeat(password, count),
+                             itertools.repeat(rounds, count), chunksize=64))
+
+def hash_password_with_rounds(password, rounds):
+    if rounds is None:
+        return hash_password(password)
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=rounds))
+
+def insert_batches(collection, documents, batch_size, progress):
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            collection.insert_many(batch, ordered=False)
+            progress.advance(len(batch))
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+        progress.advance(len(batch))
+
+def generate_users(args, rng, start):
+    print(f"Hashing passwords ({'shared hash' if args.hash_workers <= 0 else f'{args.hash_workers} processes'})...")
+    hashes = hash_passwords(args.password, args.users, args.hash_workers, args.bcrypt_rounds)
+    user_ids = []
+
+    def documents():
+        for i, password_hash in enumerate(hashes):
+            user_id = make_object_id(start, USER_IDS, i)
+            user_ids.append(user_id)
+            yield {
+                '_id': user_id,
+                'name': f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i}",
+                'email': f"user{i}@{args.email_domain}",
+                'password': password_hash,
+                'created_at': start,
+                'last_login': None,
+                'is_active': True
+            }
+
+    return documents, user_ids
+
+def pick_pairs(args, rng, user_ids):
+    """Unique participant pairs; active users appear in many more conversations"""
+    max_pairs = len(user_ids) * (len(user_ids) - 1) // 2
+    target = min(args.conversations, max_pairs)
+    user_weights = power_law_cum_weights(rng, len(user_ids), args.alpha)
+    total_weight = user_weights[-1]
+    pairs = set()
+    while len(pairs) < target:
+        first = bisect_left(user_weights, rng.random() * total_weight)
+        second = rng.randrange(len(user_ids))
+        if first != second:
+            pairs.add((min(first, second), max(first, second)))
+    return sorted(pairs)
+
+def blob_content(args, index):
+    seed_bytes = f"{args.seed}:{index}".encode()
+    return b''.join(hashlib.sha256(seed_bytes + bytes([block])).digest() for block in range(32))
+
+def write_media_files(args, start):
+    """Write the media files to disk and return their blob documents"""
+    folder = os.path.join(args.upload_folder, 'documents')
+    os.makedirs(folder, exist_ok=True)
+    media = []
+    for i in range(args.media):
+        content = blob_content(args, i)
+        sha256 = hashlib.sha256(content).hexdigest()
+        filename = f"{sha256}.txt"
+        with open(os.path.join(folder, filename), 'wb') as f:
+            f.write(content)
+        media.append({
+            '_id': filename,
+            'file_path': os.path.join('documents', filename),
+            'file_size': len(content),
+            'created_at': start,
+            'ref_count': 1,
+            'sha256': sha256
+        })
+    return media
+
+def generate(args):
+    rng = random.Random(args.seed)
+    client = MongoClient(args.mongo_uri)
+    db = client[args.database]
+
+    if args.drop:
+        for name in COLLECTIONS:
+            db.drop_collection(name)
+    elif db['users'].estimated_document_count():
+        raise SystemExit(f"{args.database}.users is not empty; pass --drop to replace existing data")
+
+    end = args.end_date
+    start = end - timedelta(days=args.days)
+    report = {}
+
+    # Users
+    documents, user_ids = generate_users(args, rng, start)
+    progress = Progress('users', args.users)
+    insert_batches(db['users'], documents(), args.batch_size, progress)
+    report['users'] = progress.summary()
+
+    # Conversations are inserted last, once their last message is known
+    pairs = pick_pairs(args, rng, user_ids)
+    conversation_ids = [make_object_id(start, CONVERSATION_IDS, i) for i in range(len(pairs))]
+    conversation_weights = power_law_cum_weights(rng, len(pairs), args.alpha)
+    last_messages = [None] * len(pairs)
+
+    # Media files, each shared as one message
+    media = write_media_files(args, start) if args.media else []
+    if media:
+        db['blobs'].insert_many([
+            {key: value for key, value in blob.items() if key != 'sha256'} for blob in media
+        ], ordered=False)
+    total_messages = args.messages + len(media)
+    media_positions = dict(zip(sorted(rng.sample(range(total_messages), len(media))), media))
+
+    def message_documents():
+        step = (end - start) / max(total_messages, 1)
+        position = 0
+        while position < total_messages:
+            count = min(args.batch_size, total_messages - position)
+            chosen = rng.choices(range(len(pairs)), cum_weights=conversation_weights, k=count)
+            for index in chosen:
+                timestamp = start + step * position
+                sender = user_ids[pairs[index][rng.randrange(2)]]
+                document = {
+                    '_id': make_object_id(timestamp, MESSAGE_IDS, position),
+                    'conversation_id': conversation_ids[index],
+                    'sender_id': sender,
+                    'timestamp': timestamp
+                }
+                blob = media_positions.get(position)
+                if blob:
+                    original_name = f"notes-{position}.txt"
+                    document.update({
+                        'content': f"Shared {original_name}",
+                        'message_type': 'document',
+                        'file_name': blob['_id'],
+                        'original_name': original_name,
+                        'file_size': blob['file_size'],
+                        'file_path': blob['file_path'],
+                        'sha256': blob['sha256']
+                    })
+                    last_text = f"📎 {original_name}"
+                else:
+                    document.update({
+                        'content': ' '.join(rng.choices(WORDS, k=rng.randint(2, 14))).capitalize(),
+                        'message_type': 'text'
+                    })
+                    last_text = document['content']
+                document['search_terms'] = search.search_terms(document['content'], document.get('original_name'))
+                last_messages[index] = (last_text, timestamp)
+                position += 1
+                yield document
+
+    progress = Progress('messages', total_messages)
+    insert_batches(db['messages'], message_documents(), args.batch_size, progress)
+    report['messages'] = progress.summary()
+
+    def conversation_documents():
+        for index, (first, second) in enumerate(pairs):
+            last_text, last_time = last_messages[index] or ('', start)
+            yield {
+                '_id': conversation_ids[index],
+                'participants': [user_ids[first], user_ids[second]],
+                'created_at': start,
+                'last_message': last_text,
+                'last_message_time': last_time,
+                'updated_at': last_time,
+                'unread_count': {str(user_ids[first]): 0, str(user_ids[second]): 0}
+            }
+
+    progress = Progress('conversations', len(pairs))
+    insert_batches(db['conversations'], conversation_documents(), args.batch_size, progress)
+    report['conversations'] = progress.summary()
+
+    # Building indexes after the load is much faster than maintaining them per insert
+    if not args.skip_indexes:
+        from migrations import run_migrations
+
+        started = time.monotonic()
+        run_migrations(db)
+        report['indexes'] = {'seconds': round(time.monotonic() - started, 2)}
+
+    print("\n✅ Synthetic data created!")
+    for phase, summary in report.items():
+        details = ', '.join(f"{key}={value:,}" if isinstance(value, int) else f"{key}={value}"
+                            for key, value in summary.items())
+        print(f"  - {phase}: {details}")
+    print(f"\nAll users log in with password '{args.password}' (e.g. user0@{args.email_domain})")
+    return report
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+
+def main(argv=None):
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    parser = argparse.ArgumentParser(description='Generate synthetic ChatFlow data at load-test scale')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--conversations', type=int, default=5000)
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--media', type=int, default=0, help='number of media files to write and share')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--alpha', type=float, default=1.2, help='power-law exponent (smaller is more skewed)')
+    parser.add_argument('--days', type=int, default=365, help='history span the messages are spread over')
+    parser.add_argument('--end-date', type=parse_date, default=today,
+                        help='YYYY-MM-DD the history ends at (default today); fix it for identical reruns')
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--password', default='password123')
+    parser.add_argument('--hash-workers', type=int, default=0,
+                        help='processes for per-user bcrypt hashes; 0 reuses one pre-computed hash')
+    parser.add_argument('--bcrypt-rounds', type=int, default=None, help='bcrypt cost (default: bcrypt default)')
+    parser.add_argument('--email-domain', default='example.com')
+    parser.add_argument('--upload-folder', default='uploads')
+    parser.add_argument('--mongo-uri', default='mongodb://localhost:27017/')
+    parser.add_argument('--database', default='chat_app')
+    parser.add_argument('--drop', action='store_true', help='drop existing chat data first')
+    parser.add_argument('--skip-indexes', action='store_true', help='do not run migrations after loading')
+    args = parser.parse_args(argv)
+
+    if args.users < 2:
+        parser.error('--users must be at least 2')
+    return generate(args)
+
+if __name__ == "__main__":
+    # Index build progress from the migrations
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    main()
@@ -0,0 +1,131 @@
+"""
+Group commit for the message write path.
+Concurrent sends are buffered for a short window and written together:
+one insert_many for the messages and one bulk_write that applies only the
+newest last_message per conversation, along with the summed unread counter
+increments. Every caller blocks until its own message has been
+acknowledged by the database.
+"""
+
+from datetime import datetime, timezone
+import logging
+import threading
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger('chatflow.group_commit')
+
+class _PendingWrite:
+    __slots__ = ('document', 'last_message', 'recipients', 'done', 'inserted_id', 'error')
+
+    def __init__(self, document, last_message, recipients):
+        self.document = document
+        self.last_message = last_message
+        self.recipients = recipients
+        self.done = threading.Event()
+        self.inserted_id = None
+        self.error = None
+
+class GroupCommitWriter:
+    """Coalesces concurrent message inserts and conversation summary updates"""
+
+    def __init__(self, messages, conversations, window_ms=5, max_batch=100):
+        self.messages = messages
+        self.conversations = conversations
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.flushes = 0
+        self._batch = []
+        self._lock = threading.Lock()
+        self._batch_full = threading.Event()
+        # Flushes run one at a time so batches reach the database in order
+        self._flush_lock = threading.Lock()
+
+    def submit(self, document, last_message, recipients=()):
+        """Store a message and return its id once the batch holding it is written"""
+        entry = _PendingWrite(document, last_message, recipients)
+        with self._lock:
+            self._batch.append(entry)
+            leader = len(self._batch) == 1
+            if len(self._batch) >= self.max_batch:
+                self._batch_full.set()
+
+        # The first writer of a batch waits out the window, then flushes for everyone
+        if leader:
+            self._batch_full.wait(self.window)
+            with self._flush_lock:
+                with self._lock:
+                    batch, self._batch = self._batch, []
+                    self._batch_full.clear()
+                self._flush(batch)
+
+        entry.done.wait()
+        if entry.error is not None:
+            raise entry.error
+        return entry.inserted_id
+
+    def _flush(self, batch):
+        try:
+            self._insert_messages(batch)
+            self._update_conversations([entry for entry in batch if entry.error is None])
+        except Exception as e:
+            for entry in batch:
+                if entry.inserted_id is None and entry.error is None:
+                    entry.error = e
+        finally:
+            self.flushes += 1
+            for entry in batch:
+                entry.done.set()
+
+    def _insert_messages(self, batch):
+        try:
+            result = self.messages.insert_many([entry.document for entry in batch], ordered=False)
+            failed = set()
+        except BulkWriteError as e:
+            result = None
+            failed = {error['index'] for error in e.details.get('writeErrors', [])}
+            for index in failed:
+                batch[index].error = e
+
+        for index, entry in enumerate(batch):
+            if index not in failed:
+                entry.inserted_id = result.inserted_ids[index] if result else entry.document['_id']
+
+    @staticmethod
+    def _summary_update(entry, increments, now):
+        update = {'$set': {
+            'last_message': entry.last_message,
+            'last_message_time': entry.document['timestamp'],
+            'updated_at': now
+        }}
+        if increments:
+            update['$inc'] = increments
+        return update
+
+    def _update_conversations(self, stored):
+        """Apply the newest last_message and unread increments per conversation in one bulk_write"""
+        newest = {}
+        unread = {}
+        for entry in stored:
+            conversation_id = entry.document['conversation_id']
+            current = newest.get(conversation_id)
+            if current is None or entry.document['timestamp'] >= current.document['timestamp']:
+                newest[conversation_id] = entry
+            increments = unread.setdefault(conversation_id, {})
+            for recipient in entry.recipients:
+                field = f'unread_count.{recipient}'
+                increments[field] = increments.get(field, 0) + 1
+
+        if not newest:
+            return
+
+        now = datetime.now(timezone.utc)
+        try:
+            self.conversations.bulk_write([
+                UpdateOne({'_id': conversation_id}, self._summary_update(entry, unread[conversation_id], now))
+                for conversation_id, entry in newest.items()
+            ], ordered=False)
+        except Exception:
+            # The messages themselves are stored; only the conversation summaries are stale
+            logger.exception("Error updating conversation summaries")
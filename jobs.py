@@ -0,0 +1,143 @@
+"""
+Background job queue backed by a MongoDB collection.
+Jobs are persisted before they run, so queued and interrupted work survives
+restarts. A fixed pool of worker threads claims jobs atomically, and
+failures are retried with exponential backoff.
+"""
+
+from datetime import datetime, timedelta, timezone
+import logging
+import threading
+import traceback
+
+from pymongo import ASCENDING, ReturnDocument
+
+logger = logging.getLogger('chatflow.jobs')
+
+class JobQueue:
+    """Persistent job queue with a bounded worker pool"""
+
+    def __init__(self, collection, workers=2, poll_interval=1.0, lease_seconds=300,
+                 backoff_base=2.0, backoff_max=300.0):
+        self.collection = collection
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.handlers = {}
+        self._threads = []
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+
+    def handler(self, name):
+        """Decorator registering the function that runs jobs called name"""
+        def register(func):
+            self.handlers[name] = func
+            return func
+        return register
+
+    def enqueue(self, name, payload, owner_id=None, max_attempts=5):
+        """Persist a job and wake a worker; returns the job id"""
+        if name not in self.handlers:
+            raise ValueError(f"No handler registered for job {name}")
+
+        now = datetime.now(timezone.utc)
+        result = self.collection.insert_one({
+            'name': name,
+            'payload': payload,
+            'owner_id': owner_id,
+            'status': 'queued',
+            'attempts': 0,
+            'max_attempts': max_attempts,
+            'run_at': now,
+            'created_at': now,
+            'updated_at': now,
+            'error': None,
+            'result': None
+        })
+        self._wakeup.set()
+        return result.inserted_id
+
+    def get(self, job_id):
+        return self.collection.find_one({'_id': job_id})
+
+    def start(self):
+        """Start the worker threads"""
+        if self._threads:
+            return
+        self._stopping.clear()
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def run_pending(self):
+        """Run every job that is due in the calling thread; returns how many ran"""
+        count = 0
+        while True:
+            job = self._claim()
+            if job is None:
+                return count
+            self._run(job)
+            count += 1
+
+    def _claim(self):
+        """Atomically take the next due job, including ones whose worker died"""
+        now = datetime.now(timezone.utc)
+        return self.collection.find_one_and_update(
+            {'$or': [
+                {'status': 'queued', 'run_at': {'$lte': now}},
+                {'status': 'running', 'locked_at': {'$lt': now - timedelta(seconds=self.lease_seconds)}}
+            ]},
+            {
+                '$set': {'status': 'running', 'locked_at': now, 'updated_at': now},
+                '$inc': {'attempts': 1}
+            },
+            sort=[('run_at', ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _run(self, job):
+        handler = self.handlers.get(job['name'])
+        now = datetime.now(timezone.utc)
+        try:
+            if handler is None:
+                raise ValueError(f"No handler registered for job {job['name']}")
+            result = handler(**job['payload'])
+        except Exception as e:
+            logger.warning("Job %s (%s) failed on attempt %d: %s", job['_id'], job['name'], job['attempts'], e)
+            update = {'error': f"{type(e).__name__}: {e}", 'traceback': traceback.format_exc(), 'updated_at': now}
+            if job['attempts'] < job['max_attempts']:
+                delay = min(self.backoff_base ** (job['attempts'] - 1), self.backoff_max)
+                update.update({'status': 'queued', 'run_at': now + timedelta(seconds=delay)})
+            else:
+                update.update({'status': 'failed', 'finished_at': now})
+            self.collection.update_one({'_id': job['_id']}, {'$set': update})
+            return
+
+        self.collection.update_one({'_id': job['_id']}, {'$set': {
+            'status': 'succeeded',
+            'result': result,
+            'error': None,
+            'finished_at': now,
+            'updated_at': now
+        }})
+
+    def _work(self):
+        while not self._stopping.is_set():
+            try:
+                ran = self.run_pending()
+            except Exception:
+                logger.exception("Job worker error")
+                ran = 0
+            if not ran:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
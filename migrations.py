@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Versioned schema migrations for the ChatFlow database.
+Each migration runs once; the applied version is recorded in the
+schema_migrations collection so running this again is a no-op.
+
+Each version is claimed in schema_migrations before it is applied, so
+workers starting together apply it once; the others leave the rest of the
+run to the claimer. A claim left by a process that died mid-migration has
+no applied_at; delete it to retry that version.
+
+Run with `python migrations.py` or `flask --app app migrate`.
+"""
+
+from datetime import datetime, timezone
+import logging
+import threading
+import time
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+import search
+
+logger = logging.getLogger('chatflow.migrations')
+
+MIGRATIONS_COLLECTION = 'schema_migrations'
+PROGRESS_INTERVAL_SECONDS = 2
+TOMBSTONE_RETENTION_DAYS = 30
+STALE_UPLOAD_HOURS = 24
+FINISHED_JOB_RETENTION_DAYS = 7
+BACKFILL_BATCH_SIZE = 1000
+
+def _report_progress(db, collection_name, index_name, done_event):
+    """Log index build progress from currentOp until the build finishes"""
+    while not done_event.wait(PROGRESS_INTERVAL_SECONDS):
+        try:
+            ops = db.client.admin.command('currentOp', {'command.createIndexes': collection_name})
+        except Exception:
+            return
+        for op in ops.get('inprog', []):
+            progress = op.get('progress')
+            if progress and progress.get('total'):
+                percent = 100.0 * progress.get('done', 0) / progress['total']
+                logger.info("Building %s.%s: %.1f%% (%s/%s)", collection_name, index_name, percent,
+                            progress.get('done', 0), progress['total'])
+
+def create_index(db, collection_name, keys, **kwargs):
+    """Create an index, reporting progress for long builds"""
+    collection = db[collection_name]
+    index_name = kwargs.setdefault('name', '_'.join(f"{field}_{direction}" for field, direction in keys))
+
+    if index_name in collection.index_information():
+        logger.info("Index %s.%s already exists", collection_name, index_name)
+        return index_name
+
+    logger.info("Creating index %s.%s (~%d documents)",
+                collection_name, index_name, collection.estimated_document_count())
+    done_event = threading.Event()
+    reporter = threading.Thread(
+        target=_report_progress, args=(db, collection_name, index_name, done_event), daemon=True
+    )
+    reporter.start()
+    started = time.monotonic()
+    try:
+        collection.create_index(keys, **kwargs)
+    finally:
+        done_event.set()
+    logger.info("Built %s.%s in %.2fs", collection_name, index_name, time.monotonic() - started)
+    return index_name
+
+def migration_001_initial_indexes(db):
+    """Indexes matching the app's hot query shapes"""
+    # Login, registration and conversation creation look users up by email.
+    # Unique so concurrent registrations cannot create duplicate accounts.
+    create_index(db, 'users', [('email', ASCENDING)], unique=True)
+
+    # Message pages: equality on conversation, keyset range on (timestamp, _id)
+    create_index(db, 'messages', [
+        ('conversation_id', ASCENDING), ('timestamp', ASCENDING), ('_id', ASCENDING)
+    ])
+
+    # Shared media: conversation + message_type filter, newest first
+    create_index(db, 'messages', [
+        ('conversation_id', ASCENDING), ('message_type', ASCENDING), ('timestamp', DESCENDING)
+    ])
+
+    # Dashboard: conversations containing a user, most recent first
+    create_index(db, 'conversations', [('participants', ASCENDING), ('last_message_time', DESCENDING)])
+
+def migration_002_conversation_keyset_index(db):
+    """Dashboard index covering the (last_message_time, _id) page cursor"""
+    create_index(db, 'conversations', [
+        ('participants', ASCENDING), ('last_message_time', DESCENDING), ('_id', DESCENDING)
+    ])
+    if 'participants_1_last_message_time_-1' in db['conversations'].index_information():
+        db['conversations'].drop_index('participants_1_last_message_time_-1')
+
+def migration_003_sync_indexes(db):
+    """Indexes for incremental account sync and deletion tombstones"""
+    # Conversations touched since a sync token
+    create_index(db, 'conversations', [('participants', ASCENDING), ('updated_at', ASCENDING)])
+
+    # Deletions in the changed conversations
+    create_index(db, 'message_tombstones', [('conversation_id', ASCENDING), ('deleted_at', ASCENDING)])
+
+    # Tombstones only need to outlive the oldest sync token we accept
+    create_index(db, 'message_tombstones', [('deleted_at', ASCENDING)],
+                 expireAfterSeconds=TOMBSTONE_RETENTION_DAYS * 24 * 60 * 60)
+
+def migration_004_upload_session_expiry(db):
+    """Expire abandoned chunked upload sessions"""
+    create_index(db, 'upload_sessions', [('updated_at', ASCENDING)],
+                 expireAfterSeconds=STALE_UPLOAD_HOURS * 60 * 60)
+
+def migration_005_job_queue(db):
+    """Indexes for claiming background jobs and expiring finished ones"""
+    # Workers claim due jobs oldest first
+    create_index(db, 'jobs', [('status', ASCENDING), ('run_at', ASCENDING)])
+
+    # Stale leases left behind by a worker that died mid-job
+    create_index(db, 'jobs', [('status', ASCENDING), ('locked_at', ASCENDING)])
+
+    # Finished jobs only need to live long enough for clients to poll them
+    create_index(db, 'jobs', [('finished_at', ASCENDING)],
+                 expireAfterSeconds=FINISHED_JOB_RETENTION_DAYS * 24 * 60 * 60)
+
+def backfill_search_terms(db, query):
+    """Set search terms on the messages matching query"""
+    messages = db['messages']
+    cursor = messages.find(query, {'content': 1, 'original_name': 1}).batch_size(BACKFILL_BATCH_SIZE)
+
+    updated = 0
+    batch = []
+    for message in cursor:
+        terms = search.search_terms(message.get('content'), message.get('original_name'))
+        batch.append(UpdateOne({'_id': message['_id']}, {'$set': {'search_terms': terms}}))
+        if len(batch) >= BACKFILL_BATCH_SIZE:
+            messages.bulk_write(batch, ordered=False)
+            updated += len(batch)
+            batch = []
+            logger.info("Indexed %d messages", updated)
+    if batch:
+        messages.bulk_write(batch, ordered=False)
+        updated += len(batch)
+    logger.info("Added search terms to %d messages", updated)
+
+def migration_006_message_search(db):
+    """Search terms on existing messages and the search index"""
+    backfill_search_terms(db, {'search_terms': {'$exists': False}})
+
+    # Term lookup, then the caller's conversations, newest first
+    create_index(db, 'messages', [
+        ('search_terms', ASCENDING), ('conversation_id', ASCENDING),
+        ('timestamp', DESCENDING), ('_id', DESCENDING)
+    ])
+
+def migration_007_dashboard_cache(db):
+    """Expire shared dashboard cache entries"""
+    create_index(db, 'dashboard_cache', [('expires_at', ASCENDING)], expireAfterSeconds=0)
+
+def migration_008_file_search_terms(db):
+    """Re-index file messages by their uploaded name instead of their blob name"""
+    backfill_search_terms(db, {'message_type': {'$ne': 'text'}})
+
+MIGRATIONS = [
+    (1, migration_001_initial_indexes),
+    (2, migration_002_conversation_keyset_index),
+    (3, migration_003_sync_indexes),
+    (4, migration_004_upload_session_expiry),
+    (5, migration_005_job_queue),
+    (6, migration_006_message_search),
+    (7, migration_007_dashboard_cache),
+    (8, migration_008_file_search_terms),
+]
+
+def get_schema_version(db):
+    """Highest applied version; versions still being applied elsewhere do not count"""
+    record = db[MIGRATIONS_COLLECTION].find_one({'applied_at': {'$exists': True}}, sort=[('version', DESCENDING)])
+    return record['version'] if record else 0
+
+def claim_migration(db, version, migration):
+    """Record that this process is applying version; False if another process already has"""
+    try:
+        db[MIGRATIONS_COLLECTION].insert_one({
+            '_id': version,
+            'version': version,
+            'name': migration.__name__,
+            'claimed_at': datetime.now(timezone.utc)
+        })
+        return True
+    except DuplicateKeyError:
+        return False
+
+def run_migrations(db):
+    """Apply every migration newer than the recorded schema version"""
+    current_version = get_schema_version(db)
+    pending = [(version, migration) for version, migration in MIGRATIONS if version > current_version]
+
+    if not pending:
+        logger.info("Database schema is up to date (version %d)", current_version)
+        return current_version
+
+    for version, migration in pending:
+        if not claim_migration(db, version, migration):
+            logger.info("Migration %d is being applied by another process; leaving the rest to it", version)
+            return current_version
+        logger.info("Applying migration %d: %s", version, migration.__doc__)
+        try:
+            migration(db)
+        except Exception as e:
+            logger.error("Migration %d failed: %s", version, e)
+            # Release the claim so the next run retries this version
+            db[MIGRATIONS_COLLECTION].delete_one({'_id': version, 'applied_at': {'$exists': False}})
+            raise
+        db[MIGRATIONS_COLLECTION].update_one(
+            {'_id': version}, {'$set': {'applied_at': datetime.now(timezone.utc)}}
+        )
+        current_version = version
+
+    logger.info("Database schema migrated to version %d", current_version)
+    return current_version
+
+if __name__ == "__main__":
+    from pymongo import MongoClient
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    client = MongoClient('mongodb://localhost:27017/')
+    run_migrations(client['chat_app'])
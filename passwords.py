@@ -0,0 +1,128 @@
+"""
+Password hashing off the request threads.
+bcrypt runs on a small thread pool (bcrypt releases the GIL, so hashes run
+in parallel) behind a bounded admission limit: when too many hashes are
+already queued, callers get HasherBusy at once instead of waiting, so a
+burst of logins cannot stall every other request. Also provides in-memory
+attempt throttling for the auth routes.
+"""
+
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import threading
+import time
+
+import bcrypt
+
+class HasherBusy(Exception):
+    """Raised when the hashing pool is saturated"""
+
+class PasswordHasher:
+    """bcrypt with a configurable work factor on a bounded executor"""
+
+    def __init__(self, rounds=12, workers=4, max_pending=32, timeout=10.0):
+        self.rounds = rounds
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy("Password hashing is saturated")
+        try:
+            future = self._executor.submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(self.timeout)
+        except FutureTimeout:
+            # The hash keeps its slot until it finishes, so the pool stays bounded
+            raise HasherBusy("Password hashing timed out") from None
+
+    def hash(self, password):
+        return self._run(lambda: bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=self.rounds)))
+
+    def check(self, password, hashed):
+        return self._run(lambda: bcrypt.checkpw(password.encode('utf-8'), hashed))
+
+    def needs_rehash(self, hashed):
+        """Whether a stored hash was made with a different work factor"""
+        try:
+            # $2b$<cost>$<salt+hash>
+            return int(bytes(hashed).split(b'$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return False
+
+class AttemptThrottle:
+    """Sliding-window attempt limit per key (an IP address or an account).
+
+    Expired keys are pruned once per window. At most max_keys keys are
+    tracked; past that the key with the oldest latest attempt is dropped,
+    so a spray over many keys cannot grow memory without bound.
+    """
+
+    def __init__(self, limit, window_seconds, max_keys=100000, clock=time.monotonic):
+        self.limit = limit
+        self.window = window_seconds
+        self.max_keys = max_keys
+        self.clock = clock
+        self._attempts = OrderedDict()  # key -> attempt times, least recently attempted first
+        self._next_prune = clock() + window_seconds
+        self._lock = threading.Lock()
+
+    def _recent(self, key, now):
+        attempts = self._attempts.get(key)
+        if attempts is None:
+            return None
+        while attempts and attempts[0] <= now - self.window:
+            attempts.popleft()
+        if not attempts:
+            del self._attempts[key]
+            return None
+        return attempts
+
+    def retry_after(self, key):
+        """Seconds until key may try again; 0 when it is not throttled"""
+        now = self.clock()
+        with self._lock:
+            attempts = self._recent(key, now)
+            if not attempts or len(attempts) < self.limit:
+                return 0
+            return max(1, int(attempts[0] + self.window - now + 0.999))
+
+    def record(self, key):
+        now = self.clock()
+        with self._lock:
+            if now >= self._next_prune:
+                self._prune(now)
+            attempts = self._recent(key, now)
+            if attempts is None:
+                while len(self._attempts) >= self.max_keys:
+                    self._attempts.popitem(last=False)
+                attempts = self._attempts[key] = deque()
+            else:
+                self._attempts.move_to_end(key)
+            attempts.append(now)
+
+    def reset(self, key):
+        with self._lock:
+            self._attempts.pop(key, None)
+
+    def reset_all(self):
+        with self._lock:
+            self._attempts.clear()
+
+    def prune(self):
+        """Forget keys with no attempts left in the window"""
+        with self._lock:
+            self._prune(self.clock())
+
+    def _prune(self, now):
+        for key in list(self._attempts):
+            self._recent(key, now)
+        self._next_prune = now + self.window
+
+    def __len__(self):
+        return len(self._attempts)
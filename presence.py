@@ -0,0 +1,138 @@
+"""
+Presence tracking for the ChatFlow application.
+Clients heartbeat while a page is open; an in-memory table turns the time
+since a user's last heartbeat (and last activity) into online, away or
+offline. Nothing is written or pushed per heartbeat: collect() reports only
+the net status changes since it last ran, so a user who flickers between
+states within one flush interval produces no change at all.
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger('chatflow.presence')
+
+ONLINE = 'online'
+AWAY = 'away'
+OFFLINE = 'offline'
+
+class _Entry:
+    __slots__ = ('last_seen', 'last_active', 'idle', 'seen_at')
+
+    def __init__(self, now, wall):
+        self.last_seen = now
+        self.last_active = now
+        self.idle = False
+        self.seen_at = wall
+
+class PresenceTracker:
+    """Heartbeat table with expiry and coalesced status changes"""
+
+    def __init__(self, away_after=300, offline_after=75, clock=time.monotonic, wall_clock=time.time):
+        self.away_after = away_after
+        self.offline_after = offline_after
+        self.clock = clock
+        self.wall_clock = wall_clock
+        self._entries = {}
+        self._published = {}
+        self._departed = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def heartbeat(self, user_id, idle=False):
+        """Record that a user is connected; idle heartbeats keep them away rather than online"""
+        now, wall = self.clock(), self.wall_clock()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                entry = self._entries[user_id] = _Entry(now, wall)
+            entry.last_seen = now
+            entry.seen_at = wall
+            entry.idle = idle
+            if not idle:
+                entry.last_active = now
+
+    def disconnect(self, user_id):
+        """The user closed their last connection; they are offline from now"""
+        with self._lock:
+            entry = self._entries.pop(user_id, None)
+            if entry is not None:
+                self._departed[user_id] = self.wall_clock()
+
+    def _status(self, entry, now):
+        if entry is None or now - entry.last_seen > self.offline_after:
+            return OFFLINE
+        if entry.idle or now - entry.last_active > self.away_after:
+            return AWAY
+        return ONLINE
+
+    def status(self, user_id):
+        with self._lock:
+            return self._status(self._entries.get(user_id), self.clock())
+
+    def statuses(self, user_ids):
+        """{user_id: {'status', 'last_seen'}} for many users; last_seen is a Unix time or None"""
+        now = self.clock()
+        result = {}
+        with self._lock:
+            for user_id in user_ids:
+                entry = self._entries.get(user_id)
+                status = self._status(entry, now)
+                last_seen = entry.seen_at if entry is not None else self._departed.get(user_id)
+                result[user_id] = {'status': status, 'last_seen': last_seen}
+        return result
+
+    def collect(self):
+        """Net status changes since the last call.
+
+        Returns (changes, departed): changes maps user id to new status, and
+        departed maps users who went offline to their last heartbeat time.
+        Expired users are dropped from the table.
+        """
+        now = self.clock()
+        changes = {}
+        departed = {}
+        with self._lock:
+            for user_id in set(self._entries) | set(self._published):
+                entry = self._entries.get(user_id)
+                status = self._status(entry, now)
+                if status != self._published.get(user_id, OFFLINE):
+                    changes[user_id] = status
+                if status == OFFLINE:
+                    self._published.pop(user_id, None)
+                    if entry is not None:
+                        del self._entries[user_id]
+                        departed[user_id] = entry.seen_at
+                else:
+                    self._published[user_id] = status
+            departed.update((user_id, seen_at) for user_id, seen_at in self._departed.items()
+                            if user_id not in self._entries)
+            self._departed = {}
+        return changes, departed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._published.clear()
+            self._departed.clear()
+
+    def size(self):
+        with self._lock:
+            return len(self._entries)
+
+    def start(self, interval, on_collect):
+        """Call on_collect(changes, departed) every interval seconds on a background thread"""
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    on_collect(*self.collect())
+                except Exception:
+                    logger.exception("Error flushing presence changes")
+
+        self._thread = threading.Thread(target=run, name='presence-flush', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,622 @@
+"""
+Publish/subscribe for live message delivery.
+Each conversation is a topic. The in-process broker fans events out to this
+worker's subscribers and keeps a bounded history so reconnecting clients
+can resume from their Last-Event-ID; a backend carries events between
+workers (nothing, a Unix socket hub on one host, or a MongoDB capped
+collection across hosts).
+"""
+
+import asyncio
+from collections import deque, namedtuple
+from datetime import datetime, timedelta, timezone
+import fcntl
+import json
+import logging
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+import uuid
+
+from bson import ObjectId
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid, PyMongoError
+
+logger = logging.getLogger('chatflow.pubsub')
+
+Event = namedtuple('Event', ['id', 'type', 'data'])
+
+class Subscription:
+    """A single subscriber's queue of pending events"""
+
+    def __init__(self, broker, topic, max_queue):
+        self.broker = broker
+        self.topic = topic
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.overflowed = False
+
+    def deliver(self, event):
+        """Queue an event, flagging the subscription if the consumer is too slow"""
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout=None):
+        """Wait for the next event, returning None on timeout"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+class AsyncSubscription(Subscription):
+    """A subscription consumed by a coroutine on an event loop.
+
+    Events are published from any thread and handed to the loop, so waiting
+    for the next one holds no thread.
+    """
+
+    def __init__(self, broker, topic, max_queue, loop):
+        self.broker = broker
+        self.topic = topic
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.overflowed = False
+
+    def deliver(self, event):
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            pass  # the event loop has shut down
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self):
+        return await self.queue.get()
+
+class InProcessBroker:
+    """Fan-out broker with a per-topic replay history"""
+
+    def __init__(self, history_size=256, max_queue=1000):
+        self.history_size = history_size
+        self.max_queue = max_queue
+        # Event ids are prefixed with a boot epoch so ids from a previous
+        # process are never mistaken for ids in this one
+        self.epoch = str(int(time.time() * 1000))
+        self._sequence = 0
+        self._history = {}
+        self._evicted = {}
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def publish(self, topic, event_type, data):
+        """Publish an event to every subscriber of a topic"""
+        with self._lock:
+            self._sequence += 1
+            event = Event(f"{self.epoch}:{self._sequence}", event_type, data)
+            history = self._history.setdefault(topic, deque(maxlen=self.history_size))
+            if len(history) == history.maxlen:
+                self._evicted[topic] = _sequence_of(history[0])
+            history.append(event)
+            subscribers = list(self._subscribers.get(topic, ()))
+
+        for subscription in subscribers:
+            subscription.deliver(event)
+        return event
+
+    def subscribe(self, topic, last_event_id=None, loop=None):
+        """Subscribe to a topic.
+
+        Returns (subscription, replay). replay is the list of events published
+        after last_event_id, or None if they are no longer available and the
+        client has to resynchronise from the database. With an event loop
+        the subscription is an AsyncSubscription for that loop.
+        """
+        if loop is None:
+            subscription = Subscription(self, topic, self.max_queue)
+        else:
+            subscription = AsyncSubscription(self, topic, self.max_queue, loop)
+        with self._lock:
+            self._subscribers.setdefault(topic, set()).add(subscription)
+            replay = self._replay_since(topic, last_event_id) if last_event_id else []
+        return subscription, replay
+
+    def history_since(self, topic, last_event_id):
+        """Events published after last_event_id, or None if some are no longer available"""
+        with self._lock:
+            return self._replay_since(topic, last_event_id)
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.topic)
+            if subscribers:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.topic]
+
+    def subscriber_count(self, topic):
+        with self._lock:
+            return len(self._subscribers.get(topic, ()))
+
+    def _replay_since(self, topic, last_event_id):
+        epoch, _, sequence = last_event_id.partition(':')
+        if epoch != self.epoch or not sequence.isdigit():
+            return None
+
+        sequence = int(sequence)
+        # Events after the client's last one have already been evicted
+        if sequence > self._sequence or sequence < self._evicted.get(topic, 0):
+            return None
+
+        return [event for event in self._history.get(topic, ()) if _sequence_of(event) > sequence]
+
+def _sequence_of(event):
+    return int(event.id.rsplit(':', 1)[1])
+
+# Cross-worker backends
+#
+# The broker above only reaches clients connected to this process. A backend
+# carries each published message to the other workers, which deliver it to
+# their own clients; the publishing worker has already delivered it locally.
+# Messages are dicts with a 'topic' and a 'kind': 'event' (stored in the
+# broker history and sent to gateway subscribers) or 'frame' (an ephemeral
+# gateway frame such as a typing indicator).
+
+BACKENDS = ('inprocess', 'unix', 'mongo')
+DEFAULT_SOCKET_PATH = '/tmp/chatflow-pubsub.sock'
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+RECV_SIZE = 64 * 1024
+
+class InProcessBackend:
+    """Single worker: every subscriber is already reached by the local broker"""
+
+    name = 'inprocess'
+
+    def start(self, deliver):
+        pass
+
+    def publish(self, message):
+        pass
+
+    def flush(self, timeout=None):
+        return True
+
+    def close(self):
+        pass
+
+    def stats(self):
+        return {'backend': self.name, 'published': 0, 'received': 0, 'dropped': 0, 'connected': True}
+
+class _QueuedBackend:
+    """Publishes from a bounded queue on a sender thread.
+
+    Request threads never wait on the transport: messages are handed to the
+    sender, which writes everything queued so far in one batch. If the queue
+    is full (the transport is down or too slow) messages are dropped and
+    counted rather than blocking the publisher.
+    """
+
+    name = None
+
+    def __init__(self, max_queue=10000):
+        self.max_queue = max_queue
+        self.published = 0
+        self.received = 0
+        self.dropped = 0
+        self._queue = deque()
+        self._sending = 0
+        self._ready = threading.Condition()
+        self._closed = threading.Event()
+        self._deliver = None
+
+    def start(self, deliver):
+        self._deliver = deliver
+        threading.Thread(target=self._send_loop, name=f'pubsub-{self.name}-send', daemon=True).start()
+
+    def publish(self, message):
+        with self._ready:
+            if len(self._queue) >= self.max_queue:
+                self.dropped += 1
+                return False
+            self._queue.append(message)
+            self._ready.notify_all()
+            return True
+
+    def flush(self, timeout=None):
+        """Wait until everything published so far has been sent; False on timeout"""
+        with self._ready:
+            return self._ready.wait_for(lambda: not self._queue and not self._sending, timeout)
+
+    def close(self):
+        self._closed.set()
+        with self._ready:
+            self._ready.notify_all()
+
+    def connected(self):
+        return True
+
+    def stats(self):
+        return {'backend': self.name, 'published': self.published, 'received': self.received,
+                'dropped': self.dropped, 'connected': self.connected()}
+
+    def _receive(self, message):
+        self.received += 1
+        try:
+            self._deliver(message)
+        except Exception:
+            logger.exception("Error delivering %s message from another worker", message.get('kind'))
+
+    def _send_loop(self):
+        while True:
+            with self._ready:
+                while not self._queue and not self._closed.is_set():
+                    self._ready.wait()
+                if self._closed.is_set():
+                    return
+                batch = list(self._queue)
+                self._queue.clear()
+                self._sending = len(batch)
+            try:
+                self._send_batch(batch)
+                self.published += len(batch)
+            except Exception:
+                self.dropped += len(batch)
+                logger.warning("Dropped %d pub/sub messages: %s backend unavailable", len(batch), self.name,
+                               exc_info=True)
+            with self._ready:
+                self._sending = 0
+                self._ready.notify_all()
+
+    def _send_batch(self, messages):
+        raise NotImplementedError
+
+def _encode_frame(message):
+    payload = json.dumps(message, default=str).encode('utf-8')
+    return struct.pack('!I', len(payload)) + payload
+
+def _read_frames(sock):
+    """Yield length-prefixed frames from a stream socket until it closes"""
+    buffer = bytearray()
+    while True:
+        try:
+            data = sock.recv(RECV_SIZE)
+        except socket.timeout:
+            continue  # the hub sets a timeout for its sends, not for waiting on frames
+        if not data:
+            return
+        buffer += data
+        while len(buffer) >= 4:
+            length = struct.unpack_from('!I', buffer)[0]
+            if length > MAX_FRAME_SIZE:
+                raise ConnectionError(f"Pub/sub frame of {length} bytes is too large")
+            if len(buffer) < 4 + length:
+                break
+            yield bytes(buffer[4:4 + length])
+            del buffer[:4 + length]
+
+class UnixSocketHub:
+    """Relays frames from each worker connected to a Unix socket to all the others.
+
+    Frames are forwarded as raw bytes and never decoded. A worker that cannot
+    take a frame within send_timeout is disconnected and reconnects.
+    """
+
+    def __init__(self, path, send_timeout=5.0):
+        self.path = path
+        self.send_timeout = send_timeout
+        self._server = None
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        # Only the holder of the hub lock gets here, so an existing socket file is stale
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        server.listen(128)
+        self._server = server
+        threading.Thread(target=self._accept_loop, name='pubsub-hub', daemon=True).start()
+
+    def client_count(self):
+        with self._lock:
+            return len(self._clients)
+
+    def close(self):
+        if self._server is None:
+            return
+        try:
+            self._server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._server.close()
+        with self._lock:
+            clients, self._clients = list(self._clients), {}
+        for client in clients:
+            _close_socket(client)
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def _accept_loop(self):
+        while True:
+            try:
+                client, _ = self._server.accept()
+            except OSError:
+                return
+            client.settimeout(self.send_timeout)
+            with self._lock:
+                self._clients[client] = threading.Lock()
+            threading.Thread(target=self._relay_loop, args=(client,), name='pubsub-hub-relay', daemon=True).start()
+
+    def _relay_loop(self, client):
+        try:
+            for frame in _read_frames(client):
+                self._relay(client, struct.pack('!I', len(frame)) + frame)
+        except (OSError, ConnectionError):
+            pass
+        finally:
+            self._drop(client)
+
+    def _relay(self, sender, data):
+        with self._lock:
+            targets = [(client, lock) for client, lock in self._clients.items() if client is not sender]
+        for client, lock in targets:
+            try:
+                with lock:
+                    client.sendall(data)
+            except OSError:
+                logger.warning("Disconnecting pub/sub worker that stopped reading")
+                self._drop(client)
+
+    def _drop(self, client):
+        with self._lock:
+            self._clients.pop(client, None)
+        _close_socket(client)
+
+def _close_socket(sock):
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    sock.close()
+
+class UnixSocketBackend(_QueuedBackend):
+    """Workers on one host exchange messages through a hub on a Unix socket.
+
+    The first worker to take an flock on ``<path>.lock`` runs the hub; the
+    lock is released when that process exits, and the next worker to find
+    the hub gone takes over. Messages published while no hub is reachable
+    are dropped.
+    """
+
+    name = 'unix'
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH, run_hub=True, reconnect_delay=0.5, max_queue=10000):
+        super().__init__(max_queue)
+        self.path = path
+        self.run_hub = run_hub
+        self.reconnect_delay = reconnect_delay
+        self.hub = None
+        self._hub_lock_file = None
+        self._sock = None
+        self._sock_lock = threading.Lock()
+        self._connected = threading.Event()
+
+    def start(self, deliver):
+        super().start(deliver)
+        sock = self._connect()
+        threading.Thread(target=self._receive_loop, args=(sock,), name='pubsub-unix-receive', daemon=True).start()
+
+    def connected(self):
+        return self._connected.is_set()
+
+    def wait_connected(self, timeout=None):
+        return self._connected.wait(timeout)
+
+    def close(self):
+        super().close()
+        with self._sock_lock:
+            sock, self._sock = self._sock, None
+        if sock is not None:
+            _close_socket(sock)
+        if self.hub is not None:
+            self.hub.close()
+            self.hub = None
+        if self._hub_lock_file is not None:
+            self._hub_lock_file.close()
+            self._hub_lock_file = None
+
+    def _connect(self):
+        """Connect to the hub, starting it if no worker runs one; None if unreachable"""
+        for _ in range(2):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                if not (self.run_hub and self._take_hub()):
+                    return None
+                continue
+            with self._sock_lock:
+                self._sock = sock
+            self._connected.set()
+            return sock
+        return None
+
+    def _take_hub(self):
+        if self.hub is not None:
+            return True
+        lock_file = open(self.path + '.lock', 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        hub = UnixSocketHub(self.path)
+        try:
+            hub.start()
+        except OSError:
+            lock_file.close()
+            raise
+        self.hub = hub
+        self._hub_lock_file = lock_file
+        logger.info("Running the pub/sub hub on %s", self.path)
+        return True
+
+    def _receive_loop(self, sock):
+        while not self._closed.is_set():
+            if sock is None:
+                self._closed.wait(self.reconnect_delay)
+                if self._closed.is_set():
+                    return
+                try:
+                    sock = self._connect()
+                except OSError:
+                    logger.exception("Could not start the pub/sub hub")
+                continue
+            try:
+                for frame in _read_frames(sock):
+                    self._receive(json.loads(frame))
+            except (OSError, ConnectionError, ValueError):
+                pass
+            self._connected.clear()
+            with self._sock_lock:
+                if self._sock is sock:
+                    self._sock = None
+            _close_socket(sock)
+            sock = None
+            if not self._closed.is_set():
+                logger.warning("Lost the pub/sub hub connection; reconnecting")
+
+    def _send_batch(self, messages):
+        with self._sock_lock:
+            sock = self._sock
+        if sock is None:
+            raise ConnectionError("Not connected to the pub/sub hub")
+        sock.sendall(b''.join(_encode_frame(message) for message in messages))
+
+class MongoBackend(_QueuedBackend):
+    """Nodes exchange messages through a capped collection read with a tailable cursor.
+
+    Each batch of published messages is one insert_many. Every node tails
+    the collection and skips its own messages. ObjectIds are generated on
+    the publishing nodes, so after a cursor is re-opened the last
+    overlap_seconds are read again and already seen ids are skipped.
+    """
+
+    name = 'mongo'
+    MESSAGE_FIELDS = ('topic', 'kind', 'type', 'data', 'payload', 'exclude_user', 'users')
+
+    def __init__(self, collection, node_id=None, size_bytes=64 * 1024 * 1024, max_documents=100000,
+                 overlap_seconds=2, await_ms=1000, retry_delay=1.0, max_queue=10000):
+        super().__init__(max_queue)
+        self.collection = collection
+        self.node_id = node_id or uuid.uuid4().hex
+        self.size_bytes = size_bytes
+        self.max_documents = max_documents
+        self.overlap_seconds = overlap_seconds
+        self.await_ms = await_ms
+        self.retry_delay = retry_delay
+        self._horizon = None
+        self._seen = set()
+        self._seen_order = deque()
+
+    def ensure_collection(self):
+        """Create the capped collection if it does not exist yet"""
+        database = self.collection.database
+        if self.collection.name in database.list_collection_names():
+            return
+        try:
+            database.create_collection(self.collection.name, capped=True, size=self.size_bytes,
+                                       max=self.max_documents)
+        except CollectionInvalid:
+            return  # another node created it first
+        # A tailable cursor on an empty collection dies at once; give it something to wait after
+        self.collection.insert_one({'kind': 'init', 'origin': self.node_id})
+
+    def start(self, deliver):
+        self.ensure_collection()
+        self._prime()
+        super().start(deliver)
+        threading.Thread(target=self._tail_loop, name='pubsub-mongo-tail', daemon=True).start()
+
+    def poll(self):
+        """Deliver new messages once with a regular cursor; returns the number delivered"""
+        if self._horizon is None:
+            self._prime()
+        return self._consume(self._cursor())
+
+    def _prime(self):
+        """Start from now: mark messages already in the overlap window as seen"""
+        self._horizon = datetime.now(timezone.utc)
+        for document in self._cursor(projection={'_id': 1}):
+            self._mark_seen(document['_id'])
+
+    def _cursor(self, cursor_type=CursorType.NON_TAILABLE, projection=None):
+        since = ObjectId.from_datetime(self._horizon - timedelta(seconds=self.overlap_seconds))
+        cursor = self.collection.find({'_id': {'$gte': since}}, projection, cursor_type=cursor_type)
+        if cursor_type == CursorType.TAILABLE_AWAIT:
+            cursor = cursor.max_await_time_ms(self.await_ms)
+        return cursor
+
+    def _consume(self, cursor):
+        delivered = 0
+        for document in cursor:
+            if document['_id'] in self._seen:
+                continue
+            self._mark_seen(document['_id'])
+            if document.get('origin') == self.node_id or document.get('kind') not in ('event', 'frame', 'invalidate'):
+                continue
+            self._receive({field: document[field] for field in self.MESSAGE_FIELDS if field in document})
+            delivered += 1
+            if self._closed.is_set():
+                break
+        return delivered
+
+    def _mark_seen(self, object_id):
+        self._seen.add(object_id)
+        self._seen_order.append(object_id)
+        generated = object_id.generation_time
+        if generated > self._horizon:
+            self._horizon = generated
+        # Ids older than the overlap window can never be read again
+        cutoff = self._horizon - timedelta(seconds=self.overlap_seconds + 1)
+        while self._seen_order and self._seen_order[0].generation_time < cutoff:
+            self._seen.discard(self._seen_order.popleft())
+
+    def _tail_loop(self):
+        while not self._closed.is_set():
+            try:
+                cursor = self._cursor(CursorType.TAILABLE_AWAIT)
+                while cursor.alive and not self._closed.is_set():
+                    self._consume(cursor)
+            except PyMongoError:
+                logger.warning("Pub/sub tailable cursor failed; re-opening", exc_info=True)
+            self._closed.wait(self.retry_delay)
+
+    def _send_batch(self, messages):
+        self.collection.insert_many([dict(message, origin=self.node_id) for message in messages], ordered=True)
+
+def create_backend(name, socket_path=DEFAULT_SOCKET_PATH, collection=None):
+    """The cross-worker backend called name (one of BACKENDS)"""
+    if name == 'inprocess':
+        return InProcessBackend()
+    if name == 'unix':
+        return UnixSocketBackend(socket_path)
+    if name == 'mongo':
+        if collection is None:
+            raise ValueError("The mongo pub/sub backend needs a collection")
+        return MongoBackend(collection)
+    raise ValueError(f"Unknown pub/sub backend {name!r}; expected one of {', '.join(BACKENDS)}")
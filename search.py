@@ -0,0 +1,69 @@
+"""
+Keyword indexing and snippet highlighting for message search.
+Each message stores its normalized terms in a search_terms array, which is
+covered by a multikey index, so a search is an index lookup on the rarest
+term instead of a scan over message content.
+"""
+
+import re
+import unicodedata
+
+from markupsafe import escape
+
+MAX_TERMS_PER_MESSAGE = 200
+MAX_QUERY_TERMS = 8
+MIN_TERM_LENGTH = 2
+SNIPPET_CONTEXT = 40
+
+STOP_WORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'for', 'if', 'in',
+    'into', 'is', 'it', 'no', 'not', 'of', 'on', 'or', 'so', 'that', 'the',
+    'their', 'then', 'there', 'these', 'they', 'this', 'to', 'was', 'will', 'with'
+}
+
+WORD_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+def normalize(word):
+    """Lowercase and strip accents so 'Café' matches 'cafe'"""
+    decomposed = unicodedata.normalize('NFKD', word.lower())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+def tokenize(text):
+    """Normalized terms of text in order of appearance, without stop words"""
+    terms = []
+    for match in WORD_PATTERN.finditer(text or ''):
+        term = normalize(match.group())
+        if len(term) >= MIN_TERM_LENGTH and term not in STOP_WORDS:
+            terms.append(term)
+    return terms
+
+def search_terms(*texts):
+    """Distinct terms to store on a message for indexing"""
+    terms = dict.fromkeys(term for text in texts for term in tokenize(text))
+    return list(terms)[:MAX_TERMS_PER_MESSAGE]
+
+def query_terms(query):
+    """Distinct terms of a search query, longest (usually rarest) first"""
+    return sorted(set(tokenize(query)), key=len, reverse=True)[:MAX_QUERY_TERMS]
+
+def highlight(text, terms):
+    """HTML snippet of text around the first match with matched words in <mark>"""
+    text = text or ''
+    terms = set(terms)
+    matches = [match for match in WORD_PATTERN.finditer(text) if normalize(match.group()) in terms]
+    if not matches:
+        return str(escape(text[:2 * SNIPPET_CONTEXT]))
+
+    start = max(0, matches[0].start() - SNIPPET_CONTEXT)
+    end = min(len(text), matches[0].end() + SNIPPET_CONTEXT)
+    parts = ['…' if start > 0 else '']
+    position = start
+    for match in matches:
+        if match.start() < start or match.end() > end:
+            continue
+        parts.append(str(escape(text[position:match.start()])))
+        parts.append(f"<mark>{escape(match.group())}</mark>")
+        position = match.end()
+    parts.append(str(escape(text[position:end])))
+    parts.append('…' if end < len(text) else '')
+    return ''.join(parts)
@@ -0,0 +1,142 @@
+"""
+Structured, non-blocking logging for the ChatFlow application.
+Records are formatted as one JSON object per line. Request threads only put
+records on a bounded queue; a background listener thread does the I/O, and
+records are dropped (and counted) rather than blocking when the queue is
+full. High-volume debug events are sampled before they are queued.
+"""
+
+import atexit
+from datetime import datetime, timezone
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+
+# LogRecord attributes that are not user-supplied extra fields
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'sample_rate'}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with extra= fields as top-level keys"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'thread': record.threadName
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class ContextFilter(logging.Filter):
+    """Adds fields from context() (e.g. the current request) to every record.
+
+    Runs on the calling thread, before the record is queued, so it can see
+    thread- and request-local state.
+    """
+
+    def __init__(self, context):
+        super().__init__()
+        self.context = context
+
+    def filter(self, record):
+        try:
+            fields = self.context() or {}
+        except Exception:
+            fields = {}
+        for key, value in fields.items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+class SamplingFilter(logging.Filter):
+    """Keeps only a fraction of low-severity records.
+
+    rates maps a level to the fraction kept; a record may override it with
+    extra={'sample_rate': ...}.
+    """
+
+    def __init__(self, rates, rng=random.random):
+        super().__init__()
+        self.rates = {logging._checkLevel(level): rate for level, rate in rates.items()}
+        self.rng = rng
+
+    def filter(self, record):
+        rate = getattr(record, 'sample_rate', self.rates.get(record.levelno, 1.0))
+        return rate >= 1.0 or self.rng() < rate
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks: records are dropped when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Format the message now; args may not be safe to read on another thread
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def parse_levels(value):
+    """Parse 'logger=LEVEL,...' into a dict"""
+    levels = {}
+    for part in (value or '').split(','):
+        name, _, level = part.partition('=')
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+def _stop_listener(listener):
+    # Flushes whatever is still queued; safe if the listener was already stopped
+    if listener._thread is not None:
+        listener.stop()
+
+def configure_logging(name, level='INFO', levels=None, debug_sample_rate=1.0,
+                      queue_size=10000, stream=None, context=None):
+    """Route the named logger tree through a background JSON writer.
+
+    Returns (handler, listener). The listener is stopped at interpreter exit
+    so queued records are flushed.
+    """
+    root = logging.getLogger(name)
+    root.setLevel(level)
+    root.propagate = False
+    for logger_name, logger_level in (levels or {}).items():
+        logging.getLogger(logger_name).setLevel(logger_level)
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    handler = DroppingQueueHandler(log_queue)
+    if context is not None:
+        handler.addFilter(ContextFilter(context))
+    handler.addFilter(SamplingFilter({'DEBUG': debug_sample_rate}))
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter())
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(_stop_listener, listener)
+
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    return handler, listener
@@ -0,0 +1,247 @@
+"""
+Tests for the ASGI entry point, driven directly through the ASGI interface.
+"""
+
+import asyncio
+import json
+import threading
+import time
+
+from asgi import ChatFlowASGI, application, spool_body
+from async_db import AsyncMongo
+from conftest import chat_app, login_as, make_conversation, make_user
+
+
+def session_cookie(user_id, name, email):
+    serializer = chat_app.app.session_interface.get_signing_serializer(chat_app.app)
+    value = serializer.dumps({'user_id': str(user_id), 'username': name, 'email': email})
+    return f"{chat_app.app.config['SESSION_COOKIE_NAME']}={value}"
+
+def make_scope(scope_type, path, cookie=None, method='GET', query_string=b'', headers=()):
+    headers = [(b'host', b'localhost'), *headers]
+    if cookie:
+        headers.append((b'cookie', cookie.encode('latin-1')))
+    scope = {'type': scope_type, 'path': path, 'query_string': query_string, 'headers': headers,
+             'server': ('localhost', 80), 'client': ('127.0.0.1', 5000), 'scheme': 'http'}
+    if scope_type == 'http':
+        scope['method'] = method
+    return scope
+
+def body_messages(body, size=64 * 1024):
+    """http.request messages delivering body in chunks"""
+    chunks = [body[start:start + size] for start in range(0, len(body), size)] or [b'']
+    return [{'type': 'http.request', 'body': chunk, 'more_body': i < len(chunks) - 1}
+            for i, chunk in enumerate(chunks)]
+
+async def http_request(app, method, path, cookie=None, body=b''):
+    """Run one request to completion; returns (status, headers, body)"""
+    requests = body_messages(body)
+    sent = []
+
+    async def receive():
+        if requests:
+            return requests.pop(0)
+        await asyncio.Event().wait()
+
+    async def send(message):
+        sent.append(message)
+
+    await app(make_scope('http', path, cookie, method, headers=[(b'content-length', str(len(body)).encode())]),
+              receive, send)
+    return sent[0]['status'], dict(sent[0]['headers']), b''.join(m.get('body', b'') for m in sent[1:])
+
+class AsgiWebSocket:
+    """One client of the /ws route"""
+
+    def __init__(self, app, cookie):
+        self.inbox = asyncio.Queue()
+        self.outbox = asyncio.Queue()
+        self.inbox.put_nowait({'type': 'websocket.connect'})
+        self.task = asyncio.ensure_future(app(make_scope('websocket', '/ws', cookie), self.inbox.get, self.outbox.put))
+
+    async def next_message(self):
+        return await asyncio.wait_for(self.outbox.get(), 2)
+
+    async def send(self, payload):
+        await self.inbox.put({'type': 'websocket.receive', 'text': json.dumps(payload)})
+
+    async def receive(self):
+        message = await self.next_message()
+        assert message['type'] == 'websocket.send'
+        return json.loads(message['text'])
+
+    async def disconnect(self):
+        await self.inbox.put({'type': 'websocket.disconnect', 'code': 1000})
+        await asyncio.wait_for(self.task, 2)
+
+class SlowCollection:
+    """Delays writes and records when each one ran"""
+
+    def __init__(self, collection, calls):
+        self.collection = collection
+        self.calls = calls
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def _slow(self, name, *args, **kwargs):
+        started = time.monotonic()
+        time.sleep(0.1)
+        result = getattr(self.collection, name)(*args, **kwargs)
+        self.calls[name] = (started, time.monotonic())
+        return result
+
+    def insert_one(self, *args, **kwargs):
+        return self._slow('insert_one', *args, **kwargs)
+
+    def update_one(self, *args, **kwargs):
+        return self._slow('update_one', *args, **kwargs)
+
+def setup_chat(db):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    return alice, bob, str(make_conversation(db, alice, bob))
+
+def test_flask_routes_are_served_through_the_thread_pool(db):
+    alice, _, _ = setup_chat(db)
+    cookie = session_cookie(alice, 'Alice', 'alice@example.com')
+
+    status, headers, body = asyncio.run(http_request(application, 'GET', '/api/conversations', cookie))
+
+    assert status == 200 and headers[b'content-type'] == b'application/json'
+    assert len(json.loads(body)['conversations']) == 1
+
+def test_large_bodies_are_spooled_to_disk():
+    messages = body_messages(b'x' * (3 * 1024 * 1024))
+
+    async def receive():
+        return messages.pop(0)
+
+    body, size = asyncio.run(spool_body(receive, max_memory=1024 * 1024))
+
+    assert size == 3 * 1024 * 1024 and body._rolled
+    assert body.read() == b'x' * size
+    body.close()
+
+def test_upload_chunks_stream_through_the_bridge(db, client, upload_folder):
+    alice, _, conversation_id = setup_chat(db)
+    login_as(client, alice, 'Alice', 'alice@example.com')
+    payload = bytes(range(256)) * 8192
+    upload = client.post('/api/uploads', json={
+        'conversation_id': conversation_id, 'filename': 'big.pdf', 'size': len(payload), 'kind': 'file'
+    }).get_json()
+    cookie = session_cookie(alice, 'Alice', 'alice@example.com')
+
+    async def put_chunk():
+        requests = body_messages(payload)
+        sent = []
+
+        async def receive():
+            return requests.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        headers = [(b'upload-offset', b'0'), (b'content-type', b'application/octet-stream'),
+                   (b'content-length', str(len(payload)).encode())]
+        await application(make_scope('http', f"/api/uploads/{upload['upload_id']}", cookie, 'PUT', headers=headers),
+                          receive, send)
+        return sent[0]['status'], json.loads(b''.join(m.get('body', b'') for m in sent[1:]))
+
+    status, data = asyncio.run(put_chunk())
+
+    assert status == 200 and data['offset'] == len(payload)
+    assert (upload_folder / 'partial' / upload['upload_id']).read_bytes() == payload
+
+def test_send_message_writes_the_message_and_conversation_concurrently(db, monkeypatch):
+    alice, bob, conversation_id = setup_chat(db)
+    calls = {}
+    monkeypatch.setattr(chat_app, 'messages', SlowCollection(chat_app.messages, calls))
+    monkeypatch.setattr(chat_app, 'conversations', SlowCollection(chat_app.conversations, calls))
+    body = json.dumps({'conversation_id': conversation_id, 'content': 'hello'}).encode()
+
+    status, _, response = asyncio.run(http_request(
+        application, 'POST', '/api/send_message', session_cookie(alice, 'Alice', 'alice@example.com'), body
+    ))
+
+    assert status == 200 and json.loads(response)['message']['content'] == 'hello'
+    (insert_start, insert_end), (update_start, update_end) = calls['insert_one'], calls['update_one']
+    assert insert_start < update_end and update_start < insert_end
+    assert db['messages'].find_one()['content'] == 'hello'
+    assert db['conversations'].find_one()['unread_count'][str(bob)] == 1
+
+def test_oversized_send_message_is_rejected(db):
+    alice, _, conversation_id = setup_chat(db)
+    body = json.dumps({'conversation_id': conversation_id, 'content': 'x' * (128 * 1024)}).encode()
+
+    status, _, response = asyncio.run(http_request(
+        application, 'POST', '/api/send_message', session_cookie(alice, 'Alice', 'alice@example.com'), body
+    ))
+
+    assert status == 413 and json.loads(response)['error'] == 'Message too large'
+    assert db['messages'].count_documents({}) == 0
+
+def test_send_message_requires_a_session(db):
+    status, _, body = asyncio.run(http_request(application, 'POST', '/api/send_message', body=b'{}'))
+    assert status == 401 and json.loads(body)['error'] == 'Not authenticated'
+
+def test_idle_websockets_share_a_few_threads(db):
+    alice, bob, conversation_id = setup_chat(db)
+    app = ChatFlowASGI(chat_app.app, threads=4, mongo=AsyncMongo(workers=2))
+
+    async def scenario():
+        threads_before = threading.active_count()
+        sockets = [
+            AsgiWebSocket(app, session_cookie(user, name, f'{name.lower()}@example.com'))
+            for _ in range(100) for user, name in ((alice, 'Alice'), (bob, 'Bob'))
+        ]
+        for ws in sockets:
+            assert (await ws.next_message())['type'] == 'websocket.accept'
+            await ws.send({'type': 'subscribe', 'conversation_id': conversation_id})
+            assert (await ws.receive())['type'] == 'subscribed'
+        assert threading.active_count() - threads_before <= 6
+
+        await sockets[0].send({'type': 'message', 'conversation_id': conversation_id, 'content': 'hi', 'ref': 1})
+        sent = await sockets[0].receive()
+        delivered = await sockets[1].receive()
+        assert sent['type'] == 'sent' and sent['ref'] == 1
+        assert delivered['type'] == 'message' and delivered['data']['id'] == sent['message']['id']
+
+        for ws in sockets:
+            await ws.disconnect()
+
+    asyncio.run(scenario())
+    assert chat_app.gateway.registry.stats()['connections'] == 0
+    assert db['messages'].count_documents({}) == 1
+
+def test_websocket_handshake_requires_a_session(db):
+    async def scenario():
+        ws = AsgiWebSocket(application, None)
+        assert await ws.next_message() == {'type': 'websocket.close', 'code': 1008}
+        await asyncio.wait_for(ws.task, 2)
+
+    asyncio.run(scenario())
+
+def test_event_stream_waits_on_the_event_loop(db):
+    alice, _, conversation_id = setup_chat(db)
+    cookie = session_cookie(alice, 'Alice', 'alice@example.com')
+
+    async def scenario():
+        requests, sent = asyncio.Queue(), asyncio.Queue()
+        requests.put_nowait({'type': 'http.request', 'body': b'', 'more_body': False})
+        task = asyncio.ensure_future(application(
+            make_scope('http', f'/api/stream/{conversation_id}', cookie), requests.get, sent.put
+        ))
+        start = await asyncio.wait_for(sent.get(), 2)
+        assert start['status'] == 200 and dict(start['headers'])[b'content-type'].startswith(b'text/event-stream')
+        assert (await asyncio.wait_for(sent.get(), 2))['body'] == b'retry: 3000\n\n'
+
+        chat_app.publish_event(conversation_id, 'delete', {'id': 'm1'})
+        chunk = (await asyncio.wait_for(sent.get(), 2))['body'].decode()
+        assert 'event: delete' in chunk and '"m1"' in chunk
+
+        await requests.put({'type': 'http.disconnect'})
+        await asyncio.wait_for(task, 2)
+        assert chat_app.broker.subscriber_count(conversation_id) == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,52 @@
+"""
+Tests for the conversation list on the home dashboard.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+from conftest import chat_app, login_as, make_conversation, make_user
+
+
+def make_dashboard(db, count):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    start = datetime.now(timezone.utc) - timedelta(hours=1)
+    for i in range(count):
+        friend = make_user(db, f'Friend {i}', f'friend{i}@example.com')
+        conversation_id = make_conversation(db, alice, friend)
+        db['conversations'].update_one(
+            {'_id': conversation_id},
+            {'$set': {'last_message': f'Hi {i}', 'last_message_time': start + timedelta(minutes=i)}}
+        )
+    return alice
+
+def test_get_user_conversations_is_a_single_query(db, command_counter):
+    alice = make_dashboard(db, 8)
+
+    command_counter.reset()
+    result, next_cursor = chat_app.get_user_conversations(str(alice))
+
+    assert command_counter.count == 1
+    assert [conv['other_user']['name'] for conv in result] == [f'Friend {i}' for i in range(7, -1, -1)]
+    assert result[0]['other_user']['email'] == 'friend7@example.com'
+    assert next_cursor is None
+
+def test_conversations_api_pages_with_cursor(db, client):
+    alice = make_dashboard(db, 5)
+    login_as(client, alice, 'Alice', 'alice@example.com')
+
+    first = client.get('/api/conversations', query_string={'limit': 3}).get_json()
+    second = client.get('/api/conversations', query_string={'limit': 3, 'before': first['next_cursor']}).get_json()
+
+    assert [conv['last_message'] for conv in first['conversations']] == ['Hi 4', 'Hi 3', 'Hi 2']
+    assert [conv['last_message'] for conv in second['conversations']] == ['Hi 1', 'Hi 0']
+    assert second['has_more'] is False
+
+def test_home_renders_first_page_only(db, client):
+    alice = make_dashboard(db, 4)
+    login_as(client, alice, 'Alice', 'alice@example.com')
+
+    body = client.get('/home', query_string={'limit': 2}).get_data(as_text=True)
+
+    assert 'Friend 3' in body and 'Friend 2' in body
+    assert 'Friend 1' not in body
+    assert 'let conversationsCursor = "' in body
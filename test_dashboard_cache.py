@@ -0,0 +1,125 @@
+"""
+Tests for the versioned per-user dashboard cache.
+"""
+
+import threading
+import time
+
+import mongomock
+
+from cache import MongoCacheStore, VersionedCache
+from conftest import chat_app, login_as, make_conversation, make_user
+
+
+def setup_chat(db):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    return alice, bob, str(make_conversation(db, alice, bob))
+
+def test_repeat_dashboard_views_do_not_touch_the_database(db, client, command_counter):
+    alice, _, _ = setup_chat(db)
+    login_as(client, alice, 'Alice', 'alice@example.com')
+
+    assert client.get('/home').status_code == 200
+    command_counter.reset()
+    assert client.get('/home').status_code == 200
+    assert client.get('/api/conversations').get_json()['conversations'][0]['other_user']['name'] == 'Bob'
+
+    assert command_counter.count == 0
+
+def test_a_new_message_refreshes_both_participants(db, client):
+    alice, bob, conversation_id = setup_chat(db)
+    login_as(client, bob, 'Bob', 'bob@example.com')
+    assert client.get('/api/conversations').get_json()['conversations'][0]['last_message'] == ''
+
+    chat_app.send_text_message(conversation_id, str(alice), 'Alice', 'hello')
+
+    conversation = client.get('/api/conversations').get_json()['conversations'][0]
+    assert (conversation['last_message'], conversation['unread_count']) == ('hello', 1)
+    assert chat_app.get_dashboard(str(alice))['conversations'][0]['last_message'] == 'hello'
+
+    client.post('/api/mark_read', json={'conversation_id': conversation_id})
+    assert chat_app.get_dashboard(str(bob))['unread_total'] == 0
+
+def test_invalidations_from_other_workers_drop_local_entries(db):
+    alice, _, conversation_id = setup_chat(db)
+    assert chat_app.get_dashboard(str(alice))['conversations'][0]['last_message'] == ''
+    db['conversations'].update_one({}, {'$set': {'last_message': 'from elsewhere'}})
+
+    chat_app.deliver_remote({'topic': None, 'kind': 'invalidate', 'users': [str(alice)]})
+
+    assert chat_app.get_dashboard(str(alice))['conversations'][0]['last_message'] == 'from elsewhere'
+
+def test_concurrent_misses_compute_once():
+    cache = VersionedCache()
+    calls = []
+    release = threading.Event()
+
+    def compute():
+        calls.append(1)
+        release.wait(2)
+        return 'dashboard'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute('u1', 'home', compute)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1 and results == ['dashboard'] * 8
+    assert cache.stats()['coalesced'] == 7
+
+def test_bump_makes_entries_miss_and_drops_stale_computations():
+    cache = VersionedCache()
+    assert cache.get_or_compute('u1', 'home', lambda: 'v0') == 'v0'
+    assert cache.get_or_compute('u1', 'home', lambda: 'unused') == 'v0'
+
+    def compute_racing_a_write():
+        cache.bump(['u1'])
+        return 'stale'
+
+    cache.bump(['u1'])
+    assert cache.get_or_compute('u1', 'home', compute_racing_a_write) == 'stale'
+    assert cache.get_or_compute('u1', 'home', lambda: 'fresh') == 'fresh'
+    assert cache.get_or_compute('u1', 'home', lambda: 'unused') == 'fresh'
+
+def test_entries_are_evicted_by_size():
+    cache = VersionedCache(max_bytes=100, sizer=len)
+    cache.get_or_compute('u1', 'home', lambda: 'a' * 40)
+    cache.get_or_compute('u2', 'home', lambda: 'b' * 40)
+    cache.get_or_compute('u1', 'home', lambda: 'unused')
+    cache.get_or_compute('u3', 'home', lambda: 'c' * 40)
+    cache.get_or_compute('u4', 'home', lambda: 'd' * 200)
+
+    stats = cache.stats()
+    assert (stats['size'], stats['bytes'], stats['evictions']) == (2, 80, 1)
+    assert cache.get_or_compute('u1', 'home', lambda: 'recomputed') == 'a' * 40
+    assert cache.get_or_compute('u2', 'home', lambda: 'recomputed') == 'recomputed'
+
+def test_per_user_versions_are_dropped_with_their_last_entry():
+    cache = VersionedCache(max_bytes=100, sizer=len)
+    for i in range(50):
+        cache.get_or_compute(f'u{i}', 'home', lambda: 'x' * 40)
+        cache.bump([f'u{i}', f'reader{i}'])
+
+    assert cache.stats()['users'] == len(cache) == 2
+    cache.bump(['u49'])
+    assert cache.get_or_compute('u49', 'home', lambda: 'fresh') == 'fresh'
+
+def test_shared_store_serves_other_workers():
+    db = mongomock.MongoClient()['chat_app']
+    first, second = (VersionedCache(store=MongoCacheStore(db['cache_versions'], db['dashboard_cache']))
+                     for _ in range(2))
+    assert first.get_or_compute('u1', 'home', lambda: {'unread_total': 1}) == {'unread_total': 1}
+    assert second.get_or_compute('u1', 'home', lambda: 'unused') == {'unread_total': 1}
+
+    first.bump(['u1'])
+    second.invalidate(['u1'])
+
+    assert second.get_or_compute('u1', 'home', lambda: {'unread_total': 0}) == {'unread_total': 0}
+    assert first.get_or_compute('u1', 'home', lambda: 'unused') == {'unread_total': 0}
+    assert db['cache_versions'].find_one({'_id': 'u1'})['version'] == 1
@@ -0,0 +1,58 @@
+"""
+Tests for serving uploaded files.
+"""
+
+import hashlib
+
+
+def store(upload_folder, folder, name, content):
+    (upload_folder / folder / name).write_bytes(content)
+
+def test_content_addressed_file_gets_hash_etag_and_immutable_caching(client, upload_folder):
+    content = b'\x89PNG image bytes'
+    name = f"{hashlib.sha256(content).hexdigest()}.png"
+    store(upload_folder, 'images', name, content)
+
+    response = client.get(f'/uploads/{name}')
+
+    assert response.status_code == 200
+    assert response.get_data() == content
+    assert response.headers['ETag'] == f'"{name[:64]}"'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert 'max-age=31536000' in response.headers['Cache-Control']
+
+def test_if_none_match_returns_not_modified(client, upload_folder):
+    content = b'ID3 audio bytes'
+    name = f"{hashlib.sha256(content).hexdigest()}.mp3"
+    store(upload_folder, 'audio', name, content)
+    etag = client.get(f'/uploads/{name}').headers['ETag']
+
+    response = client.get(f'/uploads/{name}', headers={'If-None-Match': etag})
+
+    assert response.status_code == 304
+    assert response.get_data() == b''
+
+def test_if_modified_since_returns_not_modified(client, upload_folder):
+    store(upload_folder, 'videos', 'legacy.mp4', b'video')
+    last_modified = client.get('/uploads/legacy.mp4').headers['Last-Modified']
+
+    response = client.get('/uploads/legacy.mp4', headers={'If-Modified-Since': last_modified})
+
+    assert response.status_code == 304
+
+def test_range_request_returns_partial_content(client, upload_folder):
+    store(upload_folder, 'videos', 'clip.mp4', b'0123456789')
+
+    response = client.get('/uploads/clip.mp4', headers={'Range': 'bytes=2-5'})
+
+    assert response.status_code == 206
+    assert response.get_data() == b'2345'
+    assert response.headers['Content-Range'] == 'bytes 2-5/10'
+
+def test_folder_comes_from_extension_and_missing_files_are_404(client, upload_folder):
+    store(upload_folder, 'documents', 'notes.txt', b'notes')
+
+    assert client.get('/uploads/notes.txt').status_code == 200
+    assert client.get('/uploads/documents/notes.txt').status_code == 200
+    assert client.get('/uploads/missing.png').status_code == 404
+    assert client.get('/uploads/../app.py').status_code == 404
@@ -0,0 +1,236 @@
+"""
+Tests for the WebSocket protocol layer and the real-time gateway.
+"""
+
+import base64
+import json
+import os
+import socket
+import struct
+import threading
+
+from conftest import chat_app, login_as, make_conversation, make_user
+from gateway import ConnectionRegistry, GatewayConnection
+from websocket import OP_CLOSE, OP_PING, OP_PONG, OP_TEXT, WebSocket, accept_key
+
+HANDSHAKE_KEY = base64.b64encode(b'0123456789abcdef').decode()
+
+
+def client_frame(opcode, payload=b'', fin=True):
+    """A masked client-to-server frame"""
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    mask = os.urandom(4)
+    header = bytes([(0x80 if fin else 0) | opcode])
+    if len(payload) < 126:
+        header += bytes([0x80 | len(payload)])
+    else:
+        header += bytes([0x80 | 126]) + struct.pack('!H', len(payload))
+    return header + mask + bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+class RawClient:
+    """Reads unmasked server frames from a socket"""
+
+    def __init__(self, sock, buffer=b''):
+        self.sock = sock
+        self.sock.settimeout(5)
+        self.buffer = buffer
+
+    def read_exact(self, count):
+        while len(self.buffer) < count:
+            data = self.sock.recv(65536)
+            assert data, 'connection closed'
+            self.buffer += data
+        data, self.buffer = self.buffer[:count], self.buffer[count:]
+        return data
+
+    def read_frame(self):
+        first, second = self.read_exact(2)
+        length = second & 0x7F
+        if length == 126:
+            length = struct.unpack('!H', self.read_exact(2))[0]
+        elif length == 127:
+            length = struct.unpack('!Q', self.read_exact(8))[0]
+        return first & 0x0F, self.read_exact(length)
+
+class WsClient(RawClient):
+    """Opens /ws through the Flask test client on one end of a socket pair"""
+
+    def __init__(self, flask_client):
+        client_sock, server_sock = socket.socketpair()
+        headers = {
+            'Upgrade': 'websocket',
+            'Connection': 'Upgrade',
+            'Sec-WebSocket-Version': '13',
+            'Sec-WebSocket-Key': HANDSHAKE_KEY
+        }
+        self.thread = threading.Thread(target=self._serve, args=(flask_client, server_sock, headers), daemon=True)
+        self.thread.start()
+        super().__init__(client_sock)
+        head = b''
+        while b'\r\n\r\n' not in head:
+            head += self.sock.recv(1)
+        self.handshake = head.decode()
+
+    def _serve(self, flask_client, server_sock, headers):
+        try:
+            flask_client.get('/ws', headers=headers, environ_overrides={'werkzeug.socket': server_sock})
+        except ConnectionError:
+            pass
+
+    def send(self, payload):
+        self.sock.sendall(client_frame(OP_TEXT, json.dumps(payload)))
+
+    def receive(self):
+        while True:
+            opcode, payload = self.read_frame()
+            if opcode == OP_TEXT:
+                return json.loads(payload)
+
+    def close(self):
+        self.sock.sendall(client_frame(OP_CLOSE, struct.pack('!H', 1000)))
+        self.thread.join(5)
+        self.sock.close()
+
+def setup_chat(db):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    return alice, bob, str(make_conversation(db, alice, bob))
+
+def connect(user_id, name, email, conversation_id=None):
+    flask_client = chat_app.app.test_client()
+    login_as(flask_client, user_id, name, email)
+    ws = WsClient(flask_client)
+    if conversation_id:
+        ws.send({'type': 'subscribe', 'conversation_id': conversation_id})
+        assert ws.receive()['type'] == 'subscribed'
+    return ws
+
+def test_accept_key_matches_the_rfc_example():
+    assert accept_key('dGhlIHNhbXBsZSBub25jZQ==') == 's3pPLMBiTxaQ9kYGzzhZRbK+xOo='
+
+def test_fragments_are_reassembled_and_pings_answered():
+    server_sock, client_sock = socket.socketpair()
+    ws, client = WebSocket(server_sock), RawClient(client_sock)
+
+    client_sock.sendall(client_frame(OP_TEXT, 'hel', fin=False) + client_frame(OP_PING, b'hb')
+                        + client_frame(0x0, 'lo'))
+
+    assert ws.receive(timeout=1) == 'hello'
+    assert client.read_frame() == (OP_PONG, b'hb')
+
+def test_receive_timeout_keeps_partial_frames():
+    server_sock, client_sock = socket.socketpair()
+    ws = WebSocket(server_sock)
+    frame = client_frame(OP_TEXT, 'x' * 300)
+
+    client_sock.sendall(frame[:100])
+    assert ws.receive(timeout=0.05) is None
+    client_sock.sendall(frame[100:])
+
+    assert ws.receive(timeout=1) == 'x' * 300
+
+def test_handshake_requires_a_session(client):
+    response = client.get('/ws', headers={'Upgrade': 'websocket', 'Connection': 'Upgrade'})
+    assert response.status_code == 401
+
+def test_cross_origin_handshake_is_rejected(db, client):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    login_as(client, alice, 'Alice', 'alice@example.com')
+
+    response = client.get('/ws', headers={
+        'Upgrade': 'websocket', 'Connection': 'Upgrade', 'Origin': 'https://evil.example'
+    })
+
+    assert response.status_code == 403
+
+def test_messages_typing_and_acks_flow_between_participants(db):
+    alice, bob, conversation_id = setup_chat(db)
+    alice_ws = connect(alice, 'Alice', 'alice@example.com', conversation_id)
+    bob_ws = connect(bob, 'Bob', 'bob@example.com', conversation_id)
+    assert accept_key(HANDSHAKE_KEY) in alice_ws.handshake
+    try:
+        alice_ws.send({'type': 'typing', 'conversation_id': conversation_id, 'typing': True})
+        typing = bob_ws.receive()
+        assert typing['type'] == 'typing' and typing['user']['name'] == 'Alice'
+
+        alice_ws.send({'type': 'message', 'conversation_id': conversation_id, 'content': 'hi bob', 'ref': 7})
+        sent = alice_ws.receive()
+        assert sent['type'] == 'sent' and sent['ref'] == 7
+        delivered = bob_ws.receive()
+        assert delivered['type'] == 'message'
+        assert delivered['data']['id'] == sent['message']['id']
+        assert db['messages'].find_one()['content'] == 'hi bob'
+
+        bob_ws.send({'type': 'ack', 'conversation_id': conversation_id,
+                     'message_id': sent['message']['id'], 'read': True})
+        receipt = alice_ws.receive()
+        assert receipt == {'type': 'delivered', 'conversation_id': conversation_id,
+                           'message_id': sent['message']['id'], 'user_id': str(bob)}
+        assert db['conversations'].find_one()['unread_count'][str(bob)] == 0
+    finally:
+        alice_ws.close()
+        bob_ws.close()
+    assert chat_app.gateway.registry.stats()['connections'] == 0
+
+def test_http_sends_reach_websocket_subscribers(db, client):
+    alice, bob, conversation_id = setup_chat(db)
+    bob_ws = connect(bob, 'Bob', 'bob@example.com', conversation_id)
+    try:
+        login_as(client, alice, 'Alice', 'alice@example.com')
+        client.post('/api/send_message', json={'conversation_id': conversation_id, 'content': 'over http'})
+
+        event = bob_ws.receive()
+        assert event['type'] == 'message' and event['data']['content'] == 'over http'
+
+        # Resuming from an event id this process never issued asks for a resync
+        bob_ws.send({'type': 'subscribe', 'conversation_id': conversation_id, 'last_event_id': 'stale:1'})
+        assert bob_ws.receive() == {'type': 'resync', 'conversation_id': conversation_id}
+    finally:
+        bob_ws.close()
+
+def test_non_participants_cannot_subscribe_or_send(db):
+    _, _, conversation_id = setup_chat(db)
+    eve = make_user(db, 'Eve', 'eve@example.com')
+    eve_ws = connect(eve, 'Eve', 'eve@example.com')
+    try:
+        eve_ws.send({'type': 'subscribe', 'conversation_id': conversation_id})
+        assert eve_ws.receive() == {'type': 'error', 'error': 'Access denied'}
+        eve_ws.send({'type': 'message', 'conversation_id': conversation_id, 'content': 'hi'})
+        assert eve_ws.receive() == {'type': 'error', 'error': 'Access denied'}
+        eve_ws.send({'type': 'typing', 'conversation_id': conversation_id})
+        assert eve_ws.receive() == {'type': 'error', 'error': 'Not subscribed'}
+    finally:
+        eve_ws.close()
+    assert db['messages'].count_documents({}) == 0
+
+class FakeWebSocket:
+    def __init__(self):
+        self.closed_with = None
+
+    def close(self, code, reason='', timeout=1.0):
+        self.closed_with = code
+
+def test_slow_consumers_drop_ephemeral_events_then_disconnect():
+    registry = ConnectionRegistry()
+    ws = FakeWebSocket()
+    connection = GatewayConnection(ws, 'u1', 'Alice', max_queue=2)  # writer not started
+    registry.add(connection)
+    registry.join(connection, 'c1')
+
+    assert registry.broadcast('c1', {'type': 'message'}) == 1
+    assert registry.broadcast('c1', {'type': 'message'}) == 1
+    assert registry.broadcast('c1', {'type': 'typing'}, droppable=True) == 0
+    assert connection.dropped == 1 and ws.closed_with is None
+
+    assert registry.broadcast('c1', {'type': 'message'}) == 0
+    assert ws.closed_with == 1013
+
+def test_heartbeat_pings_idle_connections(db, monkeypatch):
+    alice, _, _ = setup_chat(db)
+    monkeypatch.setattr(chat_app.gateway, 'heartbeat_seconds', 0.05)
+    ws = connect(alice, 'Alice', 'alice@example.com')
+    try:
+        assert ws.read_frame() == (OP_PING, b'')
+    finally:
+        ws.close()
@@ -0,0 +1,76 @@
+"""
+Tests for group-committed message writes.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from bson import ObjectId
+
+from conftest import chat_app, login_as, make_conversation, make_user
+from group_commit import GroupCommitWriter
+
+
+@pytest.fixture
+def writer(db, command_counter, monkeypatch):
+    writer = GroupCommitWriter(chat_app.messages, chat_app.conversations, window_ms=50, max_batch=8)
+    monkeypatch.setattr(chat_app, 'message_writer', writer)
+    return writer
+
+def message_doc(conversation_id, content, timestamp):
+    return {
+        'conversation_id': conversation_id,
+        'sender_id': ObjectId(),
+        'content': content,
+        'timestamp': timestamp,
+        'message_type': 'text'
+    }
+
+def test_concurrent_sends_share_one_flush(db, writer, command_counter):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    conversation_id = make_conversation(db, alice, bob)
+    start = datetime.now(timezone.utc)
+    command_counter.reset()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        ids = list(pool.map(
+            lambda i: writer.submit(message_doc(conversation_id, f'Message {i}', start + timedelta(seconds=i)), f'Message {i}'),
+            range(8)
+        ))
+
+    assert len(set(ids)) == 8
+    assert db['messages'].count_documents({}) == 8
+    assert writer.flushes == 1
+    assert command_counter.calls == [('messages', 'insert_many'), ('conversations', 'bulk_write')]
+    assert db['conversations'].find_one({'_id': conversation_id})['last_message'] == 'Message 7'
+
+def test_failed_insert_is_reported_to_its_caller_only(db, writer):
+    conversation_id = ObjectId()
+    now = datetime.now(timezone.utc)
+    existing = db['messages'].insert_one(message_doc(conversation_id, 'old', now)).inserted_id
+    duplicate = message_doc(conversation_id, 'dup', now)
+    duplicate['_id'] = existing
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        ok = pool.submit(writer.submit, message_doc(conversation_id, 'new', now), 'new')
+        failed = pool.submit(writer.submit, duplicate, 'dup')
+
+    assert ok.result() is not None
+    with pytest.raises(Exception):
+        failed.result()
+
+def test_send_message_route_uses_the_writer(db, client, writer):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    conversation_id = str(make_conversation(db, alice, bob))
+    login_as(client, alice, 'Alice', 'alice@example.com')
+
+    response = client.post('/api/send_message', json={'conversation_id': conversation_id, 'content': 'hello'})
+
+    assert response.get_json()['success']
+    assert writer.flushes == 1
+    conversation = db['conversations'].find_one()
+    assert conversation['last_message'] == 'hello'
+    assert conversation['unread_count'][str(bob)] == 1
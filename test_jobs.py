@@ -0,0 +1,120 @@
+"""
+Tests for the background job queue and post-upload processing.
+"""
+
+from datetime import datetime, timedelta, timezone
+import io
+
+import pytest
+
+from conftest import chat_app, login_as, make_conversation, make_user
+from jobs import JobQueue
+
+Image = pytest.importorskip('PIL.Image')
+
+
+@pytest.fixture
+def queue(db):
+    return JobQueue(db['test_jobs'], workers=0, backoff_max=0)
+
+def test_failed_job_is_retried_until_it_succeeds(queue):
+    calls = []
+
+    @queue.handler('flaky')
+    def flaky(value):
+        calls.append(value)
+        if len(calls) < 3:
+            raise RuntimeError('not yet')
+        return value * 2
+
+    job_id = queue.enqueue('flaky', {'value': 21})
+    while queue.run_pending():
+        pass
+
+    job = queue.get(job_id)
+    assert job['status'] == 'succeeded'
+    assert job['attempts'] == 3
+    assert job['result'] == 42
+    assert job['error'] is None
+
+def test_retries_are_delayed_with_backoff(db):
+    queue = JobQueue(db['test_jobs'], workers=0, backoff_base=2.0)
+
+    @queue.handler('broken')
+    def broken():
+        raise RuntimeError('boom')
+
+    job_id = queue.enqueue('broken', {})
+    queue.run_pending()
+    queue.run_pending()
+
+    job = queue.get(job_id)
+    assert job['status'] == 'queued'
+    assert job['attempts'] == 1
+    assert job['run_at'] > datetime.now(timezone.utc).replace(tzinfo=None)
+
+def test_job_fails_after_max_attempts(queue):
+    @queue.handler('broken')
+    def broken():
+        raise RuntimeError('boom')
+
+    job_id = queue.enqueue('broken', {}, max_attempts=2)
+    while queue.run_pending():
+        pass
+
+    job = queue.get(job_id)
+    assert job['status'] == 'failed'
+    assert job['attempts'] == 2
+    assert 'boom' in job['error']
+
+def test_job_with_expired_lease_is_reclaimed(queue):
+    ran = []
+    queue.handler('work')(lambda: ran.append(True))
+    job_id = queue.enqueue('work', {})
+    # Simulate a worker that claimed the job and then died
+    queue.collection.update_one({'_id': job_id}, {'$set': {
+        'status': 'running',
+        'attempts': 1,
+        'locked_at': datetime.now(timezone.utc) - timedelta(seconds=queue.lease_seconds + 1)
+    }})
+
+    assert queue.run_pending() == 1
+    assert ran == [True]
+    assert queue.get(job_id)['status'] == 'succeeded'
+
+def test_upload_returns_job_that_processes_media(db, client, upload_folder):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    conversation_id = str(make_conversation(db, alice, bob))
+    login_as(client, alice, 'Alice', 'alice@example.com')
+    buffer = io.BytesIO()
+    Image.new('RGB', (640, 480), (10, 20, 30)).save(buffer, 'PNG')
+
+    data = client.post('/api/upload_file', data={
+        'conversation_id': conversation_id,
+        'file': (io.BytesIO(buffer.getvalue()), 'photo.png')
+    }, content_type='multipart/form-data').get_json()
+
+    job = client.get(f"/api/jobs/{data['job_id']}").get_json()['job']
+    assert job['status'] == 'queued'
+
+    chat_app.job_queue.run_pending()
+
+    job = client.get(f"/api/jobs/{data['job_id']}").get_json()['job']
+    assert job['status'] == 'succeeded'
+    assert job['result']['thumbnail_path'] == data['message']['thumbnail_path']
+    assert job['result']['media_info'] == {'mime_type': 'image/png', 'width': 640, 'height': 480}
+    assert (upload_folder / data['message']['thumbnail_path']).exists()
+    assert db['messages'].find_one()['media_info']['width'] == 640
+
+def test_job_status_is_private_to_its_owner(db, client, upload_folder):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    job_id = chat_app.job_queue.enqueue('process_upload', {
+        'message_id': '0' * 24, 'file_path': 'images/missing.png'
+    }, owner_id=str(alice))
+
+    login_as(client, bob, 'Bob', 'bob@example.com')
+
+    assert client.get(f"/api/jobs/{job_id}").status_code == 404
+    assert client.get('/api/jobs/not-an-id').status_code == 404
@@ -0,0 +1,70 @@
+"""
+Tests for structured logging.
+"""
+
+import io
+import json
+import logging
+import queue
+
+from conftest import chat_app, login_as, make_user
+from structured_logging import (
+    DroppingQueueHandler, JsonFormatter, SamplingFilter, configure_logging, parse_levels
+)
+
+
+def make_record(level=logging.INFO, msg='hello %s', args=('world',), **extra):
+    record = logging.LogRecord('chatflow.test', level, __file__, 1, msg, args, None)
+    for key, value in extra.items():
+        setattr(record, key, value)
+    return record
+
+def test_json_formatter_includes_extra_fields():
+    entry = json.loads(JsonFormatter().format(make_record(conversation_id='abc')))
+
+    assert entry['msg'] == 'hello world'
+    assert entry['level'] == 'INFO'
+    assert entry['logger'] == 'chatflow.test'
+    assert entry['conversation_id'] == 'abc'
+
+def test_sampling_filter_only_thins_configured_levels():
+    draws = iter([0.5, 0.005])
+    sampler = SamplingFilter({'DEBUG': 0.01}, rng=lambda: next(draws))
+
+    assert sampler.filter(make_record(logging.INFO))
+    assert not sampler.filter(make_record(logging.DEBUG))
+    assert sampler.filter(make_record(logging.DEBUG))
+    assert sampler.filter(make_record(logging.DEBUG, sample_rate=1.0))
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = DroppingQueueHandler(queue.Queue(maxsize=1))
+
+    handler.handle(make_record())
+    handler.handle(make_record())
+
+    assert handler.dropped == 1
+
+def test_records_are_written_by_the_listener_with_request_context():
+    stream = io.StringIO()
+    handler, listener = configure_logging(
+        'chatflow_test', stream=stream, levels=parse_levels('chatflow_test.quiet=ERROR'),
+        context=lambda: {'path': '/api/example'}
+    )
+    logging.getLogger('chatflow_test.app').info('sent', extra={'count': 2})
+    logging.getLogger('chatflow_test.quiet').warning('suppressed')
+    listener.stop()
+
+    entries = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert entries == [dict(entries[0], msg='sent', count=2, path='/api/example')]
+
+def test_app_errors_are_logged_with_the_request(db, client, monkeypatch):
+    records = []
+    monkeypatch.setattr(chat_app.log_handler, 'enqueue', records.append)
+    login_as(client, make_user(db, 'Alice', 'alice@example.com'), 'Alice', 'alice@example.com')
+
+    client.post('/api/send_message', json={'conversation_id': 'not-an-id', 'content': 'hi'})
+
+    error = next(record for record in records if record.levelno == logging.ERROR)
+    assert error.msg == 'Error sending message'
+    assert error.path == '/api/send_message'
+    assert 'Traceback' in error.exc_text
@@ -0,0 +1,63 @@
+"""
+Tests for the conversation membership cache.
+"""
+
+from cache import TTLCache
+from conftest import chat_app, login_as, make_conversation, make_user
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.stats()['evictions'] == 1
+
+def test_ttl_cache_entries_expire():
+    now = [0.0]
+    cache = TTLCache(ttl=10, clock=lambda: now[0])
+    cache.set('a', True)
+    now[0] = 9.9
+    assert cache.get('a') is True
+    now[0] = 10.0
+    assert cache.get('a') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_repeat_sends_skip_the_membership_query(db, client, command_counter):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    conversation_id = str(make_conversation(db, alice, bob))
+    login_as(client, alice, 'Alice', 'alice@example.com')
+
+    client.post('/api/send_message', json={'conversation_id': conversation_id, 'content': 'one'})
+    command_counter.reset()
+    response = client.post('/api/send_message', json={'conversation_id': conversation_id, 'content': 'two'})
+
+    assert response.status_code == 200
+    assert ('conversations', 'find_one') not in command_counter.calls
+    assert chat_app.membership_cache.stats()['hits'] >= 1
+
+def test_non_members_are_denied_and_the_answer_is_cached(db, client):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    eve = make_user(db, 'Eve', 'eve@example.com')
+    conversation_id = str(make_conversation(db, alice, bob))
+    login_as(client, eve, 'Eve', 'eve@example.com')
+
+    for _ in range(2):
+        assert client.get(f'/api/get_messages/{conversation_id}').status_code == 403
+    assert chat_app.membership_cache.get((str(eve), conversation_id)) is False
+
+def test_invalidate_membership_drops_cached_denials(db, client):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    conversation_id = str(make_conversation(db, alice, bob))
+    chat_app.membership_cache.set((str(alice), conversation_id), False)
+
+    chat_app.invalidate_membership(conversation_id, [alice, bob])
+
+    assert chat_app.is_participant(alice, conversation_id)
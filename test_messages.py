@@ -0,0 +1,125 @@
+"""
+Tests for the message read path.
+"""
+
+from datetime import datetime, timezone
+
+from conftest import chat_app, login_as, make_conversation, make_messages, make_user
+
+
+def test_get_conversation_messages_uses_constant_queries(db, command_counter):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    conversation_id = make_conversation(db, alice, bob)
+    make_messages(db, conversation_id, [alice, bob], 30)
+
+    command_counter.reset()
+    result, _ = chat_app.get_conversation_messages(str(conversation_id))
+
+    assert len(result) == 30
+    # One query for the messages and one batched sender lookup
+    assert command_counter.count == 2
+    assert {msg['sender']['name'] for msg in result} == {'Alice', 'Bob'}
+
+def test_get_conversation_messages_skips_unknown_senders(db):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    conversation_id = make_conversation(db, alice, bob)
+    make_messages(db, conversation_id, [alice, bob], 4)
+    db['users'].delete_one({'_id': bob})
+
+    result, _ = chat_app.get_conversation_messages(str(conversation_id))
+
+    assert [msg['sender']['id'] for msg in result] == [str(alice), str(alice)]
+
+def test_get_conversation_media_uses_constant_queries(db, command_counter):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    conversation_id = make_conversation(db, alice, bob)
+    for sender in (alice, bob, alice):
+        db['messages'].insert_one({
+            'conversation_id': conversation_id,
+            'sender_id': sender,
+            'content': 'Shared photo.png',
+            'timestamp': datetime.now(timezone.utc),
+            'message_type': 'image',
+            'file_name': 'photo.png',
+            'original_name': 'photo.png',
+            'file_size': 10,
+            'file_path': 'images/photo.png'
+        })
+
+    command_counter.reset()
+    result = chat_app.get_conversation_media(str(conversation_id))
+
+    assert len(result) == 3
+    assert command_counter.count == 2
+
+def test_get_conversation_messages_returns_newest_page_first(db):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    conversation_id = make_conversation(db, alice, bob)
+    make_messages(db, conversation_id, [alice, bob], 12)
+
+    page, next_cursor = chat_app.get_conversation_messages(str(conversation_id), limit=5)
+
+    assert [msg['content'] for msg in page] == [f'Message {i}' for i in range(7, 12)]
+    assert next_cursor == page[0]['cursor']
+
+def test_get_messages_pages_backwards_through_history(db, client):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    conversation_id = make_conversation(db, alice, bob)
+    make_messages(db, conversation_id, [alice, bob], 12)
+    login_as(client, alice, 'Alice', 'alice@example.com')
+
+    seen = []
+    params = {'limit': 5}
+    while True:
+        data = client.get(f'/api/get_messages/{conversation_id}', query_string=params).get_json()
+        assert data['success']
+        seen = [msg['content'] for msg in data['messages']] + seen
+        if not data['has_more']:
+            break
+        params = {'limit': 5, 'before': data['next_cursor']}
+
+    assert seen == [f'Message {i}' for i in range(12)]
+    assert data['next_cursor'] is None
+
+def test_get_messages_after_cursor_returns_only_newer(db, client):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    conversation_id = make_conversation(db, alice, bob)
+    make_messages(db, conversation_id, [alice, bob], 6)
+    login_as(client, alice, 'Alice', 'alice@example.com')
+
+    first = client.get(f'/api/get_messages/{conversation_id}', query_string={'limit': 6}).get_json()
+    cursor = first['messages'][2]['cursor']
+    data = client.get(f'/api/get_messages/{conversation_id}', query_string={'after': cursor}).get_json()
+
+    assert [msg['content'] for msg in data['messages']] == ['Message 3', 'Message 4', 'Message 5']
+    assert data['has_more'] is False
+
+def test_get_messages_rejects_malformed_cursor(db, client):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    conversation_id = make_conversation(db, alice, bob)
+    login_as(client, alice, 'Alice', 'alice@example.com')
+
+    response = client.get(f'/api/get_messages/{conversation_id}', query_string={'before': 'garbage'})
+
+    assert response.status_code == 400
+
+def test_chat_page_renders_newest_page_with_older_cursor(db, client):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    conversation_id = make_conversation(db, alice, bob)
+    make_messages(db, conversation_id, [alice, bob], 8)
+    login_as(client, alice, 'Alice', 'alice@example.com')
+
+    response = client.get('/chat', query_string={'id': str(conversation_id), 'limit': 3})
+    body = response.get_data(as_text=True)
+
+    assert response.status_code == 200
+    assert 'Message 7' in body and 'Message 4' not in body
+    assert 'let olderCursor = "' in body
@@ -0,0 +1,85 @@
+"""
+Tests for request instrumentation and the /metrics endpoint.
+"""
+
+import io
+from types import SimpleNamespace
+
+from conftest import chat_app, login_as, make_conversation, make_user
+from metrics import Registry
+
+
+class EmittingCollection:
+    """Collection proxy that reports calls as MongoDB command events, like pymongo does"""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr) or name.startswith('_'):
+            return attr
+
+        def wrapper(*args, **kwargs):
+            chat_app.command_monitor.succeeded(SimpleNamespace(command_name=name, duration_micros=250))
+            return attr(*args, **kwargs)
+        return wrapper
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    latency = registry.histogram('test_seconds', 'Test latency', ['route'], buckets=(0.1, 1))
+    latency.observe(0.05, route='a')
+    latency.observe(0.5, route='a')
+
+    lines = registry.render().splitlines()
+
+    assert 'test_seconds_bucket{route="a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{route="a",le="1"} 2' in lines
+    assert 'test_seconds_bucket{route="a",le="+Inf"} 2' in lines
+    assert 'test_seconds_count{route="a"} 2' in lines
+
+def test_requests_are_timed_per_endpoint(db, client):
+    login_as(client, make_user(db, 'Alice', 'alice@example.com'), 'Alice', 'alice@example.com')
+    client.get('/api/unread_total')
+
+    body = client.get('/metrics').get_data(as_text=True)
+
+    assert 'chatflow_requests_total{endpoint="unread_total",method="GET",status="200"}' in body
+    assert 'chatflow_request_duration_seconds_count{endpoint="unread_total",method="GET"}' in body
+    assert 'chatflow_mongo_pool_connections{state="open"}' in body
+
+def test_commands_are_attributed_to_the_request(db, client, monkeypatch):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    conversation_id = str(make_conversation(db, alice, bob))
+    login_as(client, alice, 'Alice', 'alice@example.com')
+    monkeypatch.setattr(chat_app, 'messages', EmittingCollection(chat_app.messages))
+    monkeypatch.setattr(chat_app, 'users', EmittingCollection(chat_app.users))
+    monkeypatch.setattr(chat_app, 'QUERY_COUNT_WARNING', 0)
+    before = chat_app.QUERY_COUNT_WARNINGS.value(endpoint='get_messages')
+
+    client.get(f'/api/get_messages/{conversation_id}')
+
+    assert chat_app.QUERY_COUNT_WARNINGS.value(endpoint='get_messages') == before + 1
+    assert 'chatflow_mongo_commands_total{command="find",outcome="success"}' in chat_app.metrics_registry.render()
+
+def test_uploaded_file_bytes_are_counted(db, client, upload_folder):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    conversation_id = str(make_conversation(db, alice, bob))
+    login_as(client, alice, 'Alice', 'alice@example.com')
+    message = client.post('/api/upload_file', data={
+        'conversation_id': conversation_id,
+        'file': (io.BytesIO(b'x' * 1000), 'notes.txt')
+    }, content_type='multipart/form-data').get_json()['message']
+    before = chat_app.UPLOAD_BYTES_SENT.value(status=200)
+
+    client.get(f"/uploads/{message['file_name']}")
+
+    assert chat_app.UPLOAD_BYTES_SENT.value(status=200) == before + 1000
+
+def test_metrics_token_is_enforced(client, monkeypatch):
+    monkeypatch.setattr(chat_app, 'METRICS_TOKEN', 'secret')
+
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer secret'}).status_code == 200
@@ -0,0 +1,50 @@
+"""
+Tests for the schema migrations.
+"""
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from conftest import make_user
+import migrations
+from migrations import MIGRATIONS, get_schema_version, run_migrations
+
+
+def test_run_migrations_creates_query_indexes(db):
+    run_migrations(db)
+
+    assert get_schema_version(db) == MIGRATIONS[-1][0]
+    assert db['users'].index_information()['email_1']['unique']
+    assert 'conversation_id_1_timestamp_1__id_1' in db['messages'].index_information()
+    assert 'participants_1_last_message_time_-1__id_-1' in db['conversations'].index_information()
+
+def test_run_migrations_is_idempotent(db):
+    run_migrations(db)
+    run_migrations(db)
+
+    assert db['schema_migrations'].count_documents({}) == len(MIGRATIONS)
+
+def test_unique_email_index_rejects_duplicate_users(db):
+    run_migrations(db)
+    make_user(db, 'Alice', 'alice@example.com')
+
+    with pytest.raises(DuplicateKeyError):
+        make_user(db, 'Alice Again', 'alice@example.com')
+
+def test_versions_claimed_by_another_process_are_left_to_it(db):
+    db['schema_migrations'].insert_one({'_id': 3, 'version': 3, 'name': 'elsewhere', 'claimed_at': None})
+
+    assert run_migrations(db) == 2
+    assert get_schema_version(db) == 2
+    assert db['schema_migrations'].count_documents({}) == 3
+
+def test_failed_migration_releases_its_claim(db, monkeypatch):
+    def broken(db):
+        raise RuntimeError('boom')
+    monkeypatch.setattr(migrations, 'MIGRATIONS', MIGRATIONS[:1] + [(2, broken)])
+
+    with pytest.raises(RuntimeError):
+        run_migrations(db)
+
+    assert get_schema_version(db) == 1
+    assert db['schema_migrations'].find_one({'_id': 2}) is None
@@ -0,0 +1,150 @@
+"""
+Tests for bounded password hashing and login throttling.
+"""
+
+import time
+
+import bcrypt
+import pytest
+
+from conftest import chat_app
+from passwords import AttemptThrottle, HasherBusy, PasswordHasher
+
+
+@pytest.fixture
+def hasher(monkeypatch):
+    """Cheap work factor so tests do not spend seconds in bcrypt"""
+    hasher = PasswordHasher(rounds=4, workers=2, max_pending=4)
+    monkeypatch.setattr(chat_app, 'password_hasher', hasher)
+    return hasher
+
+def add_user(db, email, password, rounds=4):
+    db['users'].insert_one({
+        'name': 'Alice',
+        'email': email,
+        'password': bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=rounds)),
+        'is_active': True
+    })
+
+def login(client, email, password):
+    return client.post('/login', json={'email': email, 'password': password})
+
+def test_hasher_round_trip_and_cost_detection():
+    hasher = PasswordHasher(rounds=4, workers=1, max_pending=1)
+    hashed = hasher.hash('Secret123')
+
+    assert hasher.check('Secret123', hashed)
+    assert not hasher.check('wrong', hashed)
+    assert not hasher.needs_rehash(hashed)
+    assert PasswordHasher(rounds=5).needs_rehash(hashed)
+    assert not hasher.needs_rehash(b'not-a-real-hash')
+
+def test_hasher_rejects_work_beyond_the_queue_limit():
+    hasher = PasswordHasher(rounds=4, workers=1, max_pending=1)
+    hasher._slots.acquire()  # one hash already queued
+    with pytest.raises(HasherBusy):
+        hasher.hash('Secret123')
+
+    hasher._slots.release()
+    assert hasher.check('Secret123', hasher.hash('Secret123'))
+
+def test_hasher_timeout_is_reported_as_busy():
+    hasher = PasswordHasher(rounds=4, workers=1, max_pending=2, timeout=0.05)
+    hasher._executor.submit(time.sleep, 0.3)  # the only worker is occupied
+    with pytest.raises(HasherBusy):
+        hasher.hash('Secret123')
+
+def test_hash_timeout_returns_503(db, client, monkeypatch):
+    monkeypatch.setattr(chat_app, 'password_hasher', PasswordHasher(rounds=4, workers=1, max_pending=2, timeout=0.05))
+    add_user(db, 'alice@example.com', 'Secret123')
+    chat_app.password_hasher._executor.submit(time.sleep, 0.3)
+
+    response = login(client, 'alice@example.com', 'Secret123')
+
+    assert response.status_code == 503
+
+def test_throttle_prunes_expired_keys_and_caps_their_number():
+    now = [0.0]
+    throttle = AttemptThrottle(limit=2, window_seconds=60, max_keys=3, clock=lambda: now[0])
+    for key in ('a', 'b', 'c'):
+        throttle.record(key)
+    throttle.record('a')
+    throttle.record('d')  # evicts 'b', the key attempted least recently
+    assert len(throttle) == 3 and throttle.retry_after('a') == 60
+
+    now[0] = 61.0
+    throttle.record('e')
+    assert len(throttle) == 1
+
+def test_throttle_window_slides():
+    now = [0.0]
+    throttle = AttemptThrottle(limit=2, window_seconds=60, clock=lambda: now[0])
+    throttle.record('key')
+    throttle.record('key')
+    assert throttle.retry_after('key') == 60
+
+    now[0] = 30.0
+    assert throttle.retry_after('key') == 30
+    now[0] = 60.0
+    assert throttle.retry_after('key') == 0
+
+def test_login_rehashes_when_the_work_factor_changes(db, client, hasher):
+    add_user(db, 'alice@example.com', 'Secret123', rounds=5)
+
+    response = login(client, 'alice@example.com', 'Secret123')
+
+    assert response.get_json()['success'] is True
+    stored = db['users'].find_one()['password']
+    assert stored.startswith(b'$2b$04$')
+    assert hasher.check('Secret123', stored)
+
+def test_login_keeps_a_current_hash(db, client, hasher):
+    add_user(db, 'alice@example.com', 'Secret123')
+    before = db['users'].find_one()['password']
+
+    login(client, 'alice@example.com', 'Secret123')
+
+    assert db['users'].find_one()['password'] == before
+
+def test_failed_logins_throttle_the_account(db, client, hasher, monkeypatch):
+    monkeypatch.setattr(chat_app, 'login_account_throttle', AttemptThrottle(limit=2, window_seconds=60))
+    add_user(db, 'alice@example.com', 'Secret123')
+
+    assert login(client, 'alice@example.com', 'wrong').status_code == 401
+    assert login(client, 'alice@example.com', 'wrong').status_code == 401
+    response = login(client, 'alice@example.com', 'Secret123')
+
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) > 0
+
+def test_failed_logins_throttle_the_client_ip(db, client, hasher, monkeypatch):
+    monkeypatch.setattr(chat_app, 'login_ip_throttle', AttemptThrottle(limit=3, window_seconds=60))
+    add_user(db, 'alice@example.com', 'Secret123')
+
+    for i in range(3):
+        assert login(client, f'user{i}@example.com', 'guess').status_code == 401
+
+    assert login(client, 'alice@example.com', 'Secret123').status_code == 429
+
+def test_successful_login_clears_account_failures(db, client, hasher, monkeypatch):
+    monkeypatch.setattr(chat_app, 'login_account_throttle', AttemptThrottle(limit=2, window_seconds=60))
+    add_user(db, 'alice@example.com', 'Secret123')
+
+    login(client, 'alice@example.com', 'wrong')
+    assert login(client, 'alice@example.com', 'Secret123').status_code == 200
+
+    assert login(client, 'alice@example.com', 'wrong').status_code == 401
+
+def test_saturated_hasher_returns_503(db, client, monkeypatch):
+    monkeypatch.setattr(chat_app, 'password_hasher', PasswordHasher(rounds=4, workers=1, max_pending=0))
+    add_user(db, 'alice@example.com', 'Secret123')
+
+    response = login(client, 'alice@example.com', 'Secret123')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+    response = client.post('/register', json={
+        'name': 'Bob', 'email': 'bob@example.com', 'password': 'Secret123'
+    })
+    assert response.status_code == 503
+    assert db['users'].count_documents({'email': 'bob@example.com'}) == 0
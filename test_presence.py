@@ -0,0 +1,132 @@
+"""
+Tests for presence tracking, the bulk presence endpoint and batched fan-out.
+"""
+
+from datetime import datetime, timezone
+import json
+
+from conftest import chat_app, login_as, make_conversation, make_user
+from gateway import GatewayConnection
+from presence import PresenceTracker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class FakeWebSocket:
+    def close(self, code=1000, reason='', timeout=1.0):
+        pass
+
+def queued_events(connection):
+    """Decode the text frames waiting in a connection's outbound queue"""
+    return [json.loads(frame[2:] if frame[1] < 126 else frame[4:]) for frame in connection._queue]
+
+def test_status_follows_heartbeats_and_expiry():
+    clock = FakeClock()
+    tracker = PresenceTracker(away_after=300, offline_after=75, clock=clock, wall_clock=clock)
+
+    tracker.heartbeat('u1')
+    assert tracker.status('u1') == 'online'
+    tracker.heartbeat('u1', idle=True)
+    assert tracker.status('u1') == 'away'
+    clock.now += 76
+    assert tracker.status('u1') == 'offline'
+    assert tracker.status('nobody') == 'offline'
+
+def test_collect_coalesces_changes_between_flushes():
+    clock = FakeClock()
+    tracker = PresenceTracker(clock=clock, wall_clock=clock)
+    tracker.heartbeat('u1')
+    tracker.heartbeat('u2')
+    assert tracker.collect() == ({'u1': 'online', 'u2': 'online'}, {})
+
+    # A quick reconnect is not a change
+    tracker.disconnect('u1')
+    tracker.heartbeat('u1')
+    tracker.heartbeat('u2', idle=True)
+    tracker.heartbeat('u2')
+    assert tracker.collect() == ({}, {})
+
+    clock.now += 100
+    changes, departed = tracker.collect()
+    assert changes == {'u1': 'offline', 'u2': 'offline'}
+    assert set(departed) == {'u1', 'u2'}
+    assert tracker.size() == 0
+
+def test_bulk_endpoint_answers_for_partners_only(db, client):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    carol = make_user(db, 'Carol', 'carol@example.com')
+    stranger = make_user(db, 'Eve', 'eve@example.com')
+    make_conversation(db, alice, bob)
+    make_conversation(db, alice, carol)
+    seen = datetime(2026, 1, 2, tzinfo=timezone.utc)
+    db['users'].update_one({'_id': carol}, {'$set': {'last_seen': seen}})
+    chat_app.presence.heartbeat(str(bob))
+    chat_app.presence.heartbeat(str(stranger))
+    login_as(client, alice, 'Alice', 'alice@example.com')
+
+    response = client.get('/api/presence', query_string={'ids': f'{bob},{carol},{stranger}'})
+
+    presence = response.get_json()['presence']
+    assert set(presence) == {str(bob), str(carol)}
+    assert presence[str(bob)]['status'] == 'online'
+    assert presence[str(carol)] == {'status': 'offline', 'last_seen': seen.isoformat()}
+
+def test_bulk_endpoint_validates_ids(db, client):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    login_as(client, alice, 'Alice', 'alice@example.com')
+
+    assert client.get('/api/presence').status_code == 400
+    assert client.get('/api/presence?ids=nope').status_code == 400
+    too_many = ','.join(f'{i:024x}' for i in range(chat_app.PRESENCE_MAX_IDS + 1))
+    assert client.get('/api/presence', query_string={'ids': too_many}).status_code == 400
+
+def test_http_heartbeat(db, client):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    login_as(client, alice, 'Alice', 'alice@example.com')
+
+    response = client.post('/api/presence/heartbeat', json={'idle': True})
+
+    assert response.get_json() == {'success': True, 'status': 'away'}
+
+def test_changes_are_fanned_out_in_one_frame_per_recipient(db):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    carol = make_user(db, 'Carol', 'carol@example.com')
+    stranger = make_user(db, 'Eve', 'eve@example.com')
+    make_conversation(db, alice, bob)
+    make_conversation(db, alice, carol)
+    registry = chat_app.gateway.registry
+    watcher = GatewayConnection(FakeWebSocket(), alice, 'Alice')  # writer not started, so frames stay queued
+    registry.add(watcher)
+    try:
+        for user_id in (bob, carol, stranger):
+            chat_app.presence.heartbeat(str(user_id))
+        recipients = chat_app.flush_presence(*chat_app.presence.collect())
+
+        assert recipients == 1
+        assert queued_events(watcher) == [
+            {'type': 'presence', 'users': {str(bob): 'online', str(carol): 'online'}}
+        ]
+
+        # Going offline is persisted in one bulk write at the next flush
+        chat_app.presence.disconnect(str(bob))
+        chat_app.flush_presence(*chat_app.presence.collect())
+        assert queued_events(watcher)[-1] == {'type': 'presence', 'users': {str(bob): 'offline'}}
+        assert db['users'].find_one({'_id': bob})['last_seen'] is not None
+    finally:
+        registry.remove(watcher)
+
+def test_closing_the_last_connection_marks_the_user_offline(db):
+    connection = GatewayConnection(FakeWebSocket(), 'u1', 'Alice')
+    chat_app.connection_opened(connection)
+    assert chat_app.presence.status('u1') == 'online'
+
+    chat_app.connection_closed(connection)
+
+    assert chat_app.presence.status('u1') == 'offline'
@@ -0,0 +1,121 @@
+"""
+Tests for the cross-worker pub/sub backends and how the app uses them.
+"""
+
+import queue
+import time
+
+import mongomock
+import pytest
+
+from conftest import chat_app, login_as, make_conversation, make_user
+from pubsub import MongoBackend, UnixSocketBackend, create_backend
+
+
+class RecordingBackend:
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, message):
+        self.messages.append(message)
+
+def unix_pair(tmp_path):
+    """Two unix backends on one socket; the first runs the hub"""
+    path = str(tmp_path / 'pubsub.sock')
+    received = (queue.Queue(), queue.Queue())
+    backends = [UnixSocketBackend(path, reconnect_delay=0.05) for _ in received]
+    for backend, inbox in zip(backends, received):
+        backend.start(inbox.put)
+    hub = backends[0].hub
+    assert hub is not None and backends[1].hub is None
+    return backends, received
+
+def wait_until(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+def test_unix_backend_relays_to_other_workers_only(tmp_path):
+    (first, second), (first_inbox, second_inbox) = unix_pair(tmp_path)
+    try:
+        wait_until(lambda: first.hub.client_count() == 2)
+        first.publish({'topic': 'c1', 'kind': 'event', 'type': 'message', 'data': {'id': 1}})
+        second.publish({'topic': 'c1', 'kind': 'frame', 'payload': {'type': 'typing'}})
+
+        assert second_inbox.get(timeout=2) == {'topic': 'c1', 'kind': 'event', 'type': 'message', 'data': {'id': 1}}
+        assert first_inbox.get(timeout=2)['payload'] == {'type': 'typing'}
+        assert first_inbox.empty() and second_inbox.empty()
+        assert first.flush(2) and first.stats()['published'] == 1
+    finally:
+        first.close()
+        second.close()
+
+def test_unix_hub_moves_to_another_worker_when_its_owner_stops(tmp_path):
+    (first, second), (_, second_inbox) = unix_pair(tmp_path)
+    first.close()
+    third = UnixSocketBackend(first.path, reconnect_delay=0.05)
+    try:
+        wait_until(lambda: second.hub is not None and second.connected())
+
+        third.start(lambda message: None)
+        wait_until(lambda: second.hub.client_count() == 2)
+        third.publish({'topic': 'c1', 'kind': 'event', 'type': 'delete', 'data': {'id': 2}})
+
+        assert second_inbox.get(timeout=2)['data'] == {'id': 2}
+    finally:
+        second.close()
+        third.close()
+
+def test_mongo_backend_skips_its_own_and_already_seen_messages():
+    collection = mongomock.MongoClient()['chat_app']['pubsub_events']
+    collection.insert_one({'kind': 'init'})
+    publisher, subscriber = MongoBackend(collection, node_id='a'), MongoBackend(collection, node_id='b')
+    publisher_inbox, subscriber_inbox = [], []
+    publisher._deliver, subscriber._deliver = publisher_inbox.append, subscriber_inbox.append
+    publisher.poll()
+    subscriber.poll()
+
+    publisher._send_batch([{'topic': 'c1', 'kind': 'event', 'type': 'message', 'data': {'id': 1}},
+                           {'topic': 'c1', 'kind': 'frame', 'payload': {'type': 'typing'}, 'exclude_user': 'u1'}])
+
+    assert subscriber.poll() == 2
+    assert subscriber_inbox == [
+        {'topic': 'c1', 'kind': 'event', 'type': 'message', 'data': {'id': 1}},
+        {'topic': 'c1', 'kind': 'frame', 'payload': {'type': 'typing'}, 'exclude_user': 'u1'}
+    ]
+    # Re-reading the overlap window does not deliver anything twice
+    assert subscriber.poll() == 0
+    assert publisher.poll() == 0 and publisher_inbox == []
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        create_backend('redis')
+
+def test_routes_publish_events_for_other_workers(db, client, monkeypatch):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    conversation_id = str(make_conversation(db, alice, bob))
+    backend = RecordingBackend()
+    monkeypatch.setattr(chat_app, 'pubsub_backend', backend)
+    login_as(client, alice, 'Alice', 'alice@example.com')
+
+    sent = client.post('/api/send_message', json={'conversation_id': conversation_id, 'content': 'hi'}).get_json()
+    client.post('/api/delete_message', json={'message_id': sent['message']['id']})
+
+    assert [(m['topic'], m['kind'], m.get('type')) for m in backend.messages] == [
+        (None, 'invalidate', None), (conversation_id, 'event', 'message'),
+        (None, 'invalidate', None), (conversation_id, 'event', 'delete')
+    ]
+    assert backend.messages[1]['data']['content'] == 'hi'
+    assert sorted(backend.messages[0]['users']) == sorted([str(alice), str(bob)])
+
+def test_events_from_other_workers_reach_local_streams(db):
+    subscription, _ = chat_app.broker.subscribe('c1')
+    try:
+        chat_app.deliver_remote({'topic': 'c1', 'kind': 'event', 'type': 'message', 'data': {'id': 'm1'}})
+
+        event = subscription.get(timeout=1)
+        assert (event.type, event.data) == ('message', {'id': 'm1'})
+    finally:
+        subscription.close()
@@ -0,0 +1,106 @@
+"""
+Tests for message search.
+"""
+
+from datetime import datetime, timedelta, timezone
+import io
+
+import search
+from conftest import login_as, make_conversation, make_user
+from migrations import migration_006_message_search, migration_008_file_search_terms
+
+
+def send(client, conversation_id, content):
+    return client.post('/api/send_message', json={'conversation_id': conversation_id, 'content': content})
+
+def setup_chat(db, client):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    conversation_id = str(make_conversation(db, alice, bob))
+    login_as(client, alice, 'Alice', 'alice@example.com')
+    return alice, bob, conversation_id
+
+def test_tokenize_normalizes_and_drops_stop_words():
+    assert search.tokenize('The Café is OPEN, see you at 9!') == ['cafe', 'open', 'see', 'you']
+
+def test_highlight_escapes_and_marks_matches():
+    snippet = search.highlight('<b>Lunch</b> at the café?', ['cafe'])
+    assert snippet == '&lt;b&gt;Lunch&lt;/b&gt; at the <mark>café</mark>?'
+
+def test_search_requires_every_term(db, client):
+    alice, bob, conversation_id = setup_chat(db, client)
+    send(client, conversation_id, 'Dinner at the new ramen place?')
+    send(client, conversation_id, 'Dinner sounds good')
+
+    results = client.get('/api/search?q=ramen dinner').get_json()['results']
+
+    assert [r['snippet'] for r in results] == ['<mark>Dinner</mark> at the new <mark>ramen</mark> place?']
+
+def test_search_is_scoped_to_the_callers_conversations(db, client):
+    alice, bob, conversation_id = setup_chat(db, client)
+    send(client, conversation_id, 'secret launch plan')
+    eve = make_user(db, 'Eve', 'eve@example.com')
+    make_conversation(db, eve, bob)
+
+    login_as(client, eve, 'Eve', 'eve@example.com')
+
+    assert client.get('/api/search?q=launch').get_json()['results'] == []
+    assert client.get(f'/api/search?q=launch&conversation_id={conversation_id}').status_code == 403
+
+def test_search_pages_newest_first(db, client):
+    alice, bob, conversation_id = setup_chat(db, client)
+    for i in range(5):
+        send(client, conversation_id, f'report draft {i}')
+
+    first = client.get('/api/search?q=report&limit=3').get_json()
+    second = client.get(f"/api/search?q=report&limit=3&before={first['next_cursor']}").get_json()
+
+    snippets = [r['snippet'] for r in first['results'] + second['results']]
+    assert [s.rsplit(' ', 1)[1] for s in snippets] == ['4', '3', '2', '1', '0']
+    assert second['has_more'] is False
+
+def test_files_are_found_by_their_uploaded_name(db, client, upload_folder):
+    alice, bob, conversation_id = setup_chat(db, client)
+    client.post('/api/upload_file', data={
+        'conversation_id': conversation_id,
+        'file': (io.BytesIO(b'%PDF-1.4 numbers'), 'quarterly-report.pdf')
+    }, content_type='multipart/form-data')
+
+    results = client.get('/api/search?q=quarterly').get_json()['results']
+
+    assert [r['snippet'] for r in results] == ['<mark>quarterly</mark>-report.pdf']
+    stored = db['messages'].find_one()
+    assert stored['file_name'].split('.')[0] not in stored['search_terms']
+
+def test_empty_query_is_rejected(db, client):
+    setup_chat(db, client)
+    assert client.get('/api/search?q=the').status_code == 400
+
+def test_migration_backfills_search_terms(db):
+    conversation_id = make_conversation(db, make_user(db, 'A', 'a@example.com'), make_user(db, 'B', 'b@example.com'))
+    db['messages'].insert_one({
+        'conversation_id': conversation_id,
+        'content': 'Old message about budgets',
+        'timestamp': datetime.now(timezone.utc) - timedelta(days=1),
+        'message_type': 'text'
+    })
+
+    migration_006_message_search(db)
+
+    assert db['messages'].find_one()['search_terms'] == ['old', 'message', 'about', 'budgets']
+
+def test_migration_reindexes_file_messages_by_uploaded_name(db):
+    conversation_id = make_conversation(db, make_user(db, 'A', 'a@example.com'), make_user(db, 'B', 'b@example.com'))
+    db['messages'].insert_one({
+        'conversation_id': conversation_id,
+        'content': 'Shared budget.xlsx',
+        'file_name': '2cf24dba5fb0a30e26e83b2ac5b9e29e1b161e5c1fa7425e73043362938b9824.xlsx',
+        'original_name': 'budget.xlsx',
+        'search_terms': ['shared', 'budget', 'xlsx', '2cf24dba5fb0a30e26e83b2ac5b9e29e1b161e5c1fa7425e73043362938b9824'],
+        'timestamp': datetime.now(timezone.utc),
+        'message_type': 'file'
+    })
+
+    migration_008_file_search_terms(db)
+
+    assert db['messages'].find_one()['search_terms'] == ['shared', 'budget', 'xlsx']
@@ -0,0 +1,80 @@
+"""
+Tests for the pub/sub broker and the Server-Sent Events stream.
+"""
+
+from conftest import chat_app, login_as, make_conversation, make_user
+from pubsub import InProcessBroker
+
+
+def test_broker_fans_out_to_topic_subscribers():
+    broker = InProcessBroker()
+    first, _ = broker.subscribe('a')
+    second, _ = broker.subscribe('a')
+    other, _ = broker.subscribe('b')
+
+    event = broker.publish('a', 'message', {'id': 1})
+
+    assert first.get(timeout=0) == event
+    assert second.get(timeout=0) == event
+    assert other.get(timeout=0) is None
+
+def test_broker_replays_missed_events_after_last_event_id():
+    broker = InProcessBroker()
+    seen = broker.publish('a', 'message', {'id': 1})
+    broker.publish('b', 'message', {'id': 2})
+    missed = broker.publish('a', 'message', {'id': 3})
+
+    _, replay = broker.subscribe('a', last_event_id=seen.id)
+
+    assert replay == [missed]
+
+def test_broker_requests_resync_when_history_was_evicted():
+    broker = InProcessBroker(history_size=2)
+    seen = broker.publish('a', 'message', {'id': 1})
+    for i in range(3):
+        broker.publish('a', 'message', {'id': i})
+
+    _, replay = broker.subscribe('a', last_event_id=seen.id)
+    _, foreign = broker.subscribe('a', last_event_id='123:1')
+
+    assert replay is None
+    assert foreign is None
+
+def test_slow_subscriber_is_flagged_as_overflowed():
+    broker = InProcessBroker(max_queue=1)
+    subscription, _ = broker.subscribe('a')
+
+    broker.publish('a', 'message', {})
+    broker.publish('a', 'message', {})
+
+    assert subscription.overflowed
+
+def test_send_message_is_delivered_on_stream(db, client):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    conversation_id = make_conversation(db, alice, bob)
+    login_as(client, alice, 'Alice', 'alice@example.com')
+
+    response = client.get(f'/api/stream/{conversation_id}')
+    stream = iter(response.response)
+    assert response.mimetype == 'text/event-stream'
+    assert next(stream).startswith(b'retry:')
+
+    client.post('/api/send_message', json={'conversation_id': str(conversation_id), 'content': 'Hello'})
+
+    chunk = next(stream).decode()
+    assert 'event: message' in chunk
+    assert '"content": "Hello"' in chunk
+    response.close()
+    assert chat_app.broker.subscriber_count(str(conversation_id)) == 0
+
+def test_stream_rejects_non_participants(db, client):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    carol = make_user(db, 'Carol', 'carol@example.com')
+    conversation_id = make_conversation(db, alice, bob)
+    login_as(client, carol, 'Carol', 'carol@example.com')
+
+    response = client.get(f'/api/stream/{conversation_id}')
+
+    assert response.status_code == 403
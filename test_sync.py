@@ -0,0 +1,86 @@
+"""
+Tests for the account-wide incremental sync endpoint.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+from conftest import chat_app, login_as, make_user
+
+
+def start_chat(client, db):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    carol = make_user(db, 'Carol', 'carol@example.com')
+    with_bob = chat_app.create_conversation(str(alice), str(bob))
+    with_carol = chat_app.create_conversation(str(alice), str(carol))
+    login_as(client, alice, 'Alice', 'alice@example.com')
+    return with_bob, with_carol
+
+def old_token():
+    return chat_app.encode_sync_token(datetime.now(timezone.utc) - timedelta(minutes=5))
+
+def test_sync_without_token_requests_reset(db, client):
+    start_chat(client, db)
+
+    data = client.get('/api/sync').get_json()
+
+    assert data['reset'] is True
+    assert chat_app.decode_sync_token(data['token'])
+
+def test_sync_returns_new_messages_and_deletions_across_conversations(db, client):
+    with_bob, with_carol = start_chat(client, db)
+    token = old_token()
+
+    first = client.post('/api/send_message', json={'conversation_id': with_bob, 'content': 'Hi Bob'}).get_json()
+    client.post('/api/send_message', json={'conversation_id': with_carol, 'content': 'Hi Carol'})
+    client.post('/api/delete_message', json={'message_id': first['message']['id']})
+
+    data = client.get('/api/sync', query_string={'since': token}).get_json()
+
+    assert data['reset'] is False
+    assert [msg['content'] for msg in data['messages']] == ['Hi Carol']
+    assert data['deleted'] == [{'id': first['message']['id'], 'conversation_id': with_bob}]
+    assert {conv['id'] for conv in data['conversations']} == {with_bob, with_carol}
+
+def test_sync_of_idle_account_is_one_query(db, client, command_counter):
+    start_chat(client, db)
+    token = client.get('/api/sync').get_json()['token']
+    db['conversations'].update_many({}, {'$set': {'updated_at': datetime.now(timezone.utc) - timedelta(hours=1)}})
+
+    command_counter.reset()
+    data = client.get('/api/sync', query_string={'since': token}).get_json()
+
+    assert data['messages'] == [] and data['conversations'] == []
+    assert command_counter.count == 1
+
+def test_sync_rejects_malformed_token(db, client):
+    start_chat(client, db)
+
+    response = client.get('/api/sync', query_string={'since': 'not-a-token'})
+
+    assert response.status_code == 400
+
+def test_sync_pages_through_messages_sharing_a_timestamp(db, client, monkeypatch):
+    with_bob, _ = start_chat(client, db)
+    token = old_token()
+    sent_at = datetime.now(timezone.utc).replace(microsecond=0)
+    alice = db['users'].find_one({'name': 'Alice'})['_id']
+    db['messages'].insert_many([{
+        'conversation_id': chat_app.ObjectId(with_bob),
+        'sender_id': alice,
+        'content': f'Batch {i}',
+        'timestamp': sent_at,
+        'message_type': 'text'
+    } for i in range(5)])
+    db['conversations'].update_one({'_id': chat_app.ObjectId(with_bob)}, {'$set': {'updated_at': sent_at}})
+    monkeypatch.setattr(chat_app, 'SYNC_MAX_MESSAGES', 2)
+
+    received = []
+    while True:
+        data = client.get('/api/sync', query_string={'since': token}).get_json()
+        received.extend(msg['content'] for msg in data['messages'])
+        token = data['token']
+        if not data['has_more']:
+            break
+
+    assert received == [f'Batch {i}' for i in range(5)]
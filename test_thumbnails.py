@@ -0,0 +1,67 @@
+"""
+Tests for thumbnail generation.
+"""
+
+import io
+
+import pytest
+
+import thumbnails
+from conftest import chat_app, login_as, make_conversation, make_user
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def png_bytes(size=(1200, 800), color=(200, 40, 90)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+def upload_photo(db, client, content):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    conversation_id = str(make_conversation(db, alice, bob))
+    login_as(client, alice, 'Alice', 'alice@example.com')
+    return client.post('/api/upload_file', data={
+        'conversation_id': conversation_id,
+        'file': (io.BytesIO(content), 'photo.png')
+    }, content_type='multipart/form-data').get_json()['message']
+
+def test_generate_thumbnail_fits_within_bounds(tmp_path):
+    source = tmp_path / 'photo.png'
+    source.write_bytes(png_bytes())
+
+    target = thumbnails.generate_thumbnail(str(source))
+
+    with Image.open(target) as thumbnail:
+        assert thumbnail.size[0] <= thumbnails.THUMBNAIL_SIZE[0]
+        assert thumbnail.size[1] <= thumbnails.THUMBNAIL_SIZE[1]
+        assert thumbnail.format == thumbnails.THUMBNAIL_FORMAT
+
+def test_upload_exposes_thumbnail_path(db, client, upload_folder):
+    message = upload_photo(db, client, png_bytes())
+
+    assert message['thumbnail_path'] == f"images/{message['file_name']}{thumbnails.THUMBNAIL_SUFFIX}"
+    media = client.get(f"/api/get_media/{db['conversations'].find_one()['_id']}").get_json()['media']
+    assert media[0]['thumbnail_path'] == message['thumbnail_path']
+
+def test_missing_thumbnail_is_generated_on_first_request(db, client, upload_folder):
+    message = upload_photo(db, client, png_bytes())
+    thumbnail_file = upload_folder / message['thumbnail_path']
+    # Run the background job, then drop its output
+    chat_app.job_queue.run_pending()
+    thumbnails.remove_thumbnail(str(upload_folder / 'images' / message['file_name']))
+
+    response = client.get(f"/uploads/{message['thumbnail_path']}")
+
+    assert response.status_code == 200
+    assert thumbnail_file.exists()
+    assert response.headers['ETag'] != client.get(f"/uploads/{message['file_name']}").headers['ETag']
+
+def test_deleting_last_reference_removes_thumbnail(db, client, upload_folder):
+    message = upload_photo(db, client, png_bytes())
+    client.get(f"/uploads/{message['thumbnail_path']}")
+
+    client.post('/api/delete_message', json={'message_id': message['id']})
+
+    assert not (upload_folder / message['thumbnail_path']).exists()
@@ -0,0 +1,76 @@
+"""
+Tests for unread counters.
+"""
+
+from conftest import login_as, make_conversation, make_user
+
+
+def setup_chat(db):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    return alice, bob, str(make_conversation(db, alice, bob))
+
+def send(client, conversation_id, content):
+    return client.post('/api/send_message', json={'conversation_id': conversation_id, 'content': content})
+
+def test_sending_increments_only_the_recipients_counter(db, client):
+    alice, bob, conversation_id = setup_chat(db)
+    login_as(client, alice, 'Alice', 'alice@example.com')
+
+    send(client, conversation_id, 'one')
+    send(client, conversation_id, 'two')
+
+    unread = db['conversations'].find_one()['unread_count']
+    assert unread == {str(alice): 0, str(bob): 2}
+
+def test_mark_read_resets_the_counter(db, client):
+    alice, bob, conversation_id = setup_chat(db)
+    login_as(client, alice, 'Alice', 'alice@example.com')
+    send(client, conversation_id, 'hello')
+
+    login_as(client, bob, 'Bob', 'bob@example.com')
+    assert client.get('/api/unread_total').get_json()['unread_total'] == 1
+
+    response = client.post('/api/mark_read', json={'conversation_id': conversation_id})
+
+    assert response.get_json() == {'success': True, 'unread_total': 0}
+    assert db['conversations'].find_one()['unread_count'][str(bob)] == 0
+
+def test_unread_total_sums_across_conversations(db, client):
+    alice, bob, first = setup_chat(db)
+    carol = make_user(db, 'Carol', 'carol@example.com')
+    second = str(make_conversation(db, carol, bob))
+
+    login_as(client, alice, 'Alice', 'alice@example.com')
+    send(client, first, 'hi')
+    login_as(client, carol, 'Carol', 'carol@example.com')
+    send(client, second, 'hey')
+    send(client, second, 'you there?')
+
+    login_as(client, bob, 'Bob', 'bob@example.com')
+    assert client.get('/api/unread_total').get_json()['unread_total'] == 3
+    conversations = client.get('/api/conversations').get_json()['conversations']
+    assert sorted(c['unread_count'] for c in conversations) == [1, 2]
+
+def test_mark_read_requires_membership(db, client):
+    alice, bob, conversation_id = setup_chat(db)
+    eve = make_user(db, 'Eve', 'eve@example.com')
+    login_as(client, eve, 'Eve', 'eve@example.com')
+
+    assert client.post('/api/mark_read', json={'conversation_id': conversation_id}).status_code == 403
+
+def test_polling_the_unread_total_is_served_from_cache(db, client, command_counter):
+    alice, bob, conversation_id = setup_chat(db)
+    login_as(client, alice, 'Alice', 'alice@example.com')
+    send(client, conversation_id, 'hello')
+    login_as(client, bob, 'Bob', 'bob@example.com')
+    client.get('/api/unread_total')
+
+    command_counter.reset()
+    totals = [client.get('/api/unread_total').get_json()['unread_total'] for _ in range(3)]
+
+    assert totals == [1, 1, 1] and command_counter.count == 0
+    login_as(client, alice, 'Alice', 'alice@example.com')
+    send(client, conversation_id, 'again')
+    login_as(client, bob, 'Bob', 'bob@example.com')
+    assert client.get('/api/unread_total').get_json()['unread_total'] == 2
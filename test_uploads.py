@@ -0,0 +1,206 @@
+"""
+Tests for file uploads, including the resumable chunked protocol.
+"""
+
+import hashlib
+import io
+import os
+import threading
+import time
+
+import chunked_uploads
+from conftest import chat_app, login_as, make_conversation, make_user
+
+
+def setup_chat(db, client):
+    alice = make_user(db, 'Alice', 'alice@example.com')
+    bob = make_user(db, 'Bob', 'bob@example.com')
+    conversation_id = str(make_conversation(db, alice, bob))
+    login_as(client, alice, 'Alice', 'alice@example.com')
+    return conversation_id
+
+def start_upload(client, conversation_id, payload, filename='report.pdf', kind='file'):
+    return client.post('/api/uploads', json={
+        'conversation_id': conversation_id,
+        'filename': filename,
+        'size': len(payload),
+        'kind': kind
+    }).get_json()
+
+def put_chunk(client, upload_id, offset, chunk):
+    return client.put(f'/api/uploads/{upload_id}', data=chunk,
+                      headers={'Upload-Offset': str(offset), 'Content-Type': 'application/octet-stream'})
+
+def test_upload_file_creates_file_message(db, client, upload_folder):
+    conversation_id = setup_chat(db, client)
+
+    response = client.post('/api/upload_file', data={
+        'conversation_id': conversation_id,
+        'file': (io.BytesIO(b'%PDF-1.4 test'), 'report.pdf')
+    }, content_type='multipart/form-data')
+    data = response.get_json()
+
+    assert data['success']
+    assert data['message']['content'] == 'Shared report.pdf'
+    assert (upload_folder / 'documents' / data['message']['file_name']).read_bytes() == b'%PDF-1.4 test'
+
+def test_chunked_upload_creates_the_same_message(db, client, upload_folder):
+    conversation_id = setup_chat(db, client)
+    payload = b'0123456789' * 1000
+
+    upload = start_upload(client, conversation_id, payload)
+    offset = 0
+    for start in range(0, len(payload), 4096):
+        data = put_chunk(client, upload['upload_id'], offset, payload[start:start + 4096]).get_json()
+        offset = data['offset']
+    data = client.post(f"/api/uploads/{upload['upload_id']}/complete").get_json()
+
+    assert data['success']
+    assert data['message']['content'] == 'Shared report.pdf'
+    assert data['message']['file_size'] == len(payload)
+    stored = db['messages'].find_one()
+    assert stored['file_path'] == f"documents/{data['message']['file_name']}"
+    assert (upload_folder / stored['file_path']).read_bytes() == payload
+    assert db['conversations'].find_one()['last_message'] == '📎 report.pdf'
+
+def test_chunked_upload_resumes_from_acknowledged_offset(db, client, upload_folder):
+    conversation_id = setup_chat(db, client)
+    payload = bytes(range(256)) * 40
+
+    upload = start_upload(client, conversation_id, payload, filename='clip.mp3', kind='voice')
+    put_chunk(client, upload['upload_id'], 0, payload[:5000])
+    # Simulate a worker restart losing the in-memory digest
+    chunked_uploads.discard_state(upload['upload_id'])
+
+    stale = put_chunk(client, upload['upload_id'], 0, payload[:5000])
+    status = client.get(f"/api/uploads/{upload['upload_id']}").get_json()
+    put_chunk(client, upload['upload_id'], status['offset'], payload[status['offset']:])
+    data = client.post(f"/api/uploads/{upload['upload_id']}/complete").get_json()
+
+    assert stale.status_code == 409 and stale.get_json()['offset'] == 5000
+    assert data['message']['message_type'] == 'audio'
+    assert data['message']['content'] == '🎵 Voice message'
+    stored = db['messages'].find_one()
+    assert (upload_folder / stored['file_path']).read_bytes() == payload
+
+def test_chunked_upload_hashes_while_writing(db, client, upload_folder):
+    conversation_id = setup_chat(db, client)
+    payload = b'hash me please'
+
+    upload = start_upload(client, conversation_id, payload)
+    put_chunk(client, upload['upload_id'], 0, payload[:4])
+    put_chunk(client, upload['upload_id'], 4, payload[4:])
+    client.post(f"/api/uploads/{upload['upload_id']}/complete")
+
+    assert db['messages'].find_one()['sha256'] == hashlib.sha256(payload).hexdigest()
+    assert db['upload_sessions'].find_one({'_id': upload['upload_id']})['status'] == 'complete'
+
+def test_rejected_chunk_does_not_leak_into_the_digest(db, client, upload_folder):
+    conversation_id = setup_chat(db, client)
+    payload = bytes(range(256)) * 400
+
+    upload = start_upload(client, conversation_id, payload)
+    put_chunk(client, upload['upload_id'], 0, payload[:10000])
+    # Larger than the rest of the upload, rejected after its first blocks were read
+    rejected = put_chunk(client, upload['upload_id'], 10000, b'x' * len(payload))
+    put_chunk(client, upload['upload_id'], 10000, payload[10000:])
+    client.post(f"/api/uploads/{upload['upload_id']}/complete")
+
+    assert rejected.status_code == 400
+    stored = db['messages'].find_one()
+    assert stored['sha256'] == hashlib.sha256(payload).hexdigest()
+    assert (upload_folder / stored['file_path']).read_bytes() == payload
+
+def test_complete_rejects_incomplete_upload(db, client, upload_folder):
+    conversation_id = setup_chat(db, client)
+    payload = b'x' * 100
+
+    upload = start_upload(client, conversation_id, payload)
+    put_chunk(client, upload['upload_id'], 0, payload[:50])
+    response = client.post(f"/api/uploads/{upload['upload_id']}/complete")
+
+    assert response.status_code == 409
+    assert response.get_json()['offset'] == 50
+
+def test_init_upload_rejects_disallowed_extension(db, client, upload_folder):
+    conversation_id = setup_chat(db, client)
+
+    data = start_upload(client, conversation_id, b'MZ', filename='tool.exe')
+
+    assert data['success'] is False
+
+def upload_multipart(client, conversation_id, content, filename='meme.png'):
+    return client.post('/api/upload_file', data={
+        'conversation_id': conversation_id,
+        'file': (io.BytesIO(content), filename)
+    }, content_type='multipart/form-data').get_json()
+
+def test_identical_uploads_share_one_blob(db, client, upload_folder):
+    conversation_id = setup_chat(db, client)
+    content = b'\x89PNG same meme'
+
+    first = upload_multipart(client, conversation_id, content)
+    second = upload_multipart(client, conversation_id, content, filename='forwarded.png')
+
+    assert first['message']['file_name'] == second['message']['file_name']
+    assert len(list((upload_folder / 'images').iterdir())) == 1
+    assert db['blobs'].find_one()['ref_count'] == 2
+
+def test_deleting_messages_unlinks_blob_at_zero_references(db, client, upload_folder):
+    conversation_id = setup_chat(db, client)
+    content = b'\x89PNG shared twice'
+    first = upload_multipart(client, conversation_id, content)
+    second = upload_multipart(client, conversation_id, content)
+    stored = upload_folder / 'images' / first['message']['file_name']
+
+    client.post('/api/delete_message', json={'message_id': first['message']['id']})
+    assert stored.exists()
+    assert db['blobs'].find_one()['ref_count'] == 1
+
+    client.post('/api/delete_message', json={'message_id': second['message']['id']})
+    assert not stored.exists()
+    assert db['blobs'].count_documents({}) == 0
+
+def test_upload_during_a_blob_delete_stores_the_file_again(db, client, upload_folder, monkeypatch):
+    conversation_id = setup_chat(db, client)
+    content = b'\x89PNG deleted and re-sent'
+    first = upload_multipart(client, conversation_id, content)
+    stored = upload_folder / 'images' / first['message']['file_name']
+    remove = os.remove
+    uploads, uploaders = [], []
+
+    def write_content(temp_path):
+        with open(temp_path, 'wb') as f:
+            f.write(content)
+
+    def upload_while_deleting(path):
+        # The last reference is gone and the file is about to be removed
+        if path == str(stored) and not uploaders:
+            uploaders.append(threading.Thread(target=lambda: uploads.append(
+                chat_app.acquire_blob(stored.stem, 'png', 'images', len(content), write_content)
+            )))
+            uploaders[0].start()
+            time.sleep(0.1)
+        remove(path)
+
+    monkeypatch.setattr(os, 'remove', upload_while_deleting)
+    client.post('/api/delete_message', json={'message_id': first['message']['id']})
+    uploaders[0].join(2)
+
+    assert uploads == [stored.name]
+    assert stored.read_bytes() == content
+    blob = db['blobs'].find_one()
+    assert blob['ref_count'] == 1 and 'deleting' not in blob
+
+def test_chunked_upload_of_known_content_reuses_blob(db, client, upload_folder):
+    conversation_id = setup_chat(db, client)
+    payload = b'%PDF-1.4 quarterly numbers'
+    existing = upload_multipart(client, conversation_id, payload, filename='report.pdf')
+
+    upload = start_upload(client, conversation_id, payload)
+    put_chunk(client, upload['upload_id'], 0, payload)
+    data = client.post(f"/api/uploads/{upload['upload_id']}/complete").get_json()
+
+    assert data['message']['file_name'] == existing['message']['file_name']
+    assert len(list((upload_folder / 'documents').iterdir())) == 1
+    assert list((upload_folder / 'partial').iterdir()) == []
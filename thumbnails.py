@@ -0,0 +1,110 @@
+"""
+Thumbnail, preview and media probing for shared media.
+Thumbnails are written next to the original upload by the background job
+queue, so uploads never wait for them. Image thumbnails need Pillow; PDF
+first-page previews additionally need PyMuPDF. Without them thumbnails
+are skipped.
+"""
+
+import mimetypes
+import os
+import uuid
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
+
+THUMBNAIL_SIZE = (320, 320)
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_FORMAT = 'WEBP' if Image is not None and features.check('webp') else 'JPEG'
+THUMBNAIL_SUFFIX = '.thumb.webp' if THUMBNAIL_FORMAT == 'WEBP' else '.thumb.jpg'
+IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp'}
+
+def _extension(filename):
+    return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+
+def can_thumbnail(filename):
+    """Whether a thumbnail can be produced for this file with the installed libraries"""
+    if Image is None:
+        return False
+    ext = _extension(filename)
+    return ext in IMAGE_EXTENSIONS or (ext == 'pdf' and fitz is not None)
+
+def thumbnail_name(filename):
+    return f"{filename}{THUMBNAIL_SUFFIX}"
+
+def source_name(thumbnail_filename):
+    """Original filename for a thumbnail filename"""
+    return thumbnail_filename[:-len(THUMBNAIL_SUFFIX)]
+
+def is_thumbnail(filename):
+    return filename.endswith(THUMBNAIL_SUFFIX)
+
+def thumbnail_path_for(source_path):
+    directory, filename = os.path.split(source_path)
+    return os.path.join(directory, thumbnail_name(filename))
+
+def _open_source(source_path):
+    if _extension(source_path) == 'pdf':
+        with fitz.open(source_path) as document:
+            page = document.load_page(0)
+            # Render at roughly twice the thumbnail size, then downscale
+            zoom = 2 * max(THUMBNAIL_SIZE) / max(page.rect.width, page.rect.height)
+            pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+            return Image.frombytes('RGB', (pixmap.width, pixmap.height), pixmap.samples)
+
+    image = Image.open(source_path)
+    # Respect camera orientation and use the first frame of animations
+    image.seek(0)
+    return ImageOps.exif_transpose(image)
+
+def generate_thumbnail(source_path):
+    """Write the thumbnail for source_path if it is missing and return its path"""
+    target_path = thumbnail_path_for(source_path)
+    if os.path.exists(target_path):
+        return target_path
+
+    if not can_thumbnail(source_path) or not os.path.exists(source_path):
+        return None
+
+    image = _open_source(source_path)
+    image.thumbnail(THUMBNAIL_SIZE)
+    if image.mode not in ('RGB', 'RGBA') or (THUMBNAIL_FORMAT == 'JPEG' and image.mode == 'RGBA'):
+        image = image.convert('RGB')
+
+    # Write under a temporary name so readers never see a partial thumbnail
+    temp_path = f"{target_path}.{uuid.uuid4().hex}.tmp"
+    image.save(temp_path, THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY)
+    os.replace(temp_path, target_path)
+    return target_path
+
+def probe_media(source_path):
+    """Detect the MIME type and, for images, the dimensions of an upload"""
+    if not os.path.exists(source_path):
+        return {}
+
+    mime_type, _ = mimetypes.guess_type(source_path)
+    info = {'mime_type': mime_type}
+    if Image is not None and _extension(source_path) in IMAGE_EXTENSIONS:
+        try:
+            # Only the header is read here, not the pixel data
+            with Image.open(source_path) as image:
+                info.update({
+                    'mime_type': Image.MIME.get(image.format, mime_type),
+                    'width': image.width,
+                    'height': image.height
+                })
+        except Exception:
+            pass
+    return info
+
+def remove_thumbnail(source_path):
+    target_path = thumbnail_path_for(source_path)
+    if os.path.exists(target_path):
+        os.remove(target_path)
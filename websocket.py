@@ -0,0 +1,327 @@
+"""
+Minimal server-side WebSocket (RFC 6455) support for the ChatFlow application.
+The handshake is answered on the raw client socket that the WSGI server
+exposes (werkzeug's development server and gunicorn both do), after which
+the request thread owns the connection. Only what the chat gateway needs is
+implemented: text and binary messages, fragmentation, ping/pong and close.
+"""
+
+import base64
+import hashlib
+import select
+import socket
+import struct
+import threading
+import time
+
+from werkzeug.wrappers import Response
+
+GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+CLOSE_NORMAL = 1000
+CLOSE_GOING_AWAY = 1001
+CLOSE_PROTOCOL_ERROR = 1002
+CLOSE_POLICY_VIOLATION = 1008
+CLOSE_TOO_BIG = 1009
+CLOSE_TRY_AGAIN_LATER = 1013
+
+DEFAULT_MAX_MESSAGE_SIZE = 64 * 1024
+RECV_SIZE = 16 * 1024
+
+class ProtocolError(Exception):
+    """The peer broke the WebSocket protocol"""
+
+    def __init__(self, message, code=CLOSE_PROTOCOL_ERROR):
+        super().__init__(message)
+        self.code = code
+
+class ConnectionClosed(Exception):
+    """The connection has been closed"""
+
+    def __init__(self, code=CLOSE_NORMAL, reason=''):
+        super().__init__(f"WebSocket closed ({code}) {reason}".strip())
+        self.code = code
+        self.reason = reason
+
+def accept_key(key):
+    """Sec-WebSocket-Accept value for a client's Sec-WebSocket-Key"""
+    digest = hashlib.sha1((key + GUID).encode('ascii')).digest()
+    return base64.b64encode(digest).decode('ascii')
+
+def is_upgrade_request(environ):
+    connection = environ.get('HTTP_CONNECTION', '').lower()
+    return (environ.get('HTTP_UPGRADE', '').lower() == 'websocket'
+            and 'upgrade' in [token.strip() for token in connection.split(',')])
+
+def raw_socket(environ):
+    """The client socket behind a WSGI request, if the server exposes it"""
+    return environ.get('werkzeug.socket') or environ.get('gunicorn.socket')
+
+def encode_frame(opcode, payload=b'', fin=True):
+    """Encode a single unmasked (server-to-client) frame.
+
+    Frames are plain bytes, so one encoded frame can be sent to any number of
+    connections.
+    """
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    first = (0x80 if fin else 0) | opcode
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', first, length)
+    elif length < 1 << 16:
+        header = struct.pack('!BBH', first, 126, length)
+    else:
+        header = struct.pack('!BBQ', first, 127, length)
+    return header + payload
+
+def decode_frame(frame):
+    """(opcode, payload) of a single unmasked frame made by encode_frame"""
+    length = frame[1] & 0x7F
+    offset = 2 if length < 126 else 4 if length == 126 else 10
+    return frame[0] & 0x0F, frame[offset:]
+
+def close_payload(code, reason=''):
+    return struct.pack('!H', code) + reason.encode('utf-8')[:123]
+
+def _unmask(payload, mask):
+    # XOR the whole payload at once through big integers; much faster than a byte loop
+    length = len(payload)
+    if not length:
+        return b''
+    repeated = (mask * (length // 4 + 1))[:length]
+    return (int.from_bytes(payload, 'big') ^ int.from_bytes(repeated, 'big')).to_bytes(length, 'big')
+
+def _wait_readable(sock, timeout):
+    # poll() has no FD_SETSIZE limit, which matters with thousands of connections
+    if hasattr(select, 'poll'):
+        poller = select.poll()
+        poller.register(sock, select.POLLIN)
+        return bool(poller.poll(None if timeout is None else timeout * 1000))
+    readable, _, _ = select.select([sock], [], [], timeout)
+    return bool(readable)
+
+class WebSocket:
+    """One server-side WebSocket connection.
+
+    receive() is meant for a single reader thread; send_frame() may be called
+    from any thread.
+    """
+
+    def __init__(self, sock, max_message_size=DEFAULT_MAX_MESSAGE_SIZE, clock=time.monotonic):
+        self.sock = sock
+        self.max_message_size = max_message_size
+        self.clock = clock
+        self.closed = False
+        self.close_code = None
+        self.last_received = clock()
+        self._buffer = bytearray()
+        self._fragments = []
+        self._fragment_opcode = None
+        self._send_lock = threading.Lock()
+
+    @classmethod
+    def accept(cls, environ, **kwargs):
+        """Complete the opening handshake for a WSGI upgrade request"""
+        if environ.get('REQUEST_METHOD') != 'GET' or not is_upgrade_request(environ):
+            raise ProtocolError("Not a WebSocket upgrade request")
+        if environ.get('HTTP_SEC_WEBSOCKET_VERSION') != '13':
+            raise ProtocolError("Unsupported WebSocket version")
+        key = environ.get('HTTP_SEC_WEBSOCKET_KEY', '')
+        try:
+            if len(base64.b64decode(key, validate=True)) != 16:
+                raise ValueError(key)
+        except ValueError:
+            raise ProtocolError("Invalid Sec-WebSocket-Key")
+        sock = raw_socket(environ)
+        if sock is None:
+            raise ProtocolError("The WSGI server does not expose the client socket")
+
+        sock.settimeout(None)
+        sock.sendall((
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept_key(key)}\r\n\r\n"
+        ).encode('ascii'))
+        return cls(sock, **kwargs)
+
+    def receive(self, timeout=None):
+        """Next text (str) or binary (bytes) message, or None after timeout seconds.
+
+        Pings are answered automatically. Raises ConnectionClosed once the
+        peer closes or the socket fails.
+        """
+        deadline = None if timeout is None else self.clock() + timeout
+        while True:
+            frame = self._parse_frame()
+            if frame is None:
+                remaining = None if deadline is None else max(0.0, deadline - self.clock())
+                if not self._fill(remaining):
+                    return None
+                continue
+            message = self._handle_frame(*frame)
+            if message is not None:
+                return message
+
+    def send(self, message):
+        opcode = OP_BINARY if isinstance(message, (bytes, bytearray)) else OP_TEXT
+        self.send_frame(encode_frame(opcode, message))
+
+    def send_frame(self, frame):
+        """Write an already encoded frame"""
+        if self.closed:
+            raise ConnectionClosed(self.close_code or CLOSE_GOING_AWAY)
+        try:
+            with self._send_lock:
+                self.sock.sendall(frame)
+        except OSError:
+            self._abort(CLOSE_GOING_AWAY)
+            raise ConnectionClosed(CLOSE_GOING_AWAY)
+
+    def ping(self, payload=b''):
+        self.send_frame(encode_frame(OP_PING, payload))
+
+    def close(self, code=CLOSE_NORMAL, reason='', timeout=1.0):
+        """Send a close frame (best effort) and shut the socket down"""
+        if self.closed:
+            return
+        # A writer stuck on a slow peer holds the lock; then just drop the connection
+        if self._send_lock.acquire(timeout=timeout):
+            try:
+                self.sock.settimeout(timeout or 0.001)
+                self.sock.sendall(encode_frame(OP_CLOSE, close_payload(code, reason)))
+            except OSError:
+                pass
+            finally:
+                self._send_lock.release()
+        self._abort(code)
+
+    def _abort(self, code):
+        if self.closed:
+            return
+        self.closed = True
+        self.close_code = code
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _fill(self, timeout):
+        """Read more bytes into the buffer; False if nothing arrived in time"""
+        if self.closed:
+            raise ConnectionClosed(self.close_code or CLOSE_GOING_AWAY)
+        try:
+            if not _wait_readable(self.sock, timeout):
+                return False
+            data = self.sock.recv(RECV_SIZE)
+        except (OSError, ValueError):
+            self._abort(CLOSE_GOING_AWAY)
+            raise ConnectionClosed(CLOSE_GOING_AWAY)
+        if not data:
+            self._abort(CLOSE_GOING_AWAY)
+            raise ConnectionClosed(CLOSE_GOING_AWAY, 'connection lost')
+        self._buffer += data
+        self.last_received = self.clock()
+        return True
+
+    def _parse_frame(self):
+        """Take one complete frame off the buffer, or None if it is incomplete"""
+        buffer = self._buffer
+        if len(buffer) < 2:
+            return None
+        first, second = buffer[0], buffer[1]
+        if first & 0x70:
+            self._fail(ProtocolError("Reserved bits set"))
+        if not second & 0x80:
+            self._fail(ProtocolError("Client frames must be masked"))
+
+        length = second & 0x7F
+        offset = 2
+        if length == 126:
+            if len(buffer) < 4:
+                return None
+            length = struct.unpack_from('!H', buffer, 2)[0]
+            offset = 4
+        elif length == 127:
+            if len(buffer) < 10:
+                return None
+            length = struct.unpack_from('!Q', buffer, 2)[0]
+            offset = 10
+        if length > self.max_message_size:
+            self._fail(ProtocolError("Frame too large", CLOSE_TOO_BIG))
+        if len(buffer) < offset + 4 + length:
+            return None
+
+        mask = bytes(buffer[offset:offset + 4])
+        payload = _unmask(bytes(buffer[offset + 4:offset + 4 + length]), mask)
+        del buffer[:offset + 4 + length]
+        return bool(first & 0x80), first & 0x0F, payload
+
+    def _handle_frame(self, fin, opcode, payload):
+        if opcode >= OP_CLOSE:
+            if not fin or len(payload) > 125:
+                self._fail(ProtocolError("Invalid control frame"))
+            if opcode == OP_PING:
+                self.send_frame(encode_frame(OP_PONG, payload))
+            elif opcode == OP_CLOSE:
+                code = struct.unpack('!H', payload[:2])[0] if len(payload) >= 2 else CLOSE_NORMAL
+                reason = payload[2:].decode('utf-8', 'replace')
+                self.close(code if code < 5000 else CLOSE_PROTOCOL_ERROR)
+                raise ConnectionClosed(code, reason)
+            elif opcode != OP_PONG:
+                self._fail(ProtocolError("Unknown control opcode"))
+            return None
+
+        if opcode == OP_CONTINUATION:
+            if self._fragment_opcode is None:
+                self._fail(ProtocolError("Unexpected continuation frame"))
+        elif opcode in (OP_TEXT, OP_BINARY):
+            if self._fragment_opcode is not None:
+                self._fail(ProtocolError("Expected a continuation frame"))
+            self._fragment_opcode = opcode
+        else:
+            self._fail(ProtocolError("Unknown data opcode"))
+
+        self._fragments.append(payload)
+        if sum(len(fragment) for fragment in self._fragments) > self.max_message_size:
+            self._fail(ProtocolError("Message too large", CLOSE_TOO_BIG))
+        if not fin:
+            return None
+
+        message_opcode, data = self._fragment_opcode, b''.join(self._fragments)
+        self._fragments = []
+        self._fragment_opcode = None
+        if message_opcode == OP_BINARY:
+            return data
+        try:
+            return data.decode('utf-8')
+        except UnicodeDecodeError:
+            self._fail(ProtocolError("Invalid UTF-8 in text message", 1007))
+
+    def _fail(self, error):
+        self.close(error.code, str(error))
+        raise ConnectionClosed(error.code, str(error))
+
+class UpgradedResponse(Response):
+    """Response for a request whose socket was taken over by a WebSocket.
+
+    Nothing may be written once the connection is closed, so instead of a
+    body this raises whatever the WSGI server treats as "already handled":
+    werkzeug's server drops the connection on ConnectionError and gunicorn's
+    workers stop on StopIteration.
+    """
+
+    def __call__(self, environ, start_response):
+        if 'werkzeug.socket' in environ:
+            raise ConnectionError("WebSocket closed")
+        if 'gunicorn.socket' in environ:
+            raise StopIteration()
+        return super().__call__(environ, start_response)